@@ -1,5 +1,8 @@
 """Support to control a Zehnder ComfoAir Q350/450/600 ventilation unit."""
+import asyncio
 import logging
+import time
+from datetime import timedelta
 
 #from pycomfoconnect import Bridge, ComfoConnect
 import voluptuous as vol
@@ -9,13 +12,42 @@ from homeassistant.const import (
     CONF_HOST,
     CONF_NAME,
     CONF_PORT,
+    EVENT_HOMEASSISTANT_FINAL_WRITE,
     EVENT_HOMEASSISTANT_STOP,
+    WEEKDAYS,
 )
-from homeassistant.helpers import discovery
+from homeassistant.components import websocket_api
+from homeassistant.config_entries import ConfigEntry, SOURCE_IMPORT
+from homeassistant.core import callback, SupportsResponse
+from homeassistant.exceptions import HomeAssistantError, ServiceValidationError
+from homeassistant.helpers.event import async_track_state_change_event, async_track_time_interval, async_call_later
+from homeassistant.helpers.storage import Store
 import homeassistant.helpers.config_validation as cv
 from homeassistant.helpers.dispatcher import *
-from .izzi.controller import IzziEthBridge, IzziSerialBridge, IzziController
-from .izzi.const import IZZY_SENSOR_EXTRACT_CORRECTION_STATE_ID
+import homeassistant.util.dt as dt_util
+from homeassistant.util.async_ import run_callback_threadsafe
+from .izzi.controller import IzziEthBridge, IzziSerialBridge, IzziController, CfPiController
+from .izzi.const import (
+    IZZY_SENSOR_EXTRACT_CORRECTION_STATE_ID,
+    IZZY_SENSOR_FAN_SUPPLY_SPEED_ID,
+    IZZY_SENSOR_FAN_EXTRACT_SPEED_ID,
+    IZZY_SENSOR_UNIT_STATE_ID,
+    IZZY_SENSOR_BYPASS_MODE_ID,
+    IZZY_SENSOR_BYPASS_TEMP_ID,
+    IZZY_SENSOR_FAN_MODE_ID,
+    IZZY_CMD_UNIT_STATE_ON,
+    IZZY_CMD_UNIT_STATE_OFF,
+    IZZY_SENSOR_KEYS,
+)
+from .izzi.state import PublishPolicy
+from .izzi.history import HISTORY_RESOLUTIONS, IzziHistory
+from .izzi.capture import CaptureWriter
+from .izzi.cfinput import CfSocketSource, CF_CHANNEL_SUPPLY, CF_CHANNEL_EXTRACT
+from .izzi.schedule import IzziSchedule
+from .izzi.fanout import FrameFanout
+from .izzi.worker import IzziProcessController
+from .izzi.metrics import ControllerMetrics, MetricsServer
+from .izzi.stream import FrameBatcher
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -24,6 +56,42 @@ CONF_CORRECTION = "extract_correction"
 CONF_BYPASS_MODE = "bypass_mode"
 CONF_BYPASS_TEMP = "bypass_temp"
 CONF_CF_PARAMS_MAX = "cf_params_max"
+CONF_CF_SHADOW = "cf_shadow"
+CONF_CF_SUPPLY_SENSOR = "cf_supply_sensor"
+CONF_CF_EXTRACT_SENSOR = "cf_extract_sensor"
+CONF_CF_UDP_PORT = "cf_udp_port"
+CONF_CF_SOCKET = "cf_socket"
+CONF_AIRFLOW_CURVE = "airflow_curve"
+CONF_ENERGY_INTERVAL = "energy_interval"
+CONF_PUBLISH_POLICIES = "publish_policies"
+CONF_OVERSAMPLE_WINDOW = "oversample_window"
+CONF_OVERSAMPLE_INTERVAL = "oversample_interval"
+CONF_HISTORY = "history"
+CONF_HISTORY_RAW_POINTS = "history_raw_points"
+CONF_CAPTURE_DIR = "capture_dir"
+CONF_FANOUT_PORT = "fanout_port"
+CONF_FANOUT_BUFFER = "fanout_buffer"
+CONF_FANOUT_HOST = "fanout_host"
+CONF_PROCESS = "process"
+CONF_METRICS_PORT = "metrics_port"
+CONF_METRICS_HOST = "metrics_host"
+CONF_STREAM_INTERVAL = "stream_interval"
+CONF_FILTER_LOAD = "filter_load"
+CONF_FILTER_REPLACE_RESIDUAL = "filter_replace_residual"
+CONF_FILTER_HALF_LIFE = "filter_half_life"
+CONF_PRESETS = "presets"
+CONF_PRESET_SPEED = "speed"
+CONF_PRESET_SUPPLY = "supply"
+CONF_PRESET_EXTRACT = "extract"
+CONF_VENT_MODE = "vent_mode"
+CONF_SCHEDULE = "schedule"
+CONF_SCHEDULE_DAYS = "days"
+CONF_SCHEDULE_AT = "at"
+CONF_SCHEDULE_PRESET = "preset"
+CONF_DEADBAND = "deadband"
+CONF_HYSTERESIS = "hysteresis"
+CONF_MIN_INTERVAL = "min_interval"
+CONF_MAX_INTERVAL = "max_interval"
 
 DOMAIN = "izzifast"
 
@@ -35,6 +103,17 @@ DEFAULT_CORRECTION = 0.0
 DEFAULT_BYPASS_TEMP = 23
 DEFAULT_BYPASS_MODE = "auto"
 DEFAULT_CF_PARAMS_MAX = 0.0
+DEFAULT_CF_SHADOW = "none"
+DEFAULT_ENERGY_INTERVAL = 60
+DEFAULT_OVERSAMPLE_WINDOW = 0
+DEFAULT_OVERSAMPLE_INTERVAL = 60
+DEFAULT_HISTORY_RAW_POINTS = 3600
+DEFAULT_FILTER_REPLACE_RESIDUAL = 25.0
+DEFAULT_FILTER_HALF_LIFE = 30
+DEFAULT_FANOUT_BUFFER = 64
+# Raw bus frames and metrics are served without authentication
+DEFAULT_LISTEN_HOST = "127.0.0.1"
+DEFAULT_STREAM_INTERVAL = 1.0
 
 CONF_TYPE_SERIAL = "serial"
 CONF_TYPE_TCP = "tcp"
@@ -44,9 +123,37 @@ CONF_MODE_SLAVE = "slave"
 
 bypass_mode_list = ["auto", "open", "closed"]
 vent_mode_list = ["none", "fireplace", "open windows", "cooker hood"]
+cf_shadow_list = ["none", "pi"]
 
 DEVICE = None
 
+POLICY_SCHEMA = vol.Schema({
+    vol.Optional(CONF_DEADBAND, default=0): vol.All(vol.Coerce(float), vol.Range(min=0)),
+    vol.Optional(CONF_HYSTERESIS, default=0): vol.All(vol.Coerce(float), vol.Range(min=0)),
+    vol.Optional(CONF_MIN_INTERVAL, default=0): vol.All(vol.Coerce(float), vol.Range(min=0)),
+    vol.Optional(CONF_MAX_INTERVAL, default=0): vol.All(vol.Coerce(float), vol.Range(min=0)),
+})
+
+PRESET_SCHEMA = vol.Schema({
+    vol.Required(CONF_PRESET_SPEED): vol.All(vol.Coerce(int), vol.Range(min=0, max=100)),
+    vol.Optional(CONF_PRESET_SUPPLY): vol.All(vol.Coerce(int), vol.Range(min=0, max=100)),
+    vol.Optional(CONF_PRESET_EXTRACT): vol.All(vol.Coerce(int), vol.Range(min=0, max=100)),
+    vol.Optional(CONF_BYPASS_MODE): vol.In(bypass_mode_list),
+    vol.Optional(CONF_BYPASS_TEMP): vol.All(vol.Coerce(int), vol.Range(min=17, max=24)),
+    vol.Optional(CONF_VENT_MODE, default=vent_mode_list[0]): vol.In(vent_mode_list),
+})
+
+SCHEDULE_ENTRY_SCHEMA = vol.All(vol.Schema({
+    vol.Optional(CONF_SCHEDULE_DAYS, default=WEEKDAYS): vol.All(cv.ensure_list, [vol.In(WEEKDAYS)]),
+    vol.Required(CONF_SCHEDULE_AT): cv.time,
+    vol.Exclusive(CONF_SCHEDULE_PRESET, "action"): cv.string,
+    vol.Exclusive(CONF_PRESET_SPEED, "action"): vol.All(vol.Coerce(int), vol.Range(min=0, max=100)),
+}), cv.has_at_least_one_key(CONF_SCHEDULE_PRESET, CONF_PRESET_SPEED))
+
+SCHEDULE_SCHEMA = vol.All(cv.ensure_list, [SCHEDULE_ENTRY_SCHEMA])
+
+AIRFLOW_POINT_SCHEMA = vol.All(vol.ExactSequence([vol.All(vol.Coerce(int), vol.Range(min=0, max=100)), vol.All(vol.Coerce(float), vol.Range(min=0))]))
+
 SERIAL_SCHEMA = {
     vol.Required(CONF_TYPE): CONF_TYPE_SERIAL,
     vol.Required(CONF_PORT): cv.string,
@@ -56,6 +163,31 @@ SERIAL_SCHEMA = {
     vol.Optional(CONF_BYPASS_MODE, default=DEFAULT_BYPASS_MODE): vol.In(bypass_mode_list),
     vol.Optional(CONF_BYPASS_TEMP, default=DEFAULT_BYPASS_TEMP): vol.All(vol.Coerce(int), vol.Range(min=17, max=24)),
     vol.Optional(CONF_CF_PARAMS_MAX, default=DEFAULT_CF_PARAMS_MAX): vol.All(vol.Coerce(int), vol.Range(min=0, max=500)),
+    vol.Optional(CONF_CF_SHADOW, default=DEFAULT_CF_SHADOW): vol.In(cf_shadow_list),
+    vol.Optional(CONF_CF_SUPPLY_SENSOR): cv.entity_id,
+    vol.Optional(CONF_CF_EXTRACT_SENSOR): cv.entity_id,
+    vol.Optional(CONF_CF_UDP_PORT): cv.port,
+    vol.Optional(CONF_CF_SOCKET): cv.string,
+    vol.Optional(CONF_AIRFLOW_CURVE): vol.All(cv.ensure_list, [AIRFLOW_POINT_SCHEMA], vol.Length(min=2)),
+    vol.Optional(CONF_ENERGY_INTERVAL, default=DEFAULT_ENERGY_INTERVAL): vol.All(vol.Coerce(int), vol.Range(min=0, max=3600)),
+    vol.Optional(CONF_PUBLISH_POLICIES, default={}): {vol.In(IZZY_SENSOR_KEYS): POLICY_SCHEMA},
+    vol.Optional(CONF_OVERSAMPLE_WINDOW, default=DEFAULT_OVERSAMPLE_WINDOW): vol.All(vol.Coerce(int), vol.Range(min=0, max=3600)),
+    vol.Optional(CONF_OVERSAMPLE_INTERVAL, default=DEFAULT_OVERSAMPLE_INTERVAL): vol.All(vol.Coerce(int), vol.Range(min=0, max=3600)),
+    vol.Optional(CONF_HISTORY, default=False): cv.boolean,
+    vol.Optional(CONF_HISTORY_RAW_POINTS, default=DEFAULT_HISTORY_RAW_POINTS): vol.All(vol.Coerce(int), vol.Range(min=60, max=86400)),
+    vol.Optional(CONF_CAPTURE_DIR): cv.string,
+    vol.Optional(CONF_FANOUT_PORT): cv.port,
+    vol.Optional(CONF_FANOUT_BUFFER, default=DEFAULT_FANOUT_BUFFER): vol.All(vol.Coerce(int), vol.Range(min=1)),
+    vol.Optional(CONF_FANOUT_HOST, default=DEFAULT_LISTEN_HOST): cv.string,
+    vol.Optional(CONF_PROCESS, default=False): cv.boolean,
+    vol.Optional(CONF_METRICS_PORT): cv.port,
+    vol.Optional(CONF_METRICS_HOST, default=DEFAULT_LISTEN_HOST): cv.string,
+    vol.Optional(CONF_STREAM_INTERVAL, default=DEFAULT_STREAM_INTERVAL): vol.All(vol.Coerce(float), vol.Range(min=0.1, max=60)),
+    vol.Optional(CONF_FILTER_LOAD, default=False): cv.boolean,
+    vol.Optional(CONF_FILTER_REPLACE_RESIDUAL, default=DEFAULT_FILTER_REPLACE_RESIDUAL): vol.All(vol.Coerce(float), vol.Range(min=1, max=100)),
+    vol.Optional(CONF_FILTER_HALF_LIFE, default=DEFAULT_FILTER_HALF_LIFE): vol.All(vol.Coerce(int), vol.Range(min=1, max=365)),
+    vol.Optional(CONF_PRESETS, default={}): {cv.string: PRESET_SCHEMA},
+    vol.Optional(CONF_SCHEDULE, default=[]): SCHEDULE_SCHEMA,
 }
 
 ETHERNET_SCHEMA = {
@@ -68,6 +200,31 @@ ETHERNET_SCHEMA = {
     vol.Optional(CONF_BYPASS_MODE, default=DEFAULT_BYPASS_MODE): vol.In(bypass_mode_list),
     vol.Optional(CONF_BYPASS_TEMP, default=DEFAULT_BYPASS_TEMP): vol.All(vol.Coerce(int), vol.Range(min=17, max=24)),
     vol.Optional(CONF_CF_PARAMS_MAX, default=DEFAULT_CF_PARAMS_MAX): vol.All(vol.Coerce(int), vol.Range(min=0, max=500)),
+    vol.Optional(CONF_CF_SHADOW, default=DEFAULT_CF_SHADOW): vol.In(cf_shadow_list),
+    vol.Optional(CONF_CF_SUPPLY_SENSOR): cv.entity_id,
+    vol.Optional(CONF_CF_EXTRACT_SENSOR): cv.entity_id,
+    vol.Optional(CONF_CF_UDP_PORT): cv.port,
+    vol.Optional(CONF_CF_SOCKET): cv.string,
+    vol.Optional(CONF_AIRFLOW_CURVE): vol.All(cv.ensure_list, [AIRFLOW_POINT_SCHEMA], vol.Length(min=2)),
+    vol.Optional(CONF_ENERGY_INTERVAL, default=DEFAULT_ENERGY_INTERVAL): vol.All(vol.Coerce(int), vol.Range(min=0, max=3600)),
+    vol.Optional(CONF_PUBLISH_POLICIES, default={}): {vol.In(IZZY_SENSOR_KEYS): POLICY_SCHEMA},
+    vol.Optional(CONF_OVERSAMPLE_WINDOW, default=DEFAULT_OVERSAMPLE_WINDOW): vol.All(vol.Coerce(int), vol.Range(min=0, max=3600)),
+    vol.Optional(CONF_OVERSAMPLE_INTERVAL, default=DEFAULT_OVERSAMPLE_INTERVAL): vol.All(vol.Coerce(int), vol.Range(min=0, max=3600)),
+    vol.Optional(CONF_HISTORY, default=False): cv.boolean,
+    vol.Optional(CONF_HISTORY_RAW_POINTS, default=DEFAULT_HISTORY_RAW_POINTS): vol.All(vol.Coerce(int), vol.Range(min=60, max=86400)),
+    vol.Optional(CONF_CAPTURE_DIR): cv.string,
+    vol.Optional(CONF_FANOUT_PORT): cv.port,
+    vol.Optional(CONF_FANOUT_BUFFER, default=DEFAULT_FANOUT_BUFFER): vol.All(vol.Coerce(int), vol.Range(min=1)),
+    vol.Optional(CONF_FANOUT_HOST, default=DEFAULT_LISTEN_HOST): cv.string,
+    vol.Optional(CONF_PROCESS, default=False): cv.boolean,
+    vol.Optional(CONF_METRICS_PORT): cv.port,
+    vol.Optional(CONF_METRICS_HOST, default=DEFAULT_LISTEN_HOST): cv.string,
+    vol.Optional(CONF_STREAM_INTERVAL, default=DEFAULT_STREAM_INTERVAL): vol.All(vol.Coerce(float), vol.Range(min=0.1, max=60)),
+    vol.Optional(CONF_FILTER_LOAD, default=False): cv.boolean,
+    vol.Optional(CONF_FILTER_REPLACE_RESIDUAL, default=DEFAULT_FILTER_REPLACE_RESIDUAL): vol.All(vol.Coerce(float), vol.Range(min=1, max=100)),
+    vol.Optional(CONF_FILTER_HALF_LIFE, default=DEFAULT_FILTER_HALF_LIFE): vol.All(vol.Coerce(int), vol.Range(min=1, max=365)),
+    vol.Optional(CONF_PRESETS, default={}): {cv.string: PRESET_SCHEMA},
+    vol.Optional(CONF_SCHEDULE, default=[]): SCHEDULE_SCHEMA,
 }
 
 
@@ -83,13 +240,225 @@ TEMP_DEFAULT_VAL = 23
 CORRECTION_DEFAULT_VAL = 0
 VENT_DEFAULT_NAME = "none"
 
+ATTR_NAME = "name"
+ATTR_TIMEOUT = "timeout"
+ATTR_LATENCY = "latency"
+ATTR_ENTRIES = "entries"
 ATTR_SUPPLY_NAME = "supply"
 ATTR_EXTRACT_NAME = "extract"
 
-def setup(hass, config):
-    """Set up the izzi bridge."""
+# Seconds a service waits for its setting to be written to the bus
+DEFAULT_COMMAND_TIMEOUT = 10.0
+
+COMMAND_SERVICE_SCHEMA = vol.Schema({
+    vol.Optional(ATTR_TIMEOUT, default=DEFAULT_COMMAND_TIMEOUT): vol.All(vol.Coerce(float), vol.Range(min=0.1, max=120)),
+})
+BYPASS_MODE_SERVICE_SCHEMA = COMMAND_SERVICE_SCHEMA.extend({
+    vol.Optional(ATTR_MODE_NAME, default=BYPASS_DEFAULT_NAME): vol.In(bypass_mode_list),
+})
+BYPASS_TEMP_SERVICE_SCHEMA = COMMAND_SERVICE_SCHEMA.extend({
+    vol.Optional(ATTR_TEMP_NAME, default=TEMP_DEFAULT_VAL): vol.All(vol.Coerce(int), vol.Range(min=17, max=24)),
+})
+CORRECTION_SERVICE_SCHEMA = COMMAND_SERVICE_SCHEMA.extend({
+    vol.Optional(ATTR_CORRECTION_NAME, default=CORRECTION_DEFAULT_VAL): vol.All(vol.Coerce(int), vol.Range(min=-50, max=50)),
+})
+VENT_MODE_SERVICE_SCHEMA = COMMAND_SERVICE_SCHEMA.extend({
+    vol.Optional(ATTR_MODE_NAME, default=VENT_DEFAULT_NAME): vol.In(vent_mode_list),
+})
+SPEED_RAW_SERVICE_SCHEMA = COMMAND_SERVICE_SCHEMA.extend({
+    vol.Required(ATTR_SUPPLY_NAME): vol.All(vol.Coerce(int), vol.Range(min=0, max=100)),
+    vol.Required(ATTR_EXTRACT_NAME): vol.All(vol.Coerce(int), vol.Range(min=0, max=100)),
+})
+PRESET_SERVICE_SCHEMA = COMMAND_SERVICE_SCHEMA.extend({
+    vol.Required(ATTR_NAME): cv.string,
+})
+
+PLATFORMS = ["sensor", "binary_sensor"]
+PLATFORMS_MASTER = ["fan", "sensor", "binary_sensor"]
+
+# Unload function of the running bridge
+DATA_UNLOAD = DOMAIN + "_unload"
+# Configuration the running bridge was set up or last updated with
+DATA_CONF = DOMAIN + "_conf"
+
+# Options applied to the running controller, any other change reconnects
+HOT_OPTIONS = frozenset((CONF_MODE, CONF_CORRECTION, CONF_BYPASS_MODE, CONF_BYPASS_TEMP, CONF_CF_PARAMS_MAX,
+                         CONF_AIRFLOW_CURVE, CONF_ENERGY_INTERVAL, CONF_PUBLISH_POLICIES, CONF_OVERSAMPLE_WINDOW,
+                         CONF_OVERSAMPLE_INTERVAL, CONF_STREAM_INTERVAL, CONF_PRESETS, CONF_SCHEDULE))
+
+# Warm start cache of published values, command frame and setpoints
+CACHE_STORAGE_KEY = DOMAIN + ".cache"
+CACHE_STORAGE_VERSION = 1
+CACHE_SAVE_DELAY = 60
+# Configured setpoints, a cached setpoint wins while they stay unchanged
+CACHED_CONFIG = (CONF_CORRECTION, CONF_BYPASS_MODE, CONF_BYPASS_TEMP)
+
+async def async_setup(hass, config):
+    """Import YAML configuration into a config entry."""
+    if DOMAIN in config:
+        hass.async_create_task(hass.config_entries.flow.async_init(
+            DOMAIN, context={"source": SOURCE_IMPORT}, data=dict(config[DOMAIN])))
+    return True
+
+def _entry_config(entry : ConfigEntry) -> dict:
+    """Entry data and options with defaults of every option filled in."""
+    return vol.Schema(vol.Any(SERIAL_SCHEMA, ETHERNET_SCHEMA))({**entry.data, **entry.options})
+
+def _platforms(conf) -> list:
+    return PLATFORMS if conf[CONF_MODE] == CONF_MODE_SLAVE else PLATFORMS_MASTER
+
+async def async_setup_entry(hass, entry : ConfigEntry) -> bool:
+    """Set up the izzi bridge from a config entry.
+
+    Opening sockets and capture files runs in the executor, the controller
+    thread connects in the background, so setup does not wait for the unit.
+    Calls that may wait for the worker process never run in the event loop.
+    """
+    conf = _entry_config(entry)
+    store = Store(hass, CACHE_STORAGE_VERSION, CACHE_STORAGE_KEY)
+    cache = await store.async_load()
+    izzibridge = await hass.async_add_executor_job(_setup_bridge, hass, conf, cache)
+    if izzibridge is None:
+        return False
+    izzibridge.set_cache_store(store)
+    hass.data[DATA_CONF] = conf
+    await hass.config_entries.async_forward_entry_setups(entry, _platforms(conf))
+    entry.async_on_unload(entry.add_update_listener(_async_update_listener))
+
+    async def _async_final_write(_event):
+        await izzibridge.async_save_cache()
+    entry.async_on_unload(hass.bus.async_listen_once(EVENT_HOMEASSISTANT_FINAL_WRITE, _async_final_write))
+    await hass.async_add_executor_job(izzibridge.connect)
+    return True
+
+async def _async_update_listener(hass, entry : ConfigEntry):
+    """Apply changed options to the running bridge.
+
+    Options in HOT_OPTIONS are set on the running controller, the
+    connection thread keeps reading frames. Any other change, like the
+    bridge address, reloads the entry and reconnects.
+    """
+    old = hass.data[DATA_CONF]
+    try:
+        new = _entry_config(entry)
+    except vol.Invalid as exc:
+        _LOGGER.error("Invalid options: %s", exc)
+        return
+    changed = {key for key in set(old) | set(new) if old.get(key) != new.get(key)}
+    if not changed:
+        return
+    # A removed airflow curve can't be unset in place
+    if not changed <= HOT_OPTIONS or (CONF_AIRFLOW_CURVE in changed and CONF_AIRFLOW_CURVE not in new):
+        _LOGGER.debug("Reloading for changed options %s", sorted(changed))
+        await hass.config_entries.async_reload(entry.entry_id)
+        return
+    izzibridge = hass.data[DOMAIN]
+    platforms_changed = _platforms(old) != _platforms(new)
+    if platforms_changed and not await hass.config_entries.async_unload_platforms(entry, _platforms(old)):
+        return
+    await hass.async_add_executor_job(_apply_options, izzibridge, new, changed)
+    if CONF_STREAM_INTERVAL in changed and izzibridge.frame_stream is not None:
+        izzibridge.frame_stream.async_set_interval(new[CONF_STREAM_INTERVAL])
+    hass.data[DATA_CONF] = new
+    if platforms_changed:
+        await hass.config_entries.async_forward_entry_setups(entry, _platforms(new))
+    _LOGGER.debug("Applied options %s without reconnecting", sorted(changed))
+
+def _apply_options(izzibridge, conf, changed):
+    """Set changed HOT_OPTIONS on the running controller, runs in the executor."""
+    controller = izzibridge.controller
+    if CONF_MODE in changed:
+        controller.set_master_mode(conf[CONF_MODE] != CONF_MODE_SLAVE)
+    if CONF_CF_PARAMS_MAX in changed:
+        # Keeps the learned CF state, only the limit changes
+        izzibridge.set_cf_params_max(conf[CONF_CF_PARAMS_MAX])
+    if CONF_CORRECTION in changed:
+        izzibridge.set_correction(conf[CONF_CORRECTION])
+    if CONF_BYPASS_TEMP in changed:
+        izzibridge.set_bypass_temp(conf[CONF_BYPASS_TEMP])
+    if CONF_BYPASS_MODE in changed:
+        izzibridge.set_bypass_mode(bypass_mode_list.index(conf[CONF_BYPASS_MODE]))
+    if CONF_AIRFLOW_CURVE in changed:
+        controller.set_airflow_curve([tuple(point) for point in conf[CONF_AIRFLOW_CURVE]])
+    if CONF_ENERGY_INTERVAL in changed:
+        controller.set_energy_publish_interval(conf[CONF_ENERGY_INTERVAL])
+    if CONF_OVERSAMPLE_WINDOW in changed or CONF_OVERSAMPLE_INTERVAL in changed:
+        controller.set_oversampling(conf[CONF_OVERSAMPLE_WINDOW], conf[CONF_OVERSAMPLE_INTERVAL])
+    if CONF_PUBLISH_POLICIES in changed:
+        policies = conf[CONF_PUBLISH_POLICIES]
+        for key, sensor_id in IZZY_SENSOR_KEYS.items():
+            policy = policies.get(key)
+            izzibridge.set_publish_policy(sensor_id, None if policy is None else PublishPolicy(
+                policy[CONF_DEADBAND], policy[CONF_HYSTERESIS], policy[CONF_MIN_INTERVAL], policy[CONF_MAX_INTERVAL]))
+    if CONF_PRESETS in changed and not izzibridge.set_presets(conf[CONF_PRESETS]):
+        _LOGGER.error("Invalid preset in options")
+    # Switching to slave stopped the schedule, switching back starts it again
+    restart_schedule = CONF_MODE in changed and conf[CONF_MODE] != CONF_MODE_SLAVE
+    if (CONF_SCHEDULE in changed or restart_schedule) and not izzibridge.set_schedule(conf[CONF_SCHEDULE]):
+        _LOGGER.error("Invalid schedule in options")
+    izzibridge.configured = {key: conf[key] for key in CACHED_CONFIG}
+
+async def async_unload_entry(hass, entry : ConfigEntry) -> bool:
+    """Unload platforms, stop the controller and remove services."""
+    conf = hass.data[DATA_CONF]
+    if not await hass.config_entries.async_unload_platforms(entry, _platforms(conf)):
+        return False
+    hass.data.pop(DATA_CONF)
+    unload = hass.data.pop(DATA_UNLOAD)
+    izzibridge = hass.data.pop(DOMAIN)
+    await hass.async_add_executor_job(unload)
+    await izzibridge.async_save_cache()
+    if izzibridge.frame_stream is not None:
+        izzibridge.frame_stream.async_stop()
+    for service in list(hass.services.async_services().get(DOMAIN, {})):
+        hass.services.async_remove(DOMAIN, service)
+    return True
+
+def _cf_param_services(izzibridge) -> dict:
+    """Handlers of the cf_* services by service name.
+
+    Called from service calls in the executor, bench.py drives them directly.
+    """
+    def handle_set_cf_params(call):
+        """Handle the service call."""
+        try:
+            supply_pd = call.data.get(ATTR_SUPPLY_NAME, 0)
+            extract_pd = call.data.get(ATTR_EXTRACT_NAME, 0)
+            if izzibridge.set_cf_params(float(supply_pd), float(extract_pd)) != True:
+                _LOGGER.error("CF params invalid %f:%f", supply_pd, extract_pd)
+        except Exception:
+            _LOGGER.error("CF params set failed %s:%s", str(supply_pd), str(extract_pd))
+
+    def handle_set_cf_supply_param(call):
+        """Handle the service call."""
+        try:
+            supply_pd = call.data.get(ATTR_SUPPLY_NAME, 0)
+            if izzibridge.set_cf_supply_param(float(supply_pd)) != True:
+                _LOGGER.error("CF supply param invalid %f", supply_pd)
+        except Exception:
+            _LOGGER.error("CF supply param set failed %s", str(supply_pd))
+
+    def handle_set_cf_extract_param(call):
+        """Handle the service call."""
+        try:
+            extract_pd = call.data.get(ATTR_EXTRACT_NAME, 0)
+            if izzibridge.set_cf_extract_param(float(extract_pd)) != True:
+                _LOGGER.error("CF extract param invalid %f", extract_pd)
+        except Exception:
+            _LOGGER.error("CF extract param set failed %s", str(extract_pd))
+
+    return {"cf_params": handle_set_cf_params,
+            "cf_supply_param": handle_set_cf_supply_param,
+            "cf_extract_param": handle_set_cf_extract_param}
+
+def _setup_bridge(hass, conf, cache=None):
+    """Create the izzi bridge and register services, runs in the executor.
+
+    cache is restored before the configured setpoints are applied, only
+    setpoints changed in the configuration since the cache was saved
+    override the cached ones.
+    """
 
-    conf = config[DOMAIN]
     type = conf[CONF_TYPE]
     name = conf[CONF_NAME]
     mode = conf[CONF_MODE]
@@ -99,6 +468,7 @@ def setup(hass, config):
     bypass_temp = conf[CONF_BYPASS_TEMP]
     bypass_mode = conf[CONF_BYPASS_MODE]
     cf_max_params = conf[CONF_CF_PARAMS_MAX]
+    cf_shadow = conf[CONF_CF_SHADOW]
 
     if CONF_TYPE_TCP == type:
         _LOGGER.debug("Setting up Ethernet bridge")
@@ -111,7 +481,7 @@ def setup(hass, config):
         bridge = IzziSerialBridge(port)
     else:
         _LOGGER.error("Wrong bridge type '%s'", type)
-        return false
+        return None
     
     
     if CONF_MODE_MASTER == mode:
@@ -125,133 +495,342 @@ def setup(hass, config):
         _LOGGER.error("Wrong controller mode, defaulting to master")
     
     # Setup Izzi Bridge
-    izzibridge = IzzifastBridge(hass, bridge, name, correction, is_master)
+    izzibridge = IzzifastBridge(hass, bridge, name, correction, is_master, conf[CONF_PROCESS])
     hass.data[DOMAIN] = izzibridge
 
-    izzibridge.set_bypass_temp(bypass_temp);
-    izzibridge.set_bypass_mode(bypass_mode_list.index(bypass_mode));
     izzibridge.set_cf_params_max(cf_max_params);
+    if conf[CONF_FILTER_LOAD]:
+        izzibridge.controller.enable_filter_load(conf[CONF_FILTER_REPLACE_RESIDUAL], conf[CONF_FILTER_HALF_LIFE])
+    configured = {}
+    if cache is not None and izzibridge.restore_cache(cache):
+        configured = cache.get("configured", {})
+    if configured.get(CONF_CORRECTION) != correction:
+        izzibridge.set_correction(correction)
+    if configured.get(CONF_BYPASS_TEMP) != bypass_temp:
+        izzibridge.set_bypass_temp(bypass_temp);
+    if configured.get(CONF_BYPASS_MODE) != bypass_mode:
+        izzibridge.set_bypass_mode(bypass_mode_list.index(bypass_mode));
+    izzibridge.configured = {key: conf[key] for key in CACHED_CONFIG}
+    if CONF_AIRFLOW_CURVE in conf:
+        izzibridge.controller.set_airflow_curve([tuple(point) for point in conf[CONF_AIRFLOW_CURVE]])
+    izzibridge.controller.set_energy_publish_interval(conf[CONF_ENERGY_INTERVAL])
+    if conf[CONF_PROCESS] and (conf[CONF_HISTORY] or CONF_FANOUT_PORT in conf or CONF_METRICS_PORT in conf
+                               or CONF_CAPTURE_DIR in conf):
+        _LOGGER.warning("history, capture_dir, fanout_port and metrics_port are not available with process: true")
+    if conf[CONF_HISTORY] and not conf[CONF_PROCESS]:
+        izzibridge.controller.enable_history(conf[CONF_HISTORY_RAW_POINTS])
+        hass.add_job(websocket_api.async_register_command, hass, websocket_history)
+    if not conf[CONF_PROCESS]:
+        izzibridge.frame_stream = FrameStreamHub(hass, izzibridge.controller, conf[CONF_STREAM_INTERVAL])
+    hass.add_job(websocket_api.async_register_command, hass, websocket_frames)
+    izzibridge.controller.set_oversampling(conf[CONF_OVERSAMPLE_WINDOW], conf[CONF_OVERSAMPLE_INTERVAL])
+    for key, policy in conf[CONF_PUBLISH_POLICIES].items():
+        izzibridge.set_publish_policy(IZZY_SENSOR_KEYS[key], PublishPolicy(
+            policy[CONF_DEADBAND], policy[CONF_HYSTERESIS], policy[CONF_MIN_INTERVAL], policy[CONF_MAX_INTERVAL]))
+    if not izzibridge.set_presets(conf[CONF_PRESETS]):
+        _LOGGER.error("Invalid preset in configuration")
+    if conf[CONF_SCHEDULE] and not izzibridge.set_schedule(conf[CONF_SCHEDULE]):
+        _LOGGER.error("Invalid schedule in configuration")
+    if cf_shadow == "pi":
+        _LOGGER.debug("Evaluating PI CF controller in shadow mode")
+        izzibridge.set_cf_shadow(CfPiController())
     
-    # Start connection with bridge
-    izzibridge.connect()
+    capture = None
+    # A frame listener would be pickled into the worker process and never closed there
+    if CONF_CAPTURE_DIR in conf and not conf[CONF_PROCESS]:
+        capture = CaptureWriter(hass.config.path(conf[CONF_CAPTURE_DIR]))
+        izzibridge.controller.add_frame_listener(capture)
+
+    fanout = None
+    if CONF_FANOUT_PORT in conf and not conf[CONF_PROCESS]:
+        fanout = FrameFanout((conf[CONF_FANOUT_HOST], conf[CONF_FANOUT_PORT]), conf[CONF_FANOUT_BUFFER] * 1024)
+        try:
+            fanout.start()
+            izzibridge.controller.add_frame_listener(fanout)
+        except OSError as exc:
+            _LOGGER.error("Can't open frame fan-out port %d: %s", conf[CONF_FANOUT_PORT], exc)
+            fanout = None
+
+    metrics_server = None
+    if CONF_METRICS_PORT in conf and not conf[CONF_PROCESS]:
+        metrics = ControllerMetrics(izzibridge.controller)
+        metrics_server = MetricsServer((conf[CONF_METRICS_HOST], conf[CONF_METRICS_PORT]), metrics)
+        try:
+            metrics_server.start()
+            izzibridge.controller.add_frame_listener(metrics)
+        except OSError as exc:
+            _LOGGER.error("Can't open metrics port %d: %s", conf[CONF_METRICS_PORT], exc)
+            metrics_server = None
+
+    # Direct CF pressure inputs, bypassing the service call path
+    cf_sources = []
+    if CONF_CF_UDP_PORT in conf:
+        cf_sources.append(CfSocketSource(("127.0.0.1", conf[CONF_CF_UDP_PORT]), izzibridge.controller.cf_samples))
+    if CONF_CF_SOCKET in conf:
+        cf_sources.append(CfSocketSource(conf[CONF_CF_SOCKET], izzibridge.controller.cf_samples))
+    for source in cf_sources:
+        try:
+            source.start()
+        except OSError as exc:
+            _LOGGER.error("Can't open CF input %s: %s", str(source.address), exc)
+
+    cf_entities = {}
+    if CONF_CF_SUPPLY_SENSOR in conf:
+        cf_entities[conf[CONF_CF_SUPPLY_SENSOR]] = CF_CHANNEL_SUPPLY
+    if CONF_CF_EXTRACT_SENSOR in conf:
+        cf_entities[conf[CONF_CF_EXTRACT_SENSOR]] = CF_CHANNEL_EXTRACT
+
+    @callback
+    def _handle_cf_state(event):
+        """Push pressure entity updates straight into the CF sample queue."""
+        new_state = event.data.get("new_state")
+        if new_state is None:
+            return
+        try:
+            value = float(new_state.state)
+        except ValueError:
+            return
+        izzibridge.controller.cf_samples.push(cf_entities[event.data["entity_id"]], value)
+
+    remove_cf_tracking = None
+    if cf_entities:
+        # Runs in the executor, listeners are added and removed in the event loop
+        remove_cf_tracking = run_callback_threadsafe(
+            hass.loop, async_track_state_change_event, hass, list(cf_entities), _handle_cf_state).result()
 
     # Schedule disconnect on shutdown
     def _shutdown(_event):
+        for source in cf_sources:
+            source.stop()
         izzibridge.disconnect()
+        if capture is not None:
+            capture.close()
+        if fanout is not None:
+            fanout.stop()
+        if metrics_server is not None:
+            metrics_server.stop()
+
+    remove_stop_listener = hass.bus.listen_once(EVENT_HOMEASSISTANT_STOP, _shutdown)
 
-    hass.bus.listen_once(EVENT_HOMEASSISTANT_STOP, _shutdown)
+    def _unload():
+        remove_stop_listener()
+        if remove_cf_tracking is not None:
+            run_callback_threadsafe(hass.loop, remove_cf_tracking).result()
+        _shutdown(None)
+
+    hass.data[DATA_UNLOAD] = _unload
     
-    def handle_set_bypass_mode(call):
-        """Handle the service call."""
-        try:
-            mode = call.data.get(ATTR_MODE_NAME, BYPASS_DEFAULT_NAME)
-            if izzibridge.set_bypass_mode(bypass_mode_list.index(mode)) != True:
-                _LOGGER.error("Bypass mode invalid %s", mode)
-        except Exception:
-            _LOGGER.error("Bypass mode failed %s", mode)
-            
-    def handle_set_bypass_temp(call):
-        """Handle the service call."""
-        try:
-            temp = call.data.get(ATTR_TEMP_NAME, TEMP_DEFAULT_VAL)
-            if izzibridge.set_bypass_temp(int(temp)) != True:
-                _LOGGER.error("Bypass temp invalid %d", temp)
-        except Exception:
-            _LOGGER.error("Bypass temp failed %d", temp)
-                
-    def handle_set_correction(call):
-        """Handle the service call."""
-        try:
-            value = call.data.get(ATTR_CORRECTION_NAME, CORRECTION_DEFAULT_VAL)
-            if izzibridge.set_correction(int(value)) != True:
-                _LOGGER.error("Correction invalid %d", value)
-        except Exception:
-            _LOGGER.error("Correction set failed %d", value)
-            
-    def handle_set_cf_params(call):
-        """Handle the service call."""
-        try:
-            supply_pd = call.data.get(ATTR_SUPPLY_NAME, 0)
-            extract_pd = call.data.get(ATTR_EXTRACT_NAME, 0)
-            if izzibridge.set_cf_params(float(supply_pd), float(extract_pd)) != True:
-                _LOGGER.error("CF params invalid %f:%f", supply_pd, extract_pd)
-        except Exception:
-            _LOGGER.error("CF params set failed %s:%s", str(supply_pd), str(extract_pd))
-    def handle_set_cf_supply_param(call):
-        """Handle the service call."""
-        try:
-            supply_pd = call.data.get(ATTR_SUPPLY_NAME, 0)
-            if izzibridge.set_cf_supply_param(float(supply_pd)) != True:
-                _LOGGER.error("CF supply param invalid %f", supply_pd)
-        except Exception:
-            _LOGGER.error("CF supply param set failed %s", str(supply_pd)) 
-            
-    def handle_set_cf_extract_param(call):
+    def command_service(name, schema, apply):
+        """Register an async service that returns once its setting was written.
+
+        apply(call data) changes the setting and returns False when it was not
+        accepted. The response holds the latency from the call until the
+        command frame carrying the setting was written to the bus.
+        """
+        async def handle(call):
+            if not izzibridge.controller.get_master_mode():
+                raise ServiceValidationError("%s needs the controller in master mode" % name)
+            started = time.monotonic()
+            # Setters of the process controller may wait for the worker
+            if await hass.async_add_executor_job(apply, call.data) != True:
+                raise ServiceValidationError("%s not accepted: %s" % (name, dict(call.data)))
+            try:
+                latency = await izzibridge.async_wait_written(started, call.data[ATTR_TIMEOUT])
+            except asyncio.TimeoutError:
+                raise HomeAssistantError("%s not written to the unit within %.1f s" % (name, call.data[ATTR_TIMEOUT]))
+            _LOGGER.debug("%s written after %.3f s", name, latency)
+            return {ATTR_LATENCY: round(latency, 3)}
+
+        hass.services.register(DOMAIN, name, handle, schema=schema, supports_response=SupportsResponse.OPTIONAL)
+
+    def handle_filter_reset(call):
         """Handle the service call."""
-        try:
-            extract_pd = call.data.get(ATTR_EXTRACT_NAME, 0)
-            if izzibridge.set_cf_extract_param(float(extract_pd)) != True:
-                _LOGGER.error("CF extract param invalid %f", extract_pd)
-        except Exception:
-            _LOGGER.error("CF extract param set failed %s", str(extract_pd))    
-            
-    def handle_set_vent_mode(call):
+        if izzibridge.controller.reset_filter_load() != True:
+            _LOGGER.error("Filter reset failed, filter_load is not enabled")
+    
+    def handle_profile(call):
         """Handle the service call."""
         try:
-            mode = call.data.get(ATTR_MODE_NAME, VENT_DEFAULT_NAME)
-            if izzibridge.set_vent_mode(vent_mode_list.index(mode)) != True:
-                _LOGGER.error("Vent mode invalid to %s", mode)
+            duration = float(call.data.get("duration", 30))
+            interval = float(call.data.get("interval", 5)) / 1000.0
+            top = int(call.data.get("top", 20))
+            path = hass.config.path(time.strftime("izzifast_profile_%Y%m%d_%H%M%S.txt"))
+            if izzibridge.controller.start_profiler(duration, path, interval, top) != True:
+                _LOGGER.error("Profiler not started, not connected or already running")
         except Exception:
-            _LOGGER.error("Vent mode failed %s", mode)
+            _LOGGER.error("Profiler start failed")
+    
+    async def handle_cf_shadow_stats(call):
+        """Return the comparison of the shadow and the live CF controller."""
+        # The process controller answers over the worker pipe
+        stats = await hass.async_add_executor_job(izzibridge.get_cf_shadow_stats)
+        if stats is None:
+            raise ServiceValidationError("CF shadow evaluation is not enabled")
+        return stats
     
-    def handle_set_speed_raw(call):
+    def handle_schedule(call):
         """Handle the service call."""
         try:
-            supply = value = call.data.get(ATTR_SUPPLY_NAME, -1)
-            extract = call.data.get(ATTR_EXTRACT_NAME, -1)
-            if extract < 0 or supply < 0:
-                _LOGGER.error("Raw speed missing supply or extract attribute")
-                
-            if izzibridge.set_fan_speed_raw(int(supply), int(extract)) != True:
-                _LOGGER.error("Raw speed invalid supply %d, extract %d", supply, extract)
-        except Exception:
-            _LOGGER.error("Raw speed set failed %d", value)
-            
-    if is_master :    
-        hass.services.register(DOMAIN, "bypass_mode", handle_set_bypass_mode)
-        hass.services.register(DOMAIN, "bypass_temp", handle_set_bypass_temp)
-        hass.services.register(DOMAIN, "correction", handle_set_correction)
-        hass.services.register(DOMAIN, "vent_mode", handle_set_vent_mode)
-        hass.services.register(DOMAIN, "speed_raw", handle_set_speed_raw)
-        hass.services.register(DOMAIN, "cf_params", handle_set_cf_params)
-        # Load platforms
-        discovery.load_platform(hass, "fan", DOMAIN, {}, config)
-
-    discovery.load_platform(hass, "sensor", DOMAIN, {}, config)
-    discovery.load_platform(hass, "binary_sensor", DOMAIN, {}, config)
+            entries = SCHEDULE_SCHEMA(call.data.get(ATTR_ENTRIES, []))
+        except vol.Invalid as exc:
+            _LOGGER.error("Invalid schedule: %s", exc)
+            return
+        if izzibridge.set_schedule(entries) != True:
+            _LOGGER.error("Schedule not accepted, check preset names")
+    
+    # Registered in slave mode too, the mode can be switched by an options update
+    command_service("bypass_mode", BYPASS_MODE_SERVICE_SCHEMA,
+        lambda data: izzibridge.set_bypass_mode(bypass_mode_list.index(data[ATTR_MODE_NAME])))
+    command_service("bypass_temp", BYPASS_TEMP_SERVICE_SCHEMA,
+        lambda data: izzibridge.set_bypass_temp(data[ATTR_TEMP_NAME]))
+    command_service("correction", CORRECTION_SERVICE_SCHEMA,
+        lambda data: izzibridge.set_correction(data[ATTR_CORRECTION_NAME]))
+    command_service("vent_mode", VENT_MODE_SERVICE_SCHEMA,
+        lambda data: izzibridge.set_vent_mode(vent_mode_list.index(data[ATTR_MODE_NAME])))
+    command_service("speed_raw", SPEED_RAW_SERVICE_SCHEMA,
+        lambda data: izzibridge.set_fan_speed_raw(data[ATTR_SUPPLY_NAME], data[ATTR_EXTRACT_NAME]))
+    command_service("preset", PRESET_SERVICE_SCHEMA,
+        lambda data: izzibridge.apply_preset(data[ATTR_NAME]))
+    for service, handler in _cf_param_services(izzibridge).items():
+        hass.services.register(DOMAIN, service, handler)
+    hass.services.register(DOMAIN, "schedule", handle_schedule)
 
-    return True
+    if conf[CONF_FILTER_LOAD]:
+        hass.services.register(DOMAIN, "filter_reset", handle_filter_reset)
+    hass.services.register(DOMAIN, "profile", handle_profile)
+    if cf_shadow != "none":
+        hass.services.register(DOMAIN, "cf_shadow_stats", handle_cf_shadow_stats, supports_response=SupportsResponse.ONLY)
+
+    return izzibridge
+
+
+@websocket_api.websocket_command({
+    vol.Required("type"): "izzifast/history",
+    vol.Required("sensor"): vol.In([key for key, sensor_id in IZZY_SENSOR_KEYS.items() if sensor_id in IzziHistory.TRACKED_SENSORS]),
+    vol.Optional("start_time"): cv.datetime,
+    vol.Optional("end_time"): cv.datetime,
+    vol.Optional("resolution"): vol.In(HISTORY_RESOLUTIONS),
+})
+@callback
+def websocket_history(hass, connection, msg):
+    """Return in memory history of a sensor, last hour by default."""
+    izzibridge = hass.data.get(DOMAIN)
+    if izzibridge is None:
+        connection.send_error(msg["id"], "not_available", "Izzifast is not set up")
+        return
+    history = izzibridge.controller.history
+    if history is None:
+        connection.send_error(msg["id"], "not_enabled", "History is not enabled")
+        return
+
+    end = msg.get("end_time")
+    end_ts = dt_util.as_timestamp(end) if end is not None else time.time()
+    start = msg.get("start_time")
+    start_ts = dt_util.as_timestamp(start) if start is not None else end_ts - 3600
+    resolution, points = history.query(IZZY_SENSOR_KEYS[msg["sensor"]], start_ts, end_ts, msg.get("resolution"))
+    connection.send_result(msg["id"], {"resolution": resolution, "points": points})
+
+
+@websocket_api.websocket_command({
+    vol.Required("type"): "izzifast/frames",
+})
+@callback
+def websocket_frames(hass, connection, msg):
+    """Stream every decoded bus frame, in batches every stream_interval seconds."""
+    izzibridge = hass.data.get(DOMAIN)
+    if izzibridge is None or izzibridge.frame_stream is None:
+        connection.send_error(msg["id"], "not_available", "Frame stream is not available with process: true")
+        return
+    connection.subscriptions[msg["id"]] = izzibridge.frame_stream.async_subscribe(connection, msg["id"])
+    connection.send_result(msg["id"])
+
+
+class FrameStreamHub:
+    """Sends batches of decoded frames to websocket subscribers.
+
+    The frame listener and the batch timer only exist while somebody is
+    subscribed, each batch is decoded once for all subscribers.
+    """
+
+    def __init__(self, hass, controller, interval : float):
+        self.hass = hass
+        self.controller = controller
+        self.interval = interval
+        self._batcher = FrameBatcher()
+        self._subscribers = {}
+        self._cancel_timer = None
+
+    @callback
+    def async_subscribe(self, connection, msg_id):
+        key = (id(connection), msg_id)
+        self._subscribers[key] = (connection, msg_id)
+        if self._cancel_timer is None:
+            self._batcher.clear()
+            self.controller.add_frame_listener(self._batcher)
+            self._cancel_timer = async_track_time_interval(self.hass, self._async_send, timedelta(seconds=self.interval))
+
+        @callback
+        def unsubscribe():
+            self._subscribers.pop(key, None)
+            if not self._subscribers:
+                self.async_stop()
+        return unsubscribe
+
+    @callback
+    def async_set_interval(self, interval : float):
+        """Change the batch interval, a running timer is restarted."""
+        self.interval = interval
+        if self._cancel_timer is not None:
+            self._cancel_timer()
+            self._cancel_timer = async_track_time_interval(self.hass, self._async_send, timedelta(seconds=interval))
+
+    @callback
+    def async_stop(self):
+        self.controller.remove_frame_listener(self._batcher)
+        if self._cancel_timer is not None:
+            self._cancel_timer()
+            self._cancel_timer = None
+        self._batcher.clear()
+
+    @callback
+    def _async_send(self, _now=None):
+        frames = self._batcher.take()
+        if not frames:
+            return
+        for connection, msg_id in list(self._subscribers.values()):
+            connection.send_message(websocket_api.event_message(msg_id, {"frames": frames}))
 
 
 class IzzifastBridge:
     """Representation of a IZZI bridge."""
 
-    def __init__(self, hass, bridge, name, correction, is_master):
-        """Initialize the IZZI bridge."""
-        self.data = {}
+    def __init__(self, hass, bridge, name, correction, is_master, process=False):
+        """Initialize the IZZI bridge, process runs the controller in a worker process."""
         self.name = name
         self.hass = hass
         self.unique_id = "_iZZi_300_ERV_FE"
         self.correction = correction
         self.speed = 0
 
-        self.controller = IzziController(
+        controller_class = IzziProcessController if process else IzziController
+        self.controller = controller_class(
             bridge=bridge,
             is_master=is_master
         )
         self.controller.callback_sensor = self.sensor_callback
+        self.controller.callback_preset = self._preset_applied
+        self.state = self.controller.state
+        self._store = None
+        self._cache_pending = False
+        self._cancel_cache_save = None
+        self._presets = {}
+        self._schedule_presets = {}
+        self._schedule_entries = []
+        self.frame_stream = None
+        self.configured = {}
+        self._heartbeat_sensors = set()
         
-        self.sensor_callback(IZZY_SENSOR_EXTRACT_CORRECTION_STATE_ID, self.correction)
+        self.state.set_current(IZZY_SENSOR_EXTRACT_CORRECTION_STATE_ID, self.correction)
 
     def connect(self):
         """Connect with the bridge."""
@@ -264,10 +843,97 @@ class IzzifastBridge:
         self.controller.disconnect()
  
     def force_update(self, sensor):
-        if sensor == IZZY_SENSOR_EXTRACT_CORRECTION_STATE_ID :
-            self.sensor_callback(IZZY_SENSOR_EXTRACT_CORRECTION_STATE_ID, self.correction)
+        self.controller.force_update(sensor)
+
+    def get_state(self, sensor):
+        """Return the last published value of sensor."""
+        return self.state.published[sensor]
+
+    def set_publish_policy(self, sensor, policy) -> bool:
+        if policy is not None and policy.max_interval > 0:
+            self._heartbeat_sensors.add(sensor)
         else:
-            self.controller.force_update(sensor)
+            self._heartbeat_sensors.discard(sensor)
+        return self.controller.set_publish_policy(sensor, policy)
+
+    def has_heartbeat(self, sensor) -> bool:
+        """Whether sensor is republished unchanged every max_interval."""
+        return sensor in self._heartbeat_sensors
+
+    def set_local_state(self, sensor, value):
+        """Store a value owned by an entity, e.g. the fan mode."""
+        self.state.set_published(sensor, value)
+        self._schedule_cache_save()
+
+    def set_cache_store(self, store):
+        """Persist state into store, at most once per CACHE_SAVE_DELAY."""
+        self._store = store
+
+    def restore_cache(self, cache) -> bool:
+        """Restore state saved before a restart, call before connect."""
+        try:
+            if not self.controller.restore_snapshot(cache["controller"]):
+                return False
+            self.correction = cache["correction"]
+            self.speed = cache["speed"]
+        except (KeyError, TypeError, ValueError, OverflowError, IndexError) as exc:
+            _LOGGER.warning("Ignoring invalid state cache: %s", exc)
+            return False
+        self.state.set_published(IZZY_SENSOR_EXTRACT_CORRECTION_STATE_ID, self.correction)
+        return True
+
+    def _cache_data(self) -> dict:
+        self._cache_pending = False
+        return {"controller": self.controller.get_snapshot(),
+                "correction": self.correction,
+                "speed": self.speed,
+                "configured": self.configured}
+
+    def _schedule_cache_save(self):
+        # One save per CACHE_SAVE_DELAY, the timer is not restarted by
+        # later changes
+        if self._store is None or self._cache_pending:
+            return
+        self._cache_pending = True
+        self.hass.loop.call_soon_threadsafe(self._async_schedule_cache_save)
+
+    @callback
+    def _async_schedule_cache_save(self):
+        if self._cancel_cache_save is None:
+            self._cancel_cache_save = async_call_later(self.hass, CACHE_SAVE_DELAY, self._async_cache_timer)
+
+    async def _async_cache_timer(self, _now):
+        self._cancel_cache_save = None
+        await self.async_save_cache()
+
+    async def async_wait_written(self, started : float, timeout : float) -> float:
+        """Seconds from started (monotonic) until a command frame carrying
+        every setting made before this call was written.
+
+        Raises asyncio.TimeoutError after timeout seconds.
+        """
+        loop = self.hass.loop
+        written = loop.create_future()
+
+        def _set_written(ts):
+            if not written.done():
+                written.set_result(ts)
+
+        waiter = self.controller.add_write_waiter(lambda frame, ts: loop.call_soon_threadsafe(_set_written, ts))
+        try:
+            ts = await asyncio.wait_for(written, timeout)
+        finally:
+            self.controller.remove_write_waiter(waiter)
+        return ts - started
+
+    async def async_save_cache(self):
+        """Save the cache now, the snapshot is taken in the executor."""
+        if self._cancel_cache_save is not None:
+            self._cancel_cache_save()
+            self._cancel_cache_save = None
+        if self._store is not None:
+            data = await self.hass.async_add_executor_job(self._cache_data)
+            await self._store.async_save(data)
 
     def set_bypass_mode(self, mode) -> bool:
         return self.controller.set_bypass_mode(mode)
@@ -289,31 +955,124 @@ class IzzifastBridge:
         if correction < -50 or correction > 50:
             return False
         self.correction = correction
-        self.sensor_callback(IZZY_SENSOR_EXTRACT_CORRECTION_STATE_ID, self.correction)
-        return self.set_fan_speed(self.speed);
+        self.state.set_current(IZZY_SENSOR_EXTRACT_CORRECTION_STATE_ID, self.correction)
+        # Preset fan speeds include the correction
+        self.set_presets(self._presets)
+        # No speed set yet, the correction applies to the first one
+        if self.speed >= 20:
+            self.set_fan_speed(self.speed)
+        return True
         
+    def _fan_speeds(self, speed : int):
+        """Supply and extract speed for speed percent, extract correction applied."""
+        if self.controller.is_cf_enabled():
+            return speed, speed
+        reduced = speed - round(((abs(self.correction)/100.0)*speed))
+        if self.correction > 0:
+            return reduced, speed
+        return speed, reduced
+
     def set_fan_speed(self, speed : int) -> bool:
         if speed < 20 or speed > 100:
             return False
             
         self.speed = speed
-        if not self.controller.is_cf_enabled() :
-            if self.correction > 0:
-                self.controller.set_fan_speed(speed - round(((abs(self.correction)/100.0)*speed)), speed)
-            else:
-                self.controller.set_fan_speed(speed, speed - round(((abs(self.correction)/100.0)*speed)))
+        supply, extract = self._fan_speeds(speed)
+        self.controller.set_fan_speed(supply, extract)
+        return True
+
+    def _add_preset(self, name : str, preset : dict) -> bool:
+        speed = preset[CONF_PRESET_SPEED]
+        targets = {}
+        if speed == 0:
+            targets[IZZY_SENSOR_UNIT_STATE_ID] = IZZY_CMD_UNIT_STATE_OFF
         else:
-            self.controller.set_fan_speed(speed, speed)
+            supply, extract = self._fan_speeds(speed)
+            targets[IZZY_SENSOR_UNIT_STATE_ID] = IZZY_CMD_UNIT_STATE_ON
+            targets[IZZY_SENSOR_FAN_SUPPLY_SPEED_ID] = preset.get(CONF_PRESET_SUPPLY, supply)
+            targets[IZZY_SENSOR_FAN_EXTRACT_SPEED_ID] = preset.get(CONF_PRESET_EXTRACT, extract)
+        if CONF_BYPASS_MODE in preset:
+            targets[IZZY_SENSOR_BYPASS_MODE_ID] = bypass_mode_list.index(preset[CONF_BYPASS_MODE])
+        if CONF_BYPASS_TEMP in preset:
+            targets[IZZY_SENSOR_BYPASS_TEMP_ID] = preset[CONF_BYPASS_TEMP]
+        if not self.controller.add_preset(name, targets, vent_mode_list.index(preset.get(CONF_VENT_MODE, VENT_DEFAULT_NAME))):
+            _LOGGER.error("Preset %s is not valid", name)
+            return False
+        return True
+
+    def set_presets(self, presets : dict) -> bool:
+        """Precompute presets from the presets configuration."""
+        self._presets = presets
+        valid = True
+        for name, preset in presets.items():
+            valid = self._add_preset(name, preset) and valid
+        if self._schedule_entries:
+            valid = self.set_schedule(self._schedule_entries) and valid
+        return valid
+
+    def set_schedule(self, entries : list) -> bool:
+        """Upload the weekly schedule, the controller applies it from now on.
+
+        Entries with a speed instead of a preset get a preset of their own.
+        """
+        self._schedule_entries = entries
+        table = []
+        for entry in entries:
+            name = entry.get(CONF_SCHEDULE_PRESET)
+            if name is None:
+                name = "speed %d" % entry[CONF_PRESET_SPEED]
+                self._schedule_presets[name] = {CONF_PRESET_SPEED: entry[CONF_PRESET_SPEED]}
+                if not self._add_preset(name, self._schedule_presets[name]):
+                    return False
+            at = entry[CONF_SCHEDULE_AT]
+            for day in entry[CONF_SCHEDULE_DAYS]:
+                table.append((WEEKDAYS.index(day), at.hour * 3600 + at.minute * 60 + at.second, name))
+        # Times are meant in the HA time zone, not the one of the process
+        tz = dt_util.get_time_zone(self.hass.config.time_zone)
+        return self.controller.set_schedule(IzziSchedule(table, tz) if table else None)
+
+    def get_presets(self) -> list:
+        return list(self._presets)
+
+    def get_preset(self):
+        """Name of the active preset, None after any other setting changed."""
+        return self.controller.preset
+
+    def apply_preset(self, name : str) -> bool:
+        if name not in self._presets or not self.controller.apply_preset(name):
+            return False
+        self._preset_applied(name)
         return True
 
+    def _preset_applied(self, name : str):
+        preset = self._presets.get(name) or self._schedule_presets[name]
+        speed = preset[CONF_PRESET_SPEED]
+        if speed > 0:
+            self.speed = speed
+        self.state.set_published(IZZY_SENSOR_FAN_MODE_ID, speed)
+        dispatcher_send(self.hass, SIGNAL_IZZIFAST_UPDATE_RECEIVED.format(IZZY_SENSOR_FAN_MODE_ID), speed)
+        self._schedule_cache_save()
+
     def set_fan_speed_raw(self, supply : int, extract : int) -> bool:
         return self.controller.set_fan_speed(supply, extract)
         
     def set_cf_params(self, supply : float, extract : float) -> bool:
         return self.controller.set_cf_params(supply, extract)
 
+    def set_cf_supply_param(self, supply : float) -> bool:
+        return self.controller.set_cf_supply_param(supply)
+
+    def set_cf_extract_param(self, extract : float) -> bool:
+        return self.controller.set_cf_extract_param(extract)
+
     def set_cf_params_max(self, max_param : float) -> bool:
         return self.controller.set_cf_params_max(max_param)
+
+    def set_cf_shadow(self, cf_controller) -> bool:
+        return self.controller.set_cf_shadow(cf_controller)
+
+    def get_cf_shadow_stats(self) -> dict:
+        return self.controller.get_cf_shadow_stats()
         
     def sensor_callback(self, var, value):
         """Notify listeners that we have received an update."""
@@ -321,3 +1080,4 @@ class IzzifastBridge:
         dispatcher_send(
             self.hass, SIGNAL_IZZIFAST_UPDATE_RECEIVED.format(var), value
         )
+        self._schedule_cache_save()
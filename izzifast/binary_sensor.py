@@ -15,7 +15,7 @@ from .izzi import *
 
 _LOGGER = logging.getLogger(__name__)
 
-def setup_platform(hass, config, add_entities, discovery_info=None):
+async def async_setup_entry(hass, entry, async_add_entities):
     """Set up the available Danfoss Air sensors etc."""
     izzibridge = hass.data[DOMAIN]
 
@@ -30,7 +30,7 @@ def setup_platform(hass, config, add_entities, discovery_info=None):
     for sensor in sensors:
         dev.append(IzzifastBinarySensor(izzibridge, sensor[0], sensor[1], sensor[2], sensor[3]))
 
-    add_entities(dev, True)
+    async_add_entities(dev, True)
 
 
 class IzzifastBinarySensor(BinarySensorEntity):
@@ -68,7 +68,6 @@ class IzzifastBinarySensor(BinarySensorEntity):
             self._name,
             value,
         )
-        self._izzibridge.data[self._sensor_type] = value
         self.schedule_update_ha_state()
 
     @property
@@ -79,16 +78,18 @@ class IzzifastBinarySensor(BinarySensorEntity):
     @property
     def is_on(self):
         """Return the state of the sensor."""
-        try:
-            return self._izzibridge.data[self._sensor_type] == self._active_state
-        except KeyError:
-            return False
+        return self._izzibridge.get_state(self._sensor_type) == self._active_state
 
     @property
     def device_class(self):
         """Type of device class."""
         return self._device_class
 
+    @property
+    def force_update(self) -> bool:
+        """Write republished unchanged values, heartbeats would be dropped otherwise."""
+        return self._izzibridge.has_heartbeat(self._sensor_type)
+
     @property
     def should_poll(self) -> bool:
         """Do not poll."""
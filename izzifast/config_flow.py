@@ -0,0 +1,116 @@
+"""Config flow for the iZZi ERV 300 integration."""
+import logging
+import os
+import socket
+
+import voluptuous as vol
+
+from homeassistant import config_entries
+from homeassistant.const import CONF_TYPE, CONF_HOST, CONF_NAME, CONF_PORT
+from homeassistant.core import callback
+
+from . import (
+    DOMAIN,
+    CONF_BYPASS_MODE,
+    CONF_BYPASS_TEMP,
+    CONF_CF_PARAMS_MAX,
+    CONF_CORRECTION,
+    CONF_MODE,
+    CONF_MODE_MASTER,
+    CONF_MODE_SLAVE,
+    CONF_TYPE_SERIAL,
+    CONF_TYPE_TCP,
+    DEFAULT_NAME,
+    DEFAULT_PORT,
+    bypass_mode_list,
+    _entry_config,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+def _can_connect(host : str, port : int) -> bool:
+    try:
+        with socket.create_connection((host, port), timeout=5):
+            return True
+    except OSError:
+        return False
+
+
+class IzzifastConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
+    """Set up the bridge connection, other options are kept from YAML import."""
+
+    VERSION = 1
+
+    @staticmethod
+    @callback
+    def async_get_options_flow(config_entry):
+        return IzzifastOptionsFlow(config_entry)
+
+    async def async_step_user(self, user_input=None):
+        """Choose the bridge type."""
+        if self._async_current_entries():
+            return self.async_abort(reason="single_instance_allowed")
+        if user_input is not None:
+            if user_input[CONF_TYPE] == CONF_TYPE_TCP:
+                return await self.async_step_tcp()
+            return await self.async_step_serial()
+
+        return self.async_show_form(step_id="user", data_schema=vol.Schema({
+            vol.Required(CONF_TYPE, default=CONF_TYPE_TCP): vol.In([CONF_TYPE_TCP, CONF_TYPE_SERIAL]),
+        }))
+
+    async def async_step_tcp(self, user_input=None):
+        """RS485 to ethernet converter."""
+        errors = {}
+        if user_input is not None:
+            if await self.hass.async_add_executor_job(_can_connect, user_input[CONF_HOST], user_input[CONF_PORT]):
+                return self.async_create_entry(title=user_input[CONF_NAME], data={CONF_TYPE: CONF_TYPE_TCP, **user_input})
+            errors["base"] = "cannot_connect"
+
+        return self.async_show_form(step_id="tcp", errors=errors, data_schema=vol.Schema({
+            vol.Required(CONF_HOST): str,
+            vol.Required(CONF_PORT, default=DEFAULT_PORT): int,
+            vol.Optional(CONF_NAME, default=DEFAULT_NAME): str,
+            vol.Optional(CONF_MODE, default=CONF_MODE_MASTER): vol.In([CONF_MODE_MASTER, CONF_MODE_SLAVE]),
+        }))
+
+    async def async_step_serial(self, user_input=None):
+        """RS485 serial adapter."""
+        errors = {}
+        if user_input is not None:
+            if await self.hass.async_add_executor_job(os.path.exists, user_input[CONF_PORT]):
+                return self.async_create_entry(title=user_input[CONF_NAME], data={CONF_TYPE: CONF_TYPE_SERIAL, **user_input})
+            errors["base"] = "cannot_connect"
+
+        return self.async_show_form(step_id="serial", errors=errors, data_schema=vol.Schema({
+            vol.Required(CONF_PORT, default="/dev/ttyUSB0"): str,
+            vol.Optional(CONF_NAME, default=DEFAULT_NAME): str,
+            vol.Optional(CONF_MODE, default=CONF_MODE_MASTER): vol.In([CONF_MODE_MASTER, CONF_MODE_SLAVE]),
+        }))
+
+    async def async_step_import(self, import_config):
+        """Create or update the entry from configuration.yaml."""
+        for entry in self._async_current_entries():
+            self.hass.config_entries.async_update_entry(entry, data=import_config)
+            return self.async_abort(reason="already_configured")
+        return self.async_create_entry(title=import_config.get(CONF_NAME, DEFAULT_NAME), data=import_config)
+
+
+class IzzifastOptionsFlow(config_entries.OptionsFlow):
+    """Options applied to the running controller without reconnecting."""
+
+    def __init__(self, config_entry):
+        self.entry = config_entry
+
+    async def async_step_init(self, user_input=None):
+        if user_input is not None:
+            return self.async_create_entry(title="", data=user_input)
+
+        conf = _entry_config(self.entry)
+        return self.async_show_form(step_id="init", data_schema=vol.Schema({
+            vol.Required(CONF_MODE, default=conf[CONF_MODE]): vol.In([CONF_MODE_MASTER, CONF_MODE_SLAVE]),
+            vol.Required(CONF_CORRECTION, default=conf[CONF_CORRECTION]): vol.All(vol.Coerce(int), vol.Range(min=-50, max=50)),
+            vol.Required(CONF_BYPASS_MODE, default=conf[CONF_BYPASS_MODE]): vol.In(bypass_mode_list),
+            vol.Required(CONF_BYPASS_TEMP, default=conf[CONF_BYPASS_TEMP]): vol.All(vol.Coerce(int), vol.Range(min=17, max=24)),
+            vol.Required(CONF_CF_PARAMS_MAX, default=conf[CONF_CF_PARAMS_MAX]): vol.All(vol.Coerce(int), vol.Range(min=0, max=500)),
+        }))
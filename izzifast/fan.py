@@ -16,11 +16,11 @@ from .izzi import *
 
 _LOGGER = logging.getLogger(__name__)
 
-def setup_platform(hass, config, add_entities, discovery_info=None):
+async def async_setup_entry(hass, entry, async_add_entities):
     """Set up the Izzi fan platform."""
     izzibridge = hass.data[DOMAIN]
 
-    add_entities([IzzifastFan("iZZi Fan", izzibridge)], True)
+    async_add_entities([IzzifastFan("iZZi Fan", izzibridge)], True)
 
 
 class IzzifastFan(FanEntity):
@@ -50,7 +50,6 @@ class IzzifastFan(FanEntity):
         _LOGGER.debug(
             "Handle update for fan speed (%d): %s", IZZY_SENSOR_FAN_MODE_ID, value
         )
-        self._izzibridge.data[IZZY_SENSOR_FAN_MODE_ID] = value
         self.schedule_update_ha_state()
 
     @property
@@ -76,28 +75,33 @@ class IzzifastFan(FanEntity):
     @property
     def supported_features(self) -> int:
         """Flag supported features."""
+        if self._izzibridge.get_presets():
+            return FanEntityFeature.SET_SPEED | FanEntityFeature.PRESET_MODE
         return FanEntityFeature.SET_SPEED
 
+    @property
+    def preset_modes(self):
+        """Return the configured presets."""
+        return self._izzibridge.get_presets() or None
+
+    @property
+    def preset_mode(self):
+        """Return the active preset, None once any setting changed."""
+        return self._izzibridge.get_preset()
+
     @property
     def is_on(self) -> bool:
         """Flag is on."""
-        try:
-            mode = self._izzibridge.data[IZZY_SENSOR_FAN_MODE_ID]
-            if mode != None :
-                _LOGGER.debug("Is on True")
-                return True
-            return False
-            _LOGGER.debug("Is on False")
-        except KeyError:
-            _LOGGER.debug("Is on False")
-            return False
+        mode = self._izzibridge.get_state(IZZY_SENSOR_FAN_MODE_ID)
+        if mode != None :
+            _LOGGER.debug("Is on True")
+            return True
+        _LOGGER.debug("Is on False")
+        return False
     @property
     def speed(self):
         """Return the current fan mode."""
-        try:
-            return self._izzibridge.data[IZZY_SENSOR_FAN_MODE_ID]
-        except KeyError:
-            return None
+        return self._izzibridge.get_state(IZZY_SENSOR_FAN_MODE_ID)
 
     def turn_on(self, speed_arg: Optional[int] = None, **kwargs: Any) -> None:
         """Turn on the fan."""
@@ -126,10 +130,16 @@ class IzzifastFan(FanEntity):
                 _LOGGER.error("Wrong percentage value %s", percentage)
          
         if valid_val == True:
-            self._izzibridge.data[IZZY_SENSOR_FAN_MODE_ID] = percentage
+            self._izzibridge.set_local_state(IZZY_SENSOR_FAN_MODE_ID, percentage)
         else:
             _LOGGER.error("Fan percentage not accepted %s", percentage)
 
         # Update current mode
         self.schedule_update_ha_state()
+
+    def set_preset_mode(self, preset_mode: str) -> None:
+        """Apply all settings of a preset at once."""
+        if self._izzibridge.apply_preset(preset_mode) != True:
+            _LOGGER.error("Unknown preset %s", preset_mode)
+        self.schedule_update_ha_state()
  
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+"""Command line monitor and benchmarks, no Home Assistant needed.
+
+Run from the integration directory:
+
+    python -m izzi monitor --host 192.168.1.20 --port 8234
+    python -m izzi monitor --serial /dev/ttyUSB0
+    python -m izzi monitor --replay izzifast_captures/izzi_*.cap --speed 10
+    python -m izzi monitor --emulate
+    python -m izzi monitor --emulate --metrics-port 9101 -q
+    python -m izzi bench
+    python -m izzi scale --units 1 10 50 100
+
+The monitor only listens unless --master is given, then it drives the unit
+like the integration in master mode does.
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+from .const import *
+from .capture import CAPTURE_KIND_RX, CAPTURE_KIND_TX
+from .decoder import SENSOR_NAMES, decode_status_frame, decode_command_frame
+
+def _format_frame(frame) -> str:
+    if frame[IZZI_STATUS_MSG_ID_INDEX] == IZZI_STATUS_MESSAGE_ID:
+        values = decode_status_frame(frame)
+    elif frame[IZZI_STATUS_MSG_ID_INDEX] == IZZI_COMMAND_MESSAGE_ID:
+        values = decode_command_frame(frame)
+    else:
+        return bytes(frame).hex()
+    return " ".join("%s=%s" % (SENSOR_NAMES.get(sensor_id, sensor_id), value) for sensor_id, value in values.items())
+
+def _create_bridge(args):
+    if args.host:
+        from .controller import IzziEthBridge
+        return IzziEthBridge(args.host, args.port)
+    if args.serial:
+        from .controller import IzziSerialBridge
+        return IzziSerialBridge(args.serial)
+    if args.replay:
+        from .emulator import IzziReplayBridge
+        return IzziReplayBridge(args.replay, args.speed)
+    from .emulator import IzziEmulatorBridge
+    return IzziEmulatorBridge(args.frame_interval)
+
+def monitor(args) -> int:
+    from .controller import IzziController
+    for path in args.replay or ():
+        if not os.path.isfile(path):
+            print("No such capture file: %s" % path, file=sys.stderr)
+            return 2
+    bridge = _create_bridge(args)
+    controller = IzziController(bridge, args.master)
+    if args.master:
+        controller.set_unit_on(True)
+
+    counts = {CAPTURE_KIND_RX: 0, CAPTURE_KIND_TX: 0}
+    published = [0]
+
+    def on_frame(ts, kind, frame):
+        if kind in counts:
+            counts[kind] += 1
+        if not args.quiet:
+            print("%.3f %s %s" % (ts, "TX" if kind == CAPTURE_KIND_TX else "RX", _format_frame(frame)))
+
+    def on_sensor(sensor_id, value):
+        published[0] += 1
+        if args.sensors:
+            print("      %s = %s" % (SENSOR_NAMES.get(sensor_id, sensor_id), value))
+
+    controller.add_frame_listener(on_frame)
+    controller.callback_sensor = on_sensor
+    metrics_server = None
+    if args.metrics_port:
+        from .metrics import ControllerMetrics, MetricsServer
+        metrics = ControllerMetrics(controller)
+        controller.add_frame_listener(metrics)
+        metrics_server = MetricsServer((args.metrics_host, args.metrics_port), metrics)
+        metrics_server.start()
+    controller.connect()
+
+    last = time.monotonic()
+    last_counts = (0, 0, 0)
+    try:
+        while not getattr(bridge, "finished", False):
+            time.sleep(min(args.rate_interval, 0.2))
+            now = time.monotonic()
+            if now - last < args.rate_interval:
+                continue
+            current = (counts[CAPTURE_KIND_RX], counts[CAPTURE_KIND_TX], published[0])
+            elapsed = now - last
+            print("-- rx %.1f/s  tx %.1f/s  published %.1f/s" % tuple((c - p) / elapsed for c, p in zip(current, last_counts)))
+            last = now
+            last_counts = current
+    except KeyboardInterrupt:
+        pass
+    finally:
+        controller.disconnect()
+        if metrics_server is not None:
+            metrics_server.stop()
+    print("-- rx %d  tx %d  published %d" % (counts[CAPTURE_KIND_RX], counts[CAPTURE_KIND_TX], published[0]))
+    return 0
+
+def _format_value(value) -> str:
+    return ("%.1f" % value) if isinstance(value, float) else str(value)
+
+def bench(args) -> int:
+    from .bench import BENCHMARKS, run_benchmarks
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            print("Unknown benchmark %s, choose from %s" % (name, ", ".join(BENCHMARKS)), file=sys.stderr)
+            return 2
+    return _report(args, run_benchmarks(args.benchmarks))
+
+def scale(args) -> int:
+    from .bench import run_scale, SCALE_SCOPE
+    print("-- scope: %s" % SCALE_SCOPE)
+    return _report(args, run_scale(args.units, args.duration, args.frame_interval))
+
+def _report(args, document : dict) -> int:
+    import json
+    from .bench import compare_results
+    for name, result in document["results"].items():
+        print("%s: %s" % (name, "  ".join("%s=%s" % (key, _format_value(value)) for key, value in result.items())))
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump(document, output, indent=2)
+    if not args.compare:
+        return 0
+
+    with open(args.compare) as base_file:
+        base = json.load(base_file)
+    regressions = 0
+    print("-- compared with %s" % (base.get("commit") or args.compare))
+    for name, key, base_value, value, change, regressed in compare_results(base, document, args.threshold / 100.0):
+        regressions += regressed
+        print("%-12s %-24s %12s -> %12s  %+6.1f%%%s" % (name, key, _format_value(base_value), _format_value(value), change * 100.0, "  REGRESSION" if regressed else ""))
+    return 1 if regressions else 0
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m izzi", description="iZZi ERV 300 monitor and benchmarks.")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log controller debug messages")
+    commands = parser.add_subparsers(dest="command")
+
+    parser_monitor = commands.add_parser("monitor", help="print decoded frames and rates")
+    source = parser_monitor.add_mutually_exclusive_group()
+    source.add_argument("--host", help="RS485 to ethernet bridge address")
+    source.add_argument("--serial", help="RS485 serial device")
+    source.add_argument("--replay", nargs="+", help="capture files to replay")
+    source.add_argument("--emulate", action="store_true", help="emulated unit, the default")
+    parser_monitor.add_argument("--port", type=int, default=8234)
+    parser_monitor.add_argument("--master", action="store_true", help="send command frames to the unit")
+    parser_monitor.add_argument("--speed", type=float, default=1.0, help="replay speed, 0 as fast as possible")
+    parser_monitor.add_argument("--frame-interval", type=float, default=0.5, help="emulated status frame interval")
+    parser_monitor.add_argument("--rate-interval", type=float, default=5.0, help="seconds between rate lines")
+    parser_monitor.add_argument("--sensors", action="store_true", help="print published sensor values")
+    parser_monitor.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this port")
+    parser_monitor.add_argument("--metrics-host", default="127.0.0.1", help="metrics bind address")
+    parser_monitor.add_argument("-q", "--quiet", action="store_true", help="print rates only")
+
+    parser_bench = commands.add_parser("bench", help="benchmarks of the controller hot paths")
+    parser_bench.add_argument("benchmarks", nargs="*", metavar="benchmark", help="benchmarks to run, all by default")
+
+    parser_scale = commands.add_parser("scale", help="many emulated controllers feeding one asyncio loop, no HA core")
+    parser_scale.add_argument("--units", type=int, nargs="+", default=[1, 10, 50, 100], help="unit counts to run")
+    parser_scale.add_argument("--duration", type=float, default=30.0, help="seconds per unit count")
+    parser_scale.add_argument("--frame-interval", type=float, default=0.5, help="emulated status frame interval")
+
+    for results_parser in (parser_bench, parser_scale):
+        results_parser.add_argument("--json", help="store results in this file")
+        results_parser.add_argument("--compare", help="compare with results stored by --json, exit code 1 on regression")
+        results_parser.add_argument("--threshold", type=float, default=10.0, help="regression threshold in percent")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING)
+    if args.command == "monitor":
+        return monitor(args)
+    if args.command == "bench":
+        return bench(args)
+    if args.command == "scale":
+        return scale(args)
+    parser.print_help()
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
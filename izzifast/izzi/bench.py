@@ -0,0 +1,526 @@
+#!/usr/bin/env python
+"""Benchmarks of the controller hot paths, run through python -m izzi bench.
+
+Results can be stored as JSON and compared with an earlier run:
+
+    python -m izzi bench --json results/$(git rev-parse --short HEAD).json
+    python -m izzi bench --compare results/base.json
+"""
+
+import asyncio
+import importlib
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+from .const import *
+from .decoder import STATUS_UNPACK, decode_status_frames
+from .state import IzziStateTable
+from .controller import IzziController
+from .emulator import IzziEmulatorBridge
+
+def _status_frames(count : int):
+    bridge = IzziEmulatorBridge(interval=0, frames=count)
+    bridge.connect()
+    return [bridge.read_message() for _ in range(count)]
+
+def _percentile(values, percent : float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100.0))]
+
+def bench_parse(frames : int = 100000) -> dict:
+    """Status frame decoding, live per frame path and NumPy batch path."""
+    messages = _status_frames(frames)
+    state = IzziStateTable()
+    set_current = state.set_current
+    unpack = STATUS_UNPACK
+
+    start = time.perf_counter()
+    for message in messages:
+        for sensor_id, index, unpack_from in unpack:
+            set_current(sensor_id, unpack_from(message, index)[0])
+    elapsed = time.perf_counter() - start
+    result = {"frames": frames, "live_frames_per_s": frames / elapsed}
+
+    try:
+        import numpy
+    except ImportError:
+        result["batch_skipped"] = "numpy not installed"
+        return result
+    buffer = b''.join(messages)
+    start = time.perf_counter()
+    decoded = decode_status_frames(buffer)
+    decoded["outdoor_temperature"].mean()
+    elapsed = time.perf_counter() - start
+    result["batch_frames_per_s"] = frames / elapsed
+    return result
+
+def bench_callback(frames : int = 20000) -> dict:
+    """Full connection loop iterations with publishing into a counting callback."""
+    bridge = IzziEmulatorBridge(interval=0, frames=frames)
+    controller = IzziController(bridge, False)
+    published = [0]
+
+    def callback(sensor_id, value):
+        published[0] += 1
+    controller.callback_sensor = callback
+
+    start = time.monotonic()
+    controller.connect()
+    while bridge.exhausted_at is None:
+        time.sleep(0.01)
+    elapsed = bridge.exhausted_at - start
+    controller.disconnect()
+    return {"frames": frames,
+            "loop_frames_per_s": frames / elapsed,
+            "callbacks": published[0],
+            "callbacks_per_s": published[0] / elapsed}
+
+def bench_command_latency(commands : int = 20, frame_interval : float = 0.1) -> dict:
+    """Time from a set_fan_speed call until the frame carrying it is written."""
+    bridge = IzziEmulatorBridge(interval=frame_interval)
+    controller = IzziController(bridge, True)
+    written = threading.Event()
+    expected = [None]
+
+    def on_write(frame):
+        if frame[IZZI_CMD_MSG_SUPPLY_FAN_SPEED_INDEX] == expected[0]:
+            written.set()
+    bridge.on_write = on_write
+
+    latencies = []
+    controller.connect()
+    try:
+        for i in range(commands):
+            speed = 40 + i % 2 * 20
+            written.clear()
+            expected[0] = speed
+            start = time.monotonic()
+            controller.set_fan_speed(speed, speed)
+            if not written.wait(10):
+                break
+            latencies.append((time.monotonic() - start) * 1000.0)
+    finally:
+        controller.disconnect()
+    if not latencies:
+        return {"commands": 0}
+    return {"commands": len(latencies),
+            "frame_interval_s": frame_interval,
+            "latency_min_ms": min(latencies),
+            "latency_p50_ms": _percentile(latencies, 50),
+            "latency_p95_ms": _percentile(latencies, 95),
+            "latency_max_ms": max(latencies)}
+
+def _feed(write, messages, started : threading.Event, delay : float):
+    # Wait until the bridge finished draining stale data on connect
+    started.wait()
+    time.sleep(delay)
+    chunk = 64
+    for i in range(0, len(messages), chunk):
+        write(b''.join(messages[i:i + chunk]))
+
+def _read_frames(bridge, frames : int) -> dict:
+    received = 0
+    start = None
+    while received < frames:
+        if bridge.read_message(timeout=2.0) is None:
+            break
+        if start is None:
+            start = time.perf_counter()
+        received += 1
+    elapsed = time.perf_counter() - start if start is not None else 0.0
+    return {"frames": received, "read_frames_per_s": received / elapsed if elapsed > 0 else 0.0}
+
+def bench_eth_read(frames : int = 50000) -> dict:
+    """IzziEthBridge.read_message against a local TCP server."""
+    from .controller import IzziEthBridge
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+    messages = _status_frames(frames)
+    started = threading.Event()
+
+    def serve():
+        client, address = server.accept()
+        try:
+            _feed(client.sendall, messages, started, 0.05)
+        finally:
+            started.wait()
+            time.sleep(0.5)
+            client.close()
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+
+    bridge = IzziEthBridge("127.0.0.1", server.getsockname()[1])
+    try:
+        bridge.connect()
+        started.set()
+        return _read_frames(bridge, frames)
+    finally:
+        bridge.disconnect()
+        server.close()
+
+def bench_serial_read(frames : int = 20000) -> dict:
+    """IzziSerialBridge.read_message on a pseudo terminal."""
+    try:
+        import serial
+    except ImportError:
+        return {"skipped": "pyserial not installed"}
+    from .controller import IzziSerialBridge
+    master, slave = os.openpty()
+    messages = _status_frames(frames)
+    started = threading.Event()
+    thread = threading.Thread(target=_feed, args=(lambda data: os.write(master, data), messages, started, 0.05), daemon=True)
+    thread.start()
+
+    bridge = IzziSerialBridge(os.ttyname(slave))
+    try:
+        bridge.connect()
+        started.set()
+        return _read_frames(bridge, frames)
+    finally:
+        bridge.disconnect()
+        os.close(slave)
+        os.close(master)
+
+def bench_cf(iterations : int = 20000) -> dict:
+    """CfController sample intake and get_supply_speed / get_extract_speed."""
+    try:
+        import numpy
+    except ImportError:
+        return {"skipped": "numpy not installed"}
+    from .controller import CfController
+    controller = CfController()
+    controller.set_params_max(120.0)
+    controller.set_enabled(True)
+    start = time.perf_counter()
+    for i in range(iterations):
+        controller.add_supply_param(20.0 + i % 7)
+        controller.add_extract_param(22.0 - i % 5)
+        controller.get_supply_speed(50)
+        controller.get_extract_speed(50)
+    elapsed = time.perf_counter() - start
+    return {"iterations": iterations, "cf_ticks_per_s": iterations / elapsed}
+
+class _BenchHass(object):
+    """The parts of HomeAssistant used by dispatcher_send and async_call_later."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.data = {}
+
+    def async_run_hass_job(self, job, *args, **kwargs):
+        return job.target(*args)
+
+    def verify_event_loop_thread(self, what):
+        pass
+
+class _BenchStore(object):
+
+    def async_delay_save(self, data_func, delay):
+        pass
+
+    async def async_save(self, data):
+        pass
+
+def _load_integration():
+    """The integration package around this izzi package, None without homeassistant."""
+    parent, name = os.path.split(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    if parent not in sys.path:
+        sys.path.append(parent)
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+def bench_dispatch(updates : int = 50000) -> dict:
+    """IzzifastBridge.sensor_callback handing values to an event loop thread.
+
+    Runs the integration's own sensor callback, dispatcher_send of
+    homeassistant and the cache save scheduling, with a stub hass that only
+    provides the loop and hass.data. Skipped without homeassistant.
+    """
+    integration = _load_integration()
+    if integration is None:
+        return {"skipped": "homeassistant is not installed"}
+    from homeassistant.helpers.dispatcher import async_dispatcher_connect
+
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    hass = _BenchHass(loop)
+    bridge = integration.IzzifastBridge(hass, IzziEmulatorBridge(), "bench", 0, True)
+    bridge.set_cache_store(_BenchStore())
+    delivered = [0]
+    done = threading.Event()
+
+    def listener(value):
+        delivered[0] += 1
+        if delivered[0] == updates:
+            done.set()
+
+    async def subscribe():
+        for sensor_id in range(IZZY_SENSOR_ID_COUNT):
+            async_dispatcher_connect(hass, integration.SIGNAL_IZZIFAST_UPDATE_RECEIVED.format(sensor_id), listener)
+    asyncio.run_coroutine_threadsafe(subscribe(), loop).result(5)
+
+    start = time.perf_counter()
+    for i in range(updates):
+        bridge.sensor_callback(i % IZZY_SENSOR_ID_COUNT, i)
+    queued = time.perf_counter() - start
+    done.wait(30)
+    elapsed = time.perf_counter() - start
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+    return {"updates": delivered[0],
+            "callback_per_s": updates / queued,
+            "delivered_per_s": delivered[0] / elapsed}
+
+def bench_cf_service(calls : int = 50000, frame_interval : float = 0.1) -> dict:
+    """cf_params service handler of the integration feeding a running controller.
+
+    Calls the handler registered for izzifast.cf_params with the call data
+    HA passes, through IzzifastBridge into the CF sample queue, while the
+    controller thread drains it on every frame of an emulated unit. HA's
+    service registry (schema check, job scheduling) is not part of it.
+    Skipped without homeassistant.
+    """
+    integration = _load_integration()
+    if integration is None:
+        return {"skipped": "homeassistant is not installed"}
+    from types import SimpleNamespace
+
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    bridge = integration.IzzifastBridge(_BenchHass(loop), IzziEmulatorBridge(frame_interval), "bench", 0, True)
+    bridge.set_cache_store(_BenchStore())
+    handler = integration._cf_param_services(bridge)["cf_params"]
+    call_data = [SimpleNamespace(data={"supply": 20.0 + i % 7, "extract": 22.0 - i % 5}) for i in range(calls)]
+    bridge.controller.connect()
+    durations = []
+    try:
+        start = time.perf_counter()
+        for call in call_data:
+            called = time.perf_counter()
+            handler(call)
+            durations.append(time.perf_counter() - called)
+        elapsed = time.perf_counter() - start
+    finally:
+        bridge.controller.disconnect()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+    return {"calls": calls,
+            "calls_per_s": calls / elapsed,
+            "call_p99_ms": _percentile(durations, 99) * 1000.0}
+
+def _busy_loop(loop, stop : threading.Event, busy : float):
+    """Keep an event loop running callbacks holding the GIL for busy seconds."""
+    def work():
+        end = time.perf_counter() + busy
+        while time.perf_counter() < end:
+            pass
+        if not stop.is_set():
+            loop.call_soon(work)
+    loop.call_soon_threadsafe(work)
+
+def _write_jitter(times, expected : float, prefix : str) -> dict:
+    deviations = [abs(later - earlier - expected) * 1000.0 for earlier, later in zip(times, times[1:])]
+    if not deviations:
+        return {prefix + "writes": 0}
+    return {prefix + "writes": len(times),
+            prefix + "jitter_p50_ms": _percentile(deviations, 50),
+            prefix + "jitter_p99_ms": _percentile(deviations, 99),
+            prefix + "jitter_max_ms": max(deviations)}
+
+def bench_jitter(duration : float = 10.0, frame_interval : float = 0.1, busy : float = 0.05) -> dict:
+    """Command write timing with a loaded event loop, controller thread and worker process.
+
+    An event loop thread runs CPU bound callbacks of busy seconds back to
+    back, like a Home Assistant instance under load. The deviation of the
+    intervals between written command frames from twice the frame interval
+    is reported for the in-process controller and IzziProcessController.
+    """
+    from .worker import IzziProcessController
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    stop = threading.Event()
+    _busy_loop(loop, stop, busy)
+
+    results = {}
+    try:
+        for prefix, controller_class in (("thread_", IzziController), ("process_", IzziProcessController)):
+            controller = controller_class(IzziEmulatorBridge(interval=frame_interval), True)
+            controller.set_unit_on(True)
+            controller.connect()
+            time.sleep(duration)
+            if prefix == "thread_":
+                written = controller._bridge.written
+            else:
+                written = controller.bridge_attribute("written")
+            controller.disconnect()
+            results.update(_write_jitter([ts for ts, frame in written], 2 * frame_interval, prefix))
+    finally:
+        stop.set()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+    results["busy_callback_s"] = busy
+    return results
+
+BENCHMARKS = {
+    "parse": bench_parse,
+    "eth_read": bench_eth_read,
+    "serial_read": bench_serial_read,
+    "cf": bench_cf,
+    "cf_service": bench_cf_service,
+    "loop": bench_callback,
+    "dispatch": bench_dispatch,
+    "latency": bench_command_latency,
+    "jitter": bench_jitter,
+}
+
+def _rss_kb() -> int:
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+SCALE_SCOPE = "controller threads and one plain asyncio loop, no HA dispatcher, state machine or recorder"
+
+def bench_scale(units : int, duration : float = 30.0, frame_interval : float = 0.5) -> dict:
+    """N emulated units, each with its controller thread, feeding one plain asyncio loop.
+
+    Measures the controller side only: connection threads, decoding and the
+    thread to loop hand-over with call_soon_threadsafe. No HA core runs, so
+    dispatcher, state machine and recorder costs are not included, and the
+    integration itself sets up a single unit per HA instance. Measured are
+    loop lag, CPU time, RSS, thread count and the latency from reading a
+    frame to delivering its updates on the loop.
+    """
+    loop = asyncio.new_event_loop()
+    loop_thread = threading.Thread(target=loop.run_forever, daemon=True)
+    loop_thread.start()
+    latencies = []
+    lags = []
+    delivered = [0]
+    running = [True]
+
+    def deliver(read_at, sensor_id, value):
+        latencies.append(time.monotonic() - read_at)
+        delivered[0] += 1
+
+    async def watch_lag(interval : float = 0.05):
+        while running[0]:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            lags.append(loop.time() - start - interval)
+
+    controllers = []
+    for unit in range(units):
+        bridge = IzziEmulatorBridge(interval=frame_interval, phase=unit * 97)
+        controller = IzziController(bridge, True)
+        controller.set_unit_on(True)
+
+        def sensor_callback(sensor_id, value, bridge=bridge):
+            loop.call_soon_threadsafe(deliver, bridge.last_read_at, sensor_id, value)
+        controller.callback_sensor = sensor_callback
+        controllers.append(controller)
+
+    lag_task = asyncio.run_coroutine_threadsafe(watch_lag(), loop)
+    rss_start = _rss_kb()
+    cpu_start = time.process_time()
+    wall_start = time.monotonic()
+    for controller in controllers:
+        controller.connect()
+    time.sleep(duration)
+    threads = threading.active_count()
+    cpu = time.process_time() - cpu_start
+    wall = time.monotonic() - wall_start
+    rss = _rss_kb()
+    for controller in controllers:
+        controller.disconnect()
+    running[0] = False
+    lag_task.result(5)
+    loop.call_soon_threadsafe(loop.stop)
+    loop_thread.join()
+    loop.close()
+
+    result = {"units": units,
+              "frame_interval_s": frame_interval,
+              "threads": threads,
+              "rss_kb": rss,
+              "rss_growth_kb": rss - rss_start,
+              "cpu_percent": cpu / wall * 100.0,
+              "updates": delivered[0],
+              "updates_per_s": delivered[0] / wall}
+    if lags:
+        result["loop_lag_p50_ms"] = _percentile(lags, 50) * 1000.0
+        result["loop_lag_p99_ms"] = _percentile(lags, 99) * 1000.0
+        result["loop_lag_max_ms"] = max(lags) * 1000.0
+    if latencies:
+        result["update_latency_p50_ms"] = _percentile(latencies, 50) * 1000.0
+        result["update_latency_p95_ms"] = _percentile(latencies, 95) * 1000.0
+        result["update_latency_max_ms"] = max(latencies) * 1000.0
+    return result
+
+def _direction(key : str) -> int:
+    """1 if higher is better, -1 if lower is better, 0 for counts."""
+    if key.endswith("_per_s"):
+        return 1
+    if key.endswith("_ms") or key.endswith("_kb") or key.endswith("_percent"):
+        return -1
+    return 0
+
+def _document(results : dict) -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {"commit": commit,
+            "time": time.time(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "results": results}
+
+def run_benchmarks(names=None) -> dict:
+    """Run benchmarks, returns a JSON serialisable result document."""
+    return _document({name: BENCHMARKS[name]() for name in names or BENCHMARKS})
+
+def run_scale(units=(1, 10, 50, 100), duration : float = 30.0, frame_interval : float = 0.5) -> dict:
+    """Run bench_scale for every unit count, same document format as run_benchmarks.
+
+    scope in the document says what was measured, so results are not taken
+    for HA scaling numbers.
+    """
+    document = _document({"scale_%d" % count: bench_scale(count, duration, frame_interval) for count in units})
+    document["scope"] = SCALE_SCOPE
+    return document
+
+def compare_results(base : dict, current : dict, threshold : float = 0.1):
+    """Yield (benchmark, key, base, current, change, regressed) for comparable metrics.
+
+    change is relative, positive means better. A metric regressed when it
+    got worse by more than threshold.
+    """
+    for name, values in current["results"].items():
+        base_values = base["results"].get(name, {})
+        for key, value in values.items():
+            direction = _direction(key)
+            base_value = base_values.get(key)
+            if direction == 0 or not isinstance(base_value, (int, float)) or not base_value:
+                continue
+            change = (value - base_value) / base_value * direction
+            yield name, key, base_value, value, change, change < -threshold
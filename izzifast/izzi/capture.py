@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+import os
+import struct
+import time
+import logging
+
+_LOGGER = logging.getLogger('izzicontroller')
+
+CAPTURE_MAGIC = b'IZZICAP1'
+
+# Timestamp, kind, raw frame
+CAPTURE_RECORD = struct.Struct('<dB15s')
+
+CAPTURE_KIND_RX = 0
+CAPTURE_KIND_TX = 1
+CAPTURE_KIND_CF_SAMPLE = 2
+
+# Payload of CF sample records: channel, value
+CAPTURE_CF_SAMPLE = struct.Struct('<Bd6x')
+
+class CaptureWriter(object):
+    """Records raw bus frames into daily capture files.
+
+    Files are named izzi_YYYYMMDD.cap (UTC) and hold CAPTURE_MAGIC followed
+    by fixed size CAPTURE_RECORD records, so they can be memory mapped as
+    an array of records. Meant to be registered as a controller frame listener.
+    """
+
+    BUFFER_SIZE = 64 * 1024
+
+    def __init__(self, directory : str):
+        self.directory = directory
+        self._file = None
+        self._day = None
+        self.records = 0
+
+    def _open(self, day : int):
+        self.close()
+        os.makedirs(self.directory, exist_ok=True)
+        name = time.strftime("izzi_%Y%m%d.cap", time.gmtime(day * 86400))
+        path = os.path.join(self.directory, name)
+        self._file = open(path, 'ab', buffering=self.BUFFER_SIZE)
+        size = self._file.tell()
+        # A crash during a buffered write leaves a torn record at the end,
+        # drop it so appended records stay aligned
+        whole = len(CAPTURE_MAGIC) + (size - len(CAPTURE_MAGIC)) // CAPTURE_RECORD.size * CAPTURE_RECORD.size
+        if size < len(CAPTURE_MAGIC):
+            self._file.truncate(0)
+            self._file.write(CAPTURE_MAGIC)
+        elif whole != size:
+            _LOGGER.warning("Dropping %d bytes of a torn record at the end of %s", size - whole, path)
+            self._file.truncate(whole)
+        self._day = day
+        _LOGGER.info("Capturing frames to %s", path)
+
+    def __call__(self, ts : float, kind : int, frame):
+        day = int(ts // 86400)
+        try:
+            if day != self._day:
+                self._open(day)
+            self._file.write(CAPTURE_RECORD.pack(ts, kind, bytes(frame)))
+            self.records += 1
+        except OSError as exc:
+            _LOGGER.error("Capture failed: %s", exc)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._day = None
+
+
+def read_capture(path : str):
+    """Yield (timestamp, kind, frame) records of a capture file."""
+    with open(path, 'rb') as capture:
+        if capture.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError("Not an izzi capture file: %s" % path)
+        while True:
+            data = capture.read(CAPTURE_RECORD.size)
+            if len(data) < CAPTURE_RECORD.size:
+                return
+            yield CAPTURE_RECORD.unpack(data)
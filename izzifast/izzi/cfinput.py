@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+import os
+import socket
+import stat
+import struct
+import select
+import logging
+import threading
+from collections import deque
+
+_LOGGER = logging.getLogger('izzicontroller')
+
+CF_CHANNEL_SUPPLY = 0
+CF_CHANNEL_EXTRACT = 1
+
+def cf_expected_param(params_max : float, speed : float) -> float:
+    """Expected CF module param for a fan running at speed percent."""
+    speed_norm = speed / 100.0
+    return max(0.0, params_max * (speed_norm*speed_norm*speed_norm) + 40.0 * speed_norm - 6.0)
+
+
+class CfSampleQueue(object):
+    """Buffers CF pressure samples until the controller loop consumes them.
+
+    deque append/popleft are atomic, so producers (HA event loop, socket
+    thread, service calls) never take a lock and never block the loop.
+    """
+
+    QUEUE_LENGTH = 1024
+
+    def __init__(self, length : int = QUEUE_LENGTH):
+        self._samples = deque([], length)
+        self.received = 0
+
+    def push(self, channel : int, value : float):
+        self._samples.append((channel, value))
+        self.received += 1
+
+    def push_pair(self, supply : float, extract : float):
+        self._samples.append((CF_CHANNEL_SUPPLY, supply))
+        self._samples.append((CF_CHANNEL_EXTRACT, extract))
+        self.received += 2
+
+    def drain(self) -> list:
+        """Return all pending samples, oldest first."""
+        samples = []
+        popleft = self._samples.popleft
+        while True:
+            try:
+                samples.append(popleft())
+            except IndexError:
+                return samples
+
+    def __len__(self):
+        return len(self._samples)
+
+
+class CfSocketSource(object):
+    """Receives CF pressure samples on a local datagram socket.
+
+    address is either a (host, port) tuple for UDP or a path for a Unix
+    datagram socket. Every datagram carries one sample pair, either packed
+    as two little endian floats or as ASCII "supply,extract". Either value
+    may be left empty in the ASCII form to update only one fan.
+    """
+
+    PAIR_STRUCT = struct.Struct('<ff')
+
+    def __init__(self, address, queue : CfSampleQueue):
+        self.address = address
+        self._queue = queue
+        self._socket = None
+        self._thread = None
+        self._stopping = False
+        self.invalid = 0
+
+    def start(self):
+        if isinstance(self.address, str):
+            # A socket file left by an unclean stop makes bind fail
+            self._unlink()
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        else:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind(self.address)
+        self._socket.setblocking(0)
+        self._stopping = False
+        self._thread = threading.Thread(target=self._receive_loop, name="izzi_cf_input", daemon=True)
+        self._thread.start()
+        _LOGGER.info("CF input listening on %s", str(self.address))
+
+    def stop(self):
+        self._stopping = True
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+            if isinstance(self.address, str):
+                self._unlink()
+
+    def _unlink(self):
+        """Remove the Unix socket file, other files at the path are kept."""
+        try:
+            if stat.S_ISSOCK(os.stat(self.address).st_mode):
+                os.unlink(self.address)
+        except FileNotFoundError:
+            pass
+
+    def _receive_loop(self):
+        while not self._stopping:
+            ready = select.select([self._socket], [], [], 0.5)
+            if not ready[0]:
+                continue
+            # Drain everything that is pending before going back to select
+            while True:
+                try:
+                    data = self._socket.recv(64)
+                except BlockingIOError:
+                    break
+                except OSError as exc:
+                    _LOGGER.error(exc)
+                    break
+                self._parse(data)
+
+    def _parse(self, data : bytes):
+        if len(data) == self.PAIR_STRUCT.size:
+            supply, extract = self.PAIR_STRUCT.unpack(data)
+            self._queue.push_pair(supply, extract)
+            return
+        try:
+            fields = data.decode('ascii').strip().split(',')
+            if len(fields) != 2:
+                raise ValueError
+            if fields[0]:
+                self._queue.push(CF_CHANNEL_SUPPLY, float(fields[0]))
+            if fields[1]:
+                self._queue.push(CF_CHANNEL_EXTRACT, float(fields[1]))
+        except ValueError:
+            self.invalid += 1
+            _LOGGER.debug("Invalid CF sample %s", data)
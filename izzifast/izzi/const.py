@@ -33,6 +33,10 @@ IZZY_CMD_BYPASS_MODE_AUTO = 0
 IZZY_CMD_BYPASS_MODE_OPEN = 1
 IZZY_CMD_BYPASS_MODE_CLOSED = 2
 
+# Bypass comfort temperature accepted by the controller
+IZZY_CMD_BYPASS_TEMP_MIN = 18
+IZZY_CMD_BYPASS_TEMP_MAX = 26
+
 IZZY_CMD_UNIT_STATE_ON = 0
 IZZY_CMD_UNIT_STATE_OFF = 1
 
@@ -60,3 +64,69 @@ IZZY_SENSOR_DEFROST_STATE_ID = 0x0F
 IZZY_SENSOR_EXTRACT_CORRECTION_STATE_ID = 0x10
 IZZY_SENSOR_CF_EXTRACT_CORRECTION_ID = 0x11
 IZZY_SENSOR_CF_SUPPLY_CORRECTION_ID = 0x12
+IZZY_SENSOR_TEMPERATURE_DELTA_ID = 0x13
+IZZY_SENSOR_RECOVERED_POWER_ID = 0x14
+
+# Internal, revision of CF controller corrections, never published
+IZZY_SENSOR_CF_STATE_ID = 0x15
+
+IZZY_SENSOR_RECOVERED_HEAT_ENERGY_ID = 0x16
+IZZY_SENSOR_RECOVERED_COOL_ENERGY_ID = 0x17
+
+IZZY_SENSOR_FILTER_LOAD_ID = 0x18
+IZZY_SENSOR_FILTER_DAYS_ID = 0x19
+
+# Size of tables indexed by sensor id
+IZZY_SENSOR_ID_COUNT = 0x1A
+
+# Layout of status frame fields: sensor id, index in frame, unpack type.
+# Shared by the live decoder in controller.py and the batch decoder in decoder.py.
+IZZI_STATUS_LAYOUT = ((IZZY_SENSOR_TEMPERATURE_SUPPLY_ID, IZZI_STATUS_MSG_SUPPLY_AIR_TEMP_INDEX, '>b'),
+                      (IZZY_SENSOR_TEMPERATURE_EXTRACT_ID, IZZI_STATUS_MSG_EXTRACT_AIR_TEMP_INDEX, '>b'),
+                      (IZZY_SENSOR_TEMPERATURE_EXHAUST_ID, IZZI_STATUS_MSG_EXHAUST_AIR_TEMP_INDEX, '>b'),
+                      (IZZY_SENSOR_TEMPERATURE_OUTDOOR_ID, IZZI_STATUS_MSG_OUTDOR_AIR_TEMP_INDEX, '>b'),
+                      (IZZY_SENSOR_BYPASS_STATE_ID, IZZI_STATUS_MSG_BYPASS_STATE_INDEX, '>B'),
+                      (IZZY_SENSOR_COVER_STATE_ID, IZZI_STATUS_MSG_COVER_STATE_INDEX, '>B'),
+                      (IZZY_SENSOR_DEFROST_STATE_ID, IZZI_STATUS_MSG_DEFROST_STATE_INDEX, '>B'))
+
+# Layout of command frame fields: sensor id, index in frame, unpack type
+IZZI_COMMAND_LAYOUT = ((IZZY_SENSOR_FAN_SUPPLY_SPEED_ID, IZZI_CMD_MSG_SUPPLY_FAN_SPEED_INDEX, '>B'),
+                       (IZZY_SENSOR_FAN_EXTRACT_SPEED_ID, IZZI_CMD_MSG_EXTRACT_FAN_SPEED_INDEX, '>B'),
+                       (IZZY_SENSOR_UNIT_STATE_ID, IZZI_CMD_MSG_UNIT_STATE_INDEX, '>B'),
+                       (IZZY_SENSOR_BYPASS_TEMP_ID, IZZI_CMD_MSG_BYPASS_TEMP_INDEX, '>B'),
+                       (IZZY_SENSOR_BYPASS_MODE_ID, IZZI_CMD_MSG_BYPASS_MODE_INDEX, '>B'))
+
+IZZI_MESSAGE_LENGTH = 15
+
+# Supply airflow in m3/h at given fan speed in percent, linearly interpolated
+IZZY_AIRFLOW_CURVE = ((0, 0.0), (100, 300.0))
+
+# Volumetric heat capacity of air, J/(m3*K)
+IZZY_AIR_HEAT_CAPACITY = 1206.0
+
+# Configuration keys of sensors
+IZZY_SENSOR_KEYS = {
+    "extract_fan_speed": IZZY_SENSOR_FAN_EXTRACT_SPEED_ID,
+    "supply_fan_speed": IZZY_SENSOR_FAN_SUPPLY_SPEED_ID,
+    "supply_temperature": IZZY_SENSOR_TEMPERATURE_SUPPLY_ID,
+    "extract_temperature": IZZY_SENSOR_TEMPERATURE_EXTRACT_ID,
+    "exhaust_temperature": IZZY_SENSOR_TEMPERATURE_EXHAUST_ID,
+    "outdoor_temperature": IZZY_SENSOR_TEMPERATURE_OUTDOOR_ID,
+    "bypass_state": IZZY_SENSOR_BYPASS_STATE_ID,
+    "unit_state": IZZY_SENSOR_UNIT_STATE_ID,
+    "bypass_temp": IZZY_SENSOR_BYPASS_TEMP_ID,
+    "bypass_mode": IZZY_SENSOR_BYPASS_MODE_ID,
+    "vent_mode": IZZY_SENSOR_VENT_MODE_ID,
+    "cover_state": IZZY_SENSOR_COVER_STATE_ID,
+    "efficiency": IZZY_SENSOR_EFFICIENCY_ID,
+    "defrost_state": IZZY_SENSOR_DEFROST_STATE_ID,
+    "extract_correction": IZZY_SENSOR_EXTRACT_CORRECTION_STATE_ID,
+    "cf_extract_correction": IZZY_SENSOR_CF_EXTRACT_CORRECTION_ID,
+    "cf_supply_correction": IZZY_SENSOR_CF_SUPPLY_CORRECTION_ID,
+    "temperature_delta": IZZY_SENSOR_TEMPERATURE_DELTA_ID,
+    "recovered_power": IZZY_SENSOR_RECOVERED_POWER_ID,
+    "recovered_heat_energy": IZZY_SENSOR_RECOVERED_HEAT_ENERGY_ID,
+    "recovered_cool_energy": IZZY_SENSOR_RECOVERED_COOL_ENERGY_ID,
+    "filter_load": IZZY_SENSOR_FILTER_LOAD_ID,
+    "filter_days": IZZY_SENSOR_FILTER_DAYS_ID,
+}
@@ -9,14 +9,35 @@ import sys
 import select
 import logging
 import threading
-import serial
-from numpy import median
-from numpy import mean
 from array import array
 from collections import deque
 from .const import *
+from .cfinput import CfSampleQueue, cf_expected_param, CF_CHANNEL_SUPPLY, CF_CHANNEL_EXTRACT
+from .state import IzziStateTable
+from .derived import create_derived_sensors
+from .energy import RecoveredEnergyIntegrator
+from .filters import SampleWindow
+from .history import IzziHistory
+from .capture import CAPTURE_KIND_RX, CAPTURE_KIND_TX, CAPTURE_KIND_CF_SAMPLE, CAPTURE_CF_SAMPLE
+from .filterload import FilterLoadMonitor, FILTER_LOAD_PUBLISH_INTERVAL
+from .decoder import STATUS_UNPACK
+from .profiler import ThreadSampler
+from .presets import IzziPreset
+from .schedule import IzziSchedule, week_second, SCHEDULE_RECHECK_INTERVAL, SECONDS_PER_WEEK
 from . import *
 
+_numpy_mean = None
+
+def mean(values):
+    # NumPy and pyserial are imported on first use, so importing the
+    # controller stays fast for HA startup and the command line tools.
+    # The import is cached, mean runs on the status frame path.
+    global _numpy_mean
+    if _numpy_mean is None:
+        from numpy import mean as numpy_mean
+        _numpy_mean = numpy_mean
+    return _numpy_mean(values)
+
 _LOGGER = logging.getLogger('izzicontroller')
 
 #values = array('B', [0x64, 0x19, 0x00, 0x14, 0x00, 0x16, 0x05, 0x00, 0x17, 0x02, 0x28, 0x28, 0x00, 0x00, 0x00])
@@ -65,6 +86,7 @@ class IzziSerialBridge(IzziBridge):
         """Open connection to the bridge."""
 
         if self._serialport is None:
+            import serial
             self._serialport = serial.Serial(self.usbname, 9600, timeout=0, parity=serial.PARITY_NONE, stopbits=serial.STOPBITS_ONE, bytesize=serial.EIGHTBITS)
             # Clear buffered data
             while True:
@@ -257,8 +279,18 @@ class CfController(object):
     _extract_exp_param = 0.0
     
     
+    _supply_error = 0.0
+    _extract_error = 0.0
+    
+    # Incremented whenever a base correction changes
+    revision = 0
+    
     def __init__(self):
         self._module_enabled = False
+        self._params_supply = deque([], self.CF_PARAMS_LENGTH)
+        self._params_extract = deque([], self.CF_PARAMS_LENGTH)
+        self._corrections_supply = deque([], self.CF_CORRECTION_LENGTH)
+        self._corrections_extract = deque([], self.CF_CORRECTION_LENGTH)
     
     def set_enabled(self, enabled : bool):
         self._module_enabled = enabled
@@ -270,12 +302,17 @@ class CfController(object):
     def set_current_params(self, supply : float, extract : float):
         self._params_supply.append(supply)
         self._params_extract.append(extract)
+    
+    def add_supply_param(self, supply : float):
+        self._params_supply.append(supply)
+    
+    def add_extract_param(self, extract : float):
+        self._params_extract.append(extract)
    
     def get_supply_speed(self, exp_speed : int) -> int:
         if int(self._supply_speed) != exp_speed :
             self._supply_speed = float(exp_speed)
-            supply_norm = self._supply_speed / 100.0
-            self._supply_exp_param = max(0.0, self._params_max* (supply_norm*supply_norm*supply_norm) + 40.0 * supply_norm - 6.0)
+            self._supply_exp_param = cf_expected_param(self._params_max, self._supply_speed)
             self._params_supply.clear()
             #self._supply_base_correction = 0
             self._corrections_supply.clear()
@@ -291,6 +328,7 @@ class CfController(object):
                 supply_param_avg = mean(self._params_supply)
         
                 paramDiff = supply_param_avg - self._supply_exp_param
+                self._supply_error = paramDiff
                 
                 # convert difference to percent and change sign
                 diffPerc = (paramDiff / self._params_max) * -100.0
@@ -311,6 +349,7 @@ class CfController(object):
                         self._supply_base_correction += abs(supply_correction_avg) / supply_correction_avg
                         if abs(self._supply_base_correction) > correction_limit :
                             self._supply_base_correction = correction_limit * abs(self._supply_base_correction) / self._supply_base_correction
+                        self.revision += 1
                     self._corrections_supply.clear()
                     
                 _LOGGER.debug("CF Supply diff %f, correction %d, avg %f, base %d", paramDiff, self._supply_speed_correction, supply_param_avg, self._supply_base_correction)
@@ -325,8 +364,7 @@ class CfController(object):
     def get_extract_speed(self, exp_speed : int) -> int:
         if int(self._extract_speed) != exp_speed :
             self._extract_speed = float(exp_speed)
-            extract_norm = self._extract_speed / 100.0
-            self._extract_exp_param = max(0.0, self._params_max* (extract_norm*extract_norm*extract_norm) + 40.0 * extract_norm - 6.0)
+            self._extract_exp_param = cf_expected_param(self._params_max, self._extract_speed)
             self._params_extract.clear()
             #self._extract_base_correction = 0
             self._corrections_extract.clear()
@@ -342,6 +380,7 @@ class CfController(object):
                 extract_param_avg = mean(self._params_extract)
                 
                 paramDiff = extract_param_avg - self._extract_exp_param
+                self._extract_error = paramDiff
                 # convert difference to percent and change sign
                 diffPerc = (paramDiff / self._params_max) * -100.0
                 # If speed higher allow bigger differences
@@ -361,6 +400,7 @@ class CfController(object):
                         self._extract_base_correction += abs(extract_correction_avg) / extract_correction_avg
                         if abs(self._extract_base_correction) > correction_limit :
                             self._extract_base_correction = correction_limit * abs(self._extract_base_correction) / self._extract_base_correction
+                        self.revision += 1
                     self._corrections_extract.clear()
                     
                 _LOGGER.debug("CF Extract diff %f, correction %d avg %f, base %d", paramDiff, self._extract_speed_correction, extract_param_avg, self._extract_base_correction)
@@ -380,39 +420,196 @@ class CfController(object):
     
     def get_supply_correction(self) -> int:
         return int(self._supply_base_correction)
+    
+    def get_supply_error(self) -> float:
+        """Last difference between measured and expected supply param."""
+        return self._supply_error
+    
+    def get_extract_error(self) -> float:
+        """Last difference between measured and expected extract param."""
+        return self._extract_error
+        
+
+class _CfPiChannel(object):
+    """PI loop state of a single fan."""
+
+    def __init__(self, params_length : int):
+        self.params = deque([], params_length)
+        self.samples = 0
+        self.used_samples = 0
+        self.speed = -1
+        self.exp_param = 0.0
+        self.integral = 0.0
+        self.error = 0.0
+        self.correction = 0
+
+    def get_speed(self, exp_speed : int, params_max : float, kp : float, ki : float, enabled : bool) -> int:
+        if self.speed != exp_speed:
+            self.speed = exp_speed
+            self.exp_param = cf_expected_param(params_max, exp_speed)
+            self.params.clear()
+            self.used_samples = self.samples
+
+        target_val = float(exp_speed)
+        if not enabled or params_max <= 0.0:
+            return int(target_val)
+
+        correction_limit = int(target_val / 4)
+        if len(self.params) > 0 and self.samples != self.used_samples:
+            # Integrate once per new sample, not once per tick
+            self.used_samples = self.samples
+            self.error = mean(self.params) - self.exp_param
+            error_perc = (self.error / params_max) * -100.0
+            self.integral += ki * error_perc
+            # Anti windup
+            self.integral = max(-correction_limit, min(correction_limit, self.integral))
+            self.correction = int(max(-correction_limit, min(correction_limit, kp * error_perc + self.integral)))
+
+        target_val += self.correction
+        if target_val > 100:
+            target_val = 100
+        elif target_val < exp_speed / 2:
+            target_val = exp_speed / 2
+        return int(target_val)
+
+
+class CfPiController(object):
+    """Proportional-integral constant flow controller.
+
+    Exposes the same interface as CfController so it can be evaluated in
+    shadow mode next to the live one.
+    """
+
+    CF_PARAMS_LENGTH = 3
+
+    def __init__(self, kp : float = 0.4, ki : float = 0.1):
+        self._kp = kp
+        self._ki = ki
+        self._module_enabled = False
+        self._params_max = 0.0
+        self._supply = _CfPiChannel(self.CF_PARAMS_LENGTH)
+        self._extract = _CfPiChannel(self.CF_PARAMS_LENGTH)
+
+    def set_enabled(self, enabled : bool):
+        self._module_enabled = enabled
+
+    def set_params_max(self, params_max : float):
+        self._params_max = params_max
+
+    def set_current_params(self, supply : float, extract : float):
+        self.add_supply_param(supply)
+        self.add_extract_param(extract)
+
+    def add_supply_param(self, supply : float):
+        self._supply.params.append(supply)
+        self._supply.samples += 1
+
+    def add_extract_param(self, extract : float):
+        self._extract.params.append(extract)
+        self._extract.samples += 1
+
+    def get_supply_speed(self, exp_speed : int) -> int:
+        return self._supply.get_speed(exp_speed, self._params_max, self._kp, self._ki, self._module_enabled)
+
+    def get_extract_speed(self, exp_speed : int) -> int:
+        return self._extract.get_speed(exp_speed, self._params_max, self._kp, self._ki, self._module_enabled)
+
+    def is_enabled(self) -> bool:
+        return self._module_enabled
+
+    def get_extract_correction(self) -> int:
+        return int(self._extract.integral)
+
+    def get_supply_correction(self) -> int:
+        return int(self._supply.integral)
+
+    def get_supply_error(self) -> float:
+        return self._supply.error
+
+    def get_extract_error(self) -> float:
+        return self._extract.error
+
+
+class CfShadowEvaluator(object):
+    """Runs a candidate CF controller next to the live one.
+
+    The candidate gets the same inputs as the live controller but its
+    commands are only recorded, never written to the command message.
+    """
+
+    HISTORY_LENGTH = 600
+    
+    SUMMARY_INTERVAL = 300
+
+    def __init__(self, controller):
+        self.controller = controller
+        # (timestamp, live supply, shadow supply, live extract, shadow extract,
+        #  live supply error, shadow supply error, live extract error, shadow extract error, overhead)
+        self.history = deque([], self.HISTORY_LENGTH)
+        self.ticks = 0
+        self.overhead_total = 0.0
+        self.overhead_max = 0.0
+
+    def tick(self, live, supply_speed : int, extract_speed : int, live_supply : int, live_extract : int):
+        """Feed the candidate with the requested speeds and record its would-be commands."""
+        start = time.perf_counter()
+        shadow_supply = max(15, self.controller.get_supply_speed(supply_speed))
+        shadow_extract = max(15, self.controller.get_extract_speed(extract_speed))
+        overhead = time.perf_counter() - start
+
+        self.history.append((time.time(), live_supply, shadow_supply, live_extract, shadow_extract,
+                             live.get_supply_error(), self.controller.get_supply_error(),
+                             live.get_extract_error(), self.controller.get_extract_error(),
+                             overhead))
+        self.ticks += 1
+        self.overhead_total += overhead
+        if overhead > self.overhead_max:
+            self.overhead_max = overhead
+
+        if self.ticks % self.SUMMARY_INTERVAL == 0:
+            _LOGGER.debug("CF shadow %s", self.get_stats())
+
+    def get_stats(self) -> dict:
+        """Summary of the recorded history."""
+        stats = {"ticks": self.ticks,
+                 "overhead_avg_us": (self.overhead_total / self.ticks) * 1e6 if self.ticks else 0.0,
+                 "overhead_max_us": self.overhead_max * 1e6}
+        if len(self.history) > 0:
+            stats["supply_cmd_diff_avg"] = float(mean([abs(r[1] - r[2]) for r in self.history]))
+            stats["extract_cmd_diff_avg"] = float(mean([abs(r[3] - r[4]) for r in self.history]))
+            stats["supply_error_live_avg"] = float(mean([abs(r[5]) for r in self.history]))
+            stats["supply_error_shadow_avg"] = float(mean([abs(r[6]) for r in self.history]))
+            stats["extract_error_live_avg"] = float(mean([abs(r[7]) for r in self.history]))
+            stats["extract_error_shadow_avg"] = float(mean([abs(r[8]) for r in self.history]))
+        return stats
         
 
 class IzziController(object):
 
     
     """Implements the commands to communicate with the IZZI 300 ERV ventilation unit."""
-                    # Id of sensor,                      Value,    Index in status message array. Unpack type
-    _sensors_data = {IZZY_SENSOR_TEMPERATURE_SUPPLY_ID: [None, IZZI_STATUS_MSG_SUPPLY_AIR_TEMP_INDEX, '>b'],
-                     IZZY_SENSOR_TEMPERATURE_EXTRACT_ID: [None, IZZI_STATUS_MSG_EXTRACT_AIR_TEMP_INDEX, '>b'],
-                     IZZY_SENSOR_TEMPERATURE_EXHAUST_ID: [None, IZZI_STATUS_MSG_EXHAUST_AIR_TEMP_INDEX, '>b'],
-                     IZZY_SENSOR_TEMPERATURE_OUTDOOR_ID: [None, IZZI_STATUS_MSG_OUTDOR_AIR_TEMP_INDEX, '>b'],
-                     IZZY_SENSOR_BYPASS_STATE_ID: [None, IZZI_STATUS_MSG_BYPASS_STATE_INDEX, '>B'],
-                     IZZY_SENSOR_COVER_STATE_ID: [None, IZZI_STATUS_MSG_COVER_STATE_INDEX, '>B'],
-                     IZZY_SENSOR_DEFROST_STATE_ID: [None, IZZI_STATUS_MSG_DEFROST_STATE_INDEX, '>B'],
-                    }
-
-                    # Id of sensor,               Target value,    Index in command array, multiplier
-    _cmd_data = {IZZY_SENSOR_FAN_SUPPLY_SPEED_ID: [0, IZZI_CMD_MSG_SUPPLY_FAN_SPEED_INDEX, None],
-                 IZZY_SENSOR_FAN_EXTRACT_SPEED_ID: [0, IZZI_CMD_MSG_EXTRACT_FAN_SPEED_INDEX, None],
-                 IZZY_SENSOR_UNIT_STATE_ID: [IZZY_CMD_UNIT_STATE_OFF, IZZI_CMD_MSG_UNIT_STATE_INDEX, None],
-                 IZZY_SENSOR_BYPASS_TEMP_ID: [22, IZZI_CMD_MSG_BYPASS_TEMP_INDEX, None],
-                 IZZY_SENSOR_BYPASS_MODE_ID: [IZZY_CMD_BYPASS_MODE_AUTO, IZZI_CMD_MSG_BYPASS_MODE_INDEX, None]}
-
-                    # Id of sensor,           Target Value, Current value    
-    _virtual_data = {IZZY_SENSOR_VENT_MODE_ID: [IZZY_SENSOR_VENT_MODE_NONE, None],
-                     IZZY_SENSOR_EFFICIENCY_ID: [0, None],
-                     IZZY_SENSOR_CF_EXTRACT_CORRECTION_ID: [0, 0],
-                     IZZY_SENSOR_CF_SUPPLY_CORRECTION_ID: [0, 0]}
+                    # Id of sensor,               Initial target value
+    _cmd_defaults = ((IZZY_SENSOR_FAN_SUPPLY_SPEED_ID, 0),
+                     (IZZY_SENSOR_FAN_EXTRACT_SPEED_ID, 0),
+                     (IZZY_SENSOR_UNIT_STATE_ID, IZZY_CMD_UNIT_STATE_OFF),
+                     (IZZY_SENSOR_BYPASS_TEMP_ID, 22),
+                     (IZZY_SENSOR_BYPASS_MODE_ID, IZZY_CMD_BYPASS_MODE_AUTO))
+
+    # Fan speed multipliers of vent modes: supply, extract, None keeps the speed
+    _vent_multipliers = {IZZY_SENSOR_VENT_MODE_NONE: (None, None),
+                         IZZY_SENSOR_VENT_MODE_FIREPLACE: (None, 0.8),
+                         IZZY_SENSOR_VENT_MODE_OPEN_WINDOW: (0, None),
+                         IZZY_SENSOR_VENT_MODE_COOKER_HOOD: (None, 0.3)}
+
+    # Sensors averaged when oversampling is enabled
+    _oversampled_sensors = (IZZY_SENSOR_TEMPERATURE_SUPPLY_ID,
+                            IZZY_SENSOR_TEMPERATURE_EXTRACT_ID,
+                            IZZY_SENSOR_TEMPERATURE_EXHAUST_ID,
+                            IZZY_SENSOR_TEMPERATURE_OUTDOOR_ID)
 
     """Callback function to invoke when sensor updates are received."""
     callback_sensor = None
     
-    cf_controller = CfController()
     extract_correction = 0.0
     
     _command_message = array('B', [IZZI_COMMAND_MESSAGE_ID, 0x19, 0x00, 0x14, 0x00, 0x16, 0x05, 0x00, 0x17, IZZY_CMD_BYPASS_MODE_CLOSED, 0x28, 0x28, IZZY_CMD_UNIT_STATE_OFF, 0x00, 0x00])
@@ -423,6 +620,56 @@ class IzziController(object):
         self._stopping = False
         self._connection_thread = None
         self._master_mode = is_master
+        self._cf_shadow = None
+        self.cf_samples = CfSampleQueue()
+        self.cf_controller = CfController()
+        self._command_message = array('B', self._command_message)
+        self._sensors_unpack = STATUS_UNPACK
+        # Id of sensor, Index in command array
+        self._cmd_layout = tuple((sensor_id, index) for sensor_id, index, fmt in IZZI_COMMAND_LAYOUT)
+
+        # Fan speed multipliers of the current vent mode, indexed by sensor id.
+        # Replaced as a whole, never modified in place.
+        self._cmd_multiplier = self._multipliers(IZZY_SENSOR_VENT_MODE_NONE)
+        
+        self._presets = {}
+        self.preset = None
+        # Called with the preset name when the schedule applied a preset
+        self.callback_preset = None
+        self._schedule = None
+        self._schedule_last = 0.0
+        self._next_schedule = 0.0
+
+        self.state = IzziStateTable(internal=(IZZY_SENSOR_CF_STATE_ID,))
+        for sensor_id, value in self._cmd_defaults:
+            self.state.target[sensor_id] = value
+        for sensor_id, index in self._cmd_layout:
+            self.state.current[sensor_id] = self._command_message[index]
+        self.state.target[IZZY_SENSOR_VENT_MODE_ID] = IZZY_SENSOR_VENT_MODE_NONE
+        self.state.set_current(IZZY_SENSOR_VENT_MODE_ID, IZZY_SENSOR_VENT_MODE_NONE)
+        self.state.current[IZZY_SENSOR_CF_EXTRACT_CORRECTION_ID] = 0
+        self.state.current[IZZY_SENSOR_CF_SUPPLY_CORRECTION_ID] = 0
+        self.state.current[IZZY_SENSOR_CF_STATE_ID] = self.cf_controller.revision
+        self.derived = create_derived_sensors(self.cf_controller)
+        self.energy = RecoveredEnergyIntegrator()
+
+        # Sample windows indexed by sensor id, None publishes raw values
+        self._windows = [None] * IZZY_SENSOR_ID_COUNT
+        self._oversample_interval = 0.0
+        self._next_oversample = 0.0
+        
+        self.history = None
+        self.filter_load = None
+        self._next_filter_load = 0.0
+        self._profiler = None
+        
+        # Called with (timestamp, kind, frame) for every frame read or written
+        self._frame_listeners = []
+        
+        # Command frames built so far, waiters for a frame built after a setting changed
+        self._command_builds = 0
+        self._write_waiters = []
+        self._write_waiters_lock = threading.Lock()
 
     def connect(self):
         """Connect to the bridge. Disconnect existing clients if needed by default."""
@@ -443,104 +690,427 @@ class IzziController(object):
     
         # Set the stopping flag
         self._stopping = True
+        self.stop_profiler()
 
         # Wait for the background thread to finish
-        self._connection_thread.join()
-        self._connection_thread = None
+        if self._connection_thread is not None:
+            self._connection_thread.join()
+            self._connection_thread = None
 
     def is_connected(self):
         """Returns whether there is a connection with the bridge."""
 
         return self._bridge.is_connected()
 
-    def get_master_mode() -> bool:
+    def get_master_mode(self) -> bool:
         return self._master_mode
+
+    def set_master_mode(self, is_master : bool) -> bool:
+        """Switch between writing command frames and following another master.
+
+        Takes effect on the next frame, the connection is kept. A slave does
+        not run the schedule, it is stopped when switching to slave.
+        """
+        if not is_master:
+            self._schedule = None
+        self._master_mode = is_master
+        return True
         
     def force_update(self, sensor_id):
         """Make sure state of sensor will be published."""
-        sensor_obj = self._sensors_data.get(sensor_id)
-        if sensor_obj != None:
-            sensor_obj[0] = None
-        sensor_obj = self._cmd_data.get(sensor_id)
-        if sensor_obj != None:
-            sensor_obj[0] = None
-        sensor_obj = self._virtual_data.get(sensor_id)
-        if sensor_obj != None:
-            sensor_obj[1] = None
+        self.state.force_update(sensor_id)
     
     def set_bypass_mode(self, mode : int) -> bool:
         if mode < 0 or mode > 2:
             return False
-        self._cmd_data[IZZY_SENSOR_BYPASS_MODE_ID][0] = mode
+        self.state.target[IZZY_SENSOR_BYPASS_MODE_ID] = mode
+        self.preset = None
         return True
         
     def get_bypass_mode(self) -> int:
-        return self._cmd_data[IZZY_SENSOR_BYPASS_MODE_ID][0];
+        return self.state.target[IZZY_SENSOR_BYPASS_MODE_ID]
         
     def set_bypass_temp(self, temp : int) -> bool:
-        if temp < 18 or temp > 26:
+        if temp < IZZY_CMD_BYPASS_TEMP_MIN or temp > IZZY_CMD_BYPASS_TEMP_MAX:
             return False
-        self._cmd_data[IZZY_SENSOR_BYPASS_TEMP_ID][0] = temp
+        self.state.target[IZZY_SENSOR_BYPASS_TEMP_ID] = temp
+        self.preset = None
         return True
         
     def set_fan_speed(self, supply : int, extract : int) :
         if (supply < 0 and extract < 0) or supply > 100 or extract > 100:
             return False
         
-        self._cmd_data[IZZY_SENSOR_FAN_SUPPLY_SPEED_ID][0] = supply
-        self._cmd_data[IZZY_SENSOR_FAN_EXTRACT_SPEED_ID][0] = extract
-        
+        self.state.target[IZZY_SENSOR_FAN_SUPPLY_SPEED_ID] = supply
+        self.state.target[IZZY_SENSOR_FAN_EXTRACT_SPEED_ID] = extract
+        self.preset = None
         return True
 
-    def get_supply_speed():
-        return self._cmd_data[IZZY_SENSOR_FAN_SUPPLY_SPEED_ID][0]
+    def get_supply_speed(self):
+        return self.state.target[IZZY_SENSOR_FAN_SUPPLY_SPEED_ID]
         
-    def get_extract_speed():
-        return self._cmd_data[IZZY_SENSOR_FAN_EXTRACT_SPEED_ID][0]
+    def get_extract_speed(self):
+        return self.state.target[IZZY_SENSOR_FAN_EXTRACT_SPEED_ID]
+    
     
+    def _multipliers(self, mode : int) -> list:
+        multipliers = [None] * IZZY_SENSOR_ID_COUNT
+        supply, extract = self._vent_multipliers[mode]
+        multipliers[IZZY_SENSOR_FAN_SUPPLY_SPEED_ID] = supply
+        multipliers[IZZY_SENSOR_FAN_EXTRACT_SPEED_ID] = extract
+        return multipliers
     
     def set_vent_mode(self, mode : int) -> bool:
-        if mode < IZZY_SENSOR_VENT_MODE_NONE or mode > IZZY_SENSOR_VENT_MODE_COOKER_HOOD:
+        if mode not in self._vent_multipliers:
             return False
-        if mode == IZZY_SENSOR_VENT_MODE_NONE:
-            self._cmd_data[IZZY_SENSOR_FAN_SUPPLY_SPEED_ID][2] = None
-            self._cmd_data[IZZY_SENSOR_FAN_EXTRACT_SPEED_ID][2] = None
-        elif mode == IZZY_SENSOR_VENT_MODE_FIREPLACE:
-            self._cmd_data[IZZY_SENSOR_FAN_SUPPLY_SPEED_ID][2] = None
-            self._cmd_data[IZZY_SENSOR_FAN_EXTRACT_SPEED_ID][2] = 0.8
-        elif mode == IZZY_SENSOR_VENT_MODE_OPEN_WINDOW:
-            self._cmd_data[IZZY_SENSOR_FAN_SUPPLY_SPEED_ID][2] = 0
-            self._cmd_data[IZZY_SENSOR_FAN_EXTRACT_SPEED_ID][2] = None
-        elif mode == IZZY_SENSOR_VENT_MODE_COOKER_HOOD:
-            self._cmd_data[IZZY_SENSOR_FAN_SUPPLY_SPEED_ID][2] = None
-            self._cmd_data[IZZY_SENSOR_FAN_EXTRACT_SPEED_ID][2] = 0.3
-        
-        self._virtual_data[IZZY_SENSOR_VENT_MODE_ID][0] = mode
+        self._cmd_multiplier = self._multipliers(mode)
+        self.state.target[IZZY_SENSOR_VENT_MODE_ID] = mode
+        self.state.set_current(IZZY_SENSOR_VENT_MODE_ID, mode)
+        self.preset = None
         return True
         
     def set_cf_params_max(self, params_max : float) -> bool:
         self.cf_controller.set_params_max(params_max)
         self.cf_controller.set_enabled(True)
+        if self._cf_shadow is not None:
+            self._cf_shadow.controller.set_params_max(params_max)
+            self._cf_shadow.controller.set_enabled(True)
+        if self.filter_load is not None:
+            self.filter_load.params_max = params_max
         return True
     
     def set_cf_params(self, supply : float, extract : float) -> bool:
-        self.cf_controller.set_current_params(supply, extract)
+        """Queue a CF sample pair, consumed by the connection loop on next tick."""
+        self.cf_samples.push_pair(supply, extract)
+        return True
+    
+    def set_cf_supply_param(self, supply : float) -> bool:
+        self.cf_samples.push(CF_CHANNEL_SUPPLY, supply)
+        return True
+    
+    def set_cf_extract_param(self, extract : float) -> bool:
+        self.cf_samples.push(CF_CHANNEL_EXTRACT, extract)
         return True
+    
+    def _consume_cf_samples(self):
+        """Feed all pending CF samples to the CF controllers."""
+        samples = self.cf_samples.drain()
+        if not samples:
+            return
+        controllers = [self.cf_controller]
+        if self._cf_shadow is not None:
+            controllers.append(self._cf_shadow.controller)
+        ts = time.time()
+        for channel, value in samples:
+            for controller in controllers:
+                if channel == CF_CHANNEL_SUPPLY:
+                    controller.add_supply_param(value)
+                else:
+                    controller.add_extract_param(value)
+            if self.filter_load is not None:
+                self.filter_load.add_sample(ts, channel, value)
+            if self._frame_listeners:
+                self._notify_frame(CAPTURE_KIND_CF_SAMPLE, CAPTURE_CF_SAMPLE.pack(channel, value), ts)
+    
+    def _track_command_frame(self, frame):
+        # Filter load is estimated against the speeds actually on the bus
+        if self.filter_load is not None:
+            self.filter_load.set_speeds(frame[IZZI_CMD_MSG_SUPPLY_FAN_SPEED_INDEX], frame[IZZI_CMD_MSG_EXTRACT_FAN_SPEED_INDEX])
+    
+    def set_cf_shadow(self, controller) -> bool:
+        """Evaluate controller in shadow mode next to the live CF controller, None disables."""
+        if controller is None:
+            self._cf_shadow = None
+            return True
+        controller.set_params_max(self.cf_controller._params_max)
+        controller.set_enabled(self.cf_controller.is_enabled())
+        self._cf_shadow = CfShadowEvaluator(controller)
+        return True
+    
+    def get_cf_shadow_stats(self) -> dict:
+        if self._cf_shadow is None:
+            return None
+        return self._cf_shadow.get_stats()
         
     def is_cf_enabled(self) -> bool:
         return self.cf_controller.is_enabled()
         
+    def set_airflow_curve(self, curve) -> bool:
+        """Set supply airflow curve as (speed percent, m3/h) points."""
+        if len(curve) < 2:
+            return False
+        self.derived = create_derived_sensors(self.cf_controller, curve)
+        # Recompute power with the new curve on next tick
+        self.state.mark_changed(IZZY_SENSOR_FAN_SUPPLY_SPEED_ID)
+        return True
+    
+    def set_energy_publish_interval(self, interval : float) -> bool:
+        if interval < 0:
+            return False
+        self.energy.publish_interval = interval
+        return True
+    
+    def set_oversampling(self, window : int, interval : float) -> bool:
+        """Average the last window temperature samples and publish them every interval seconds.
+
+        window lower than 2 publishes raw frame values.
+        """
+        if window < 0 or interval < 0:
+            return False
+        # The connection thread may be reading the list, swap in a complete one
+        windows = [None] * IZZY_SENSOR_ID_COUNT
+        if window > 1:
+            for sensor_id in self._oversampled_sensors:
+                windows[sensor_id] = SampleWindow(window)
+        self._windows = windows
+        self._oversample_interval = interval
+        self._next_oversample = 0.0
+        return True
+    
+    def add_frame_listener(self, listener):
+        """Register listener(timestamp, kind, frame) called from the connection thread."""
+        self._frame_listeners = self._frame_listeners + [listener]
+    
+    def remove_frame_listener(self, listener):
+        self._frame_listeners = [l for l in self._frame_listeners if l is not listener]
+    
+    def _notify_frame(self, kind : int, frame, ts : float = None):
+        if ts is None:
+            ts = time.time()
+        for listener in self._frame_listeners:
+            try:
+                listener(ts, kind, frame)
+            except Exception as exc:
+                _LOGGER.error("Frame listener failed: %s", exc)
+    
+    def add_write_waiter(self, callback):
+        """Call callback(frame, monotonic time) once a command frame is written
+        that was built after this call, so it carries every setting made before.
+
+        The callback runs in the connection thread. Returns the waiter for
+        remove_write_waiter.
+        """
+        waiter = (self._command_builds, callback)
+        with self._write_waiters_lock:
+            self._write_waiters.append(waiter)
+        return waiter
+    
+    def remove_write_waiter(self, waiter):
+        with self._write_waiters_lock:
+            if waiter in self._write_waiters:
+                self._write_waiters.remove(waiter)
+    
+    def _notify_write_waiters(self, build : int, frame):
+        ts = time.monotonic()
+        with self._write_waiters_lock:
+            done = [waiter for waiter in self._write_waiters if waiter[0] < build]
+            self._write_waiters = [waiter for waiter in self._write_waiters if waiter[0] >= build]
+        frame = bytes(frame)
+        for after, callback in done:
+            try:
+                callback(frame, ts)
+            except Exception as exc:
+                _LOGGER.error("Write waiter failed: %s", exc)
+    
+    def enable_history(self, raw_capacity : int = 3600) -> bool:
+        """Keep in memory history of numeric sensors, see IzziHistory."""
+        if raw_capacity < 1:
+            return False
+        self.history = IzziHistory(raw_capacity)
+        return True
+    
+    def enable_filter_load(self, replace_residual : float = 25.0, half_life_days : float = 30.0) -> bool:
+        """Estimate filter clogging from CF samples, see FilterLoadMonitor."""
+        if replace_residual <= 0 or half_life_days <= 0:
+            return False
+        self.filter_load = FilterLoadMonitor(self.cf_controller._params_max, replace_residual, half_life_days)
+        self._next_filter_load = 0.0
+        return True
+    
+    def reset_filter_load(self) -> bool:
+        """Filters were replaced."""
+        if self.filter_load is None:
+            return False
+        self.filter_load.reset(time.time())
+        self._next_filter_load = 0.0
+        return True
+    
+    def start_profiler(self, duration : float, path : str, interval : float = 0.005, top : int = 20) -> bool:
+        """Sample the connection thread for duration seconds.
+
+        The collapsed stacks are written to path and the top functions are
+        logged. Returns False when not connected or a profile is running.
+        """
+        if self._connection_thread is None or duration <= 0 or interval <= 0:
+            return False
+        if self._profiler is not None and self._profiler.is_running():
+            return False
+
+        def on_done(sampler):
+            sampler.write_collapsed(path)
+            _LOGGER.warning("Connection thread profile written to %s\n%s", path, sampler.summary(top))
+
+        self._profiler = ThreadSampler(self._connection_thread, interval)
+        self._profiler.start(duration, on_done)
+        return True
+    
+    def stop_profiler(self):
+        if self._profiler is not None:
+            self._profiler.stop()
+    
+    def add_preset(self, name : str, targets : dict, vent_mode : int = IZZY_SENSOR_VENT_MODE_NONE) -> bool:
+        """Precompute preset name from {command sensor id: value}.
+
+        Command fields missing in targets take their current target value,
+        so presets should be added after the configured defaults are set.
+        """
+        if vent_mode not in self._vent_multipliers:
+            return False
+        multipliers = self._multipliers(vent_mode)
+        preset_targets = []
+        frame = array('B', self._command_message)
+        for sensor_id, index in self._cmd_layout:
+            value = targets.get(sensor_id, self.state.target[sensor_id])
+            if value is None or value < 0 or value > 0xFF:
+                return False
+            preset_targets.append((sensor_id, value))
+            if multipliers[sensor_id] is not None:
+                value = int(float(value) * multipliers[sensor_id])
+            frame[index] = value
+        self._presets[name] = IzziPreset(name, tuple(preset_targets), vent_mode, multipliers, frame)
+        return True
+    
+    def get_presets(self) -> list:
+        return list(self._presets)
+    
+    def apply_preset(self, name : str) -> bool:
+        """Switch all command targets, the vent mode and the frame at once.
+
+        The connection loop reads the target list and multipliers once per
+        frame, so a frame never mixes values of two presets.
+        """
+        preset = self._presets.get(name)
+        if preset is None:
+            return False
+        targets = list(self.state.target)
+        for sensor_id, value in preset.targets:
+            targets[sensor_id] = value
+        targets[IZZY_SENSOR_VENT_MODE_ID] = preset.vent_mode
+        self._cmd_multiplier = preset.multipliers
+        self.state.target = targets
+        self._command_message = array('B', preset.frame)
+        self.state.set_current(IZZY_SENSOR_VENT_MODE_ID, preset.vent_mode)
+        self.preset = name
+        return True
+    
+    def set_schedule(self, schedule : IzziSchedule) -> bool:
+        """Apply presets at the transitions of schedule, None stops the schedule.
+
+        Only transitions from now on are applied, the connection loop checks
+        the next transition time once per frame.
+        """
+        if schedule is not None:
+            if not self._master_mode:
+                return False
+            for name in schedule.presets:
+                if name not in self._presets:
+                    return False
+        self._schedule = None
+        now = time.time()
+        self._schedule_last = week_second(now, schedule.tz if schedule is not None else None)
+        self._next_schedule = 0.0
+        self._schedule = schedule
+        return True
+    
+    def _run_schedule(self, schedule : IzziSchedule, now : float) -> bool:
+        second = week_second(now, schedule.tz)
+        name = schedule.due(self._schedule_last, second)
+        # Keep last through a clock set back so the repeated hour does not fire twice
+        if not 0 < self._schedule_last - second <= SECONDS_PER_WEEK / 2:
+            self._schedule_last = second
+        self._next_schedule = now + min(schedule.seconds_to_next(second), SCHEDULE_RECHECK_INTERVAL)
+        if name is None or not self.apply_preset(name):
+            return False
+        _LOGGER.debug("Schedule applied preset %s", name)
+        if self.callback_preset is not None:
+            self.callback_preset(name)
+        return True
+    
+    def get_snapshot(self) -> dict:
+        """Published values, command frame, setpoints and filter load trend, see restore_snapshot."""
+        targets = self.state.target
+        snapshot = {"published": list(self.state.published),
+                    "command": list(self._command_message),
+                    "targets": {str(sensor_id): targets[sensor_id] for sensor_id, index in self._cmd_layout},
+                    "vent_mode": targets[IZZY_SENSOR_VENT_MODE_ID]}
+        if self.filter_load is not None:
+            snapshot["filter_load"] = self.filter_load.get_state()
+        return snapshot
+    
+    def restore_snapshot(self, snapshot : dict) -> bool:
+        """Warm start from a snapshot taken before a restart, call before connect.
+
+        Entities get the last published values right away and the first
+        command frame sent is the last one sent before the restart. The
+        filter load trend continues when filter load is enabled before.
+        """
+        command = snapshot.get("command")
+        if not command or len(command) != IZZI_MESSAGE_LENGTH or command[IZZI_CMD_MSG_ID_INDEX] != IZZI_COMMAND_MESSAGE_ID:
+            return False
+        if not all(isinstance(value, int) and 0 <= value <= 255 for value in command):
+            return False
+        self._command_message[:] = array('B', command)
+        command_ids = set()
+        for sensor_id, index in self._cmd_layout:
+            self.state.current[sensor_id] = self._command_message[index]
+            command_ids.add(sensor_id)
+        targets = snapshot.get("targets")
+        for key, value in (targets.items() if isinstance(targets, dict) else ()):
+            # Only setpoints of the command frame, a corrupt cache must not reach other sensors
+            if not str(key).isdigit() or int(key) not in command_ids:
+                continue
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                self.state.target[int(key)] = value
+        if snapshot.get("vent_mode") is not None:
+            self.set_vent_mode(snapshot["vent_mode"])
+
+        published = snapshot.get("published", [])
+        internal = self.state._internal
+        for sensor_id, value in enumerate(published[:IZZY_SENSOR_ID_COUNT]):
+            if value is not None and not internal & (1 << sensor_id):
+                self.state.set_published(sensor_id, value)
+        # Energy totals continue from the last published values
+        if self.state.published[IZZY_SENSOR_RECOVERED_HEAT_ENERGY_ID] is not None:
+            self.energy.heat_kwh = self.state.published[IZZY_SENSOR_RECOVERED_HEAT_ENERGY_ID]
+        if self.state.published[IZZY_SENSOR_RECOVERED_COOL_ENERGY_ID] is not None:
+            self.energy.cool_kwh = self.state.published[IZZY_SENSOR_RECOVERED_COOL_ENERGY_ID]
+        if self.filter_load is not None and snapshot.get("filter_load") is not None:
+            try:
+                self.filter_load.set_state(snapshot["filter_load"])
+            except (KeyError, TypeError, ValueError) as exc:
+                _LOGGER.warning("Ignoring invalid filter load state: %s", exc)
+        return True
+    
+    def set_publish_policy(self, sensor_id : int, policy) -> bool:
+        """Limit publishing of sensor with a PublishPolicy, None publishes every change."""
+        if sensor_id < 0 or sensor_id >= IZZY_SENSOR_ID_COUNT:
+            return False
+        self.state.set_policy(sensor_id, policy)
+        return True
+    
     def set_unit_on(self, on : bool) :
         if on:
-            self._cmd_data[IZZY_SENSOR_UNIT_STATE_ID][0] = IZZY_CMD_UNIT_STATE_ON
+            self.state.target[IZZY_SENSOR_UNIT_STATE_ID] = IZZY_CMD_UNIT_STATE_ON
         else:
-            self._cmd_data[IZZY_SENSOR_UNIT_STATE_ID][0] = IZZY_CMD_UNIT_STATE_OFF
+            self.state.target[IZZY_SENSOR_UNIT_STATE_ID] = IZZY_CMD_UNIT_STATE_OFF
+        self.preset = None
         return True
         
     def _connection_thread_loop(self):
         self._stopping = False
         stat_msg_counter = 0
         last_cmd_timestamp = time.time()
+        state = self.state
             
         while not self._stopping:
         
@@ -569,7 +1139,10 @@ class IzziController(object):
                     _LOGGER.error("Can't read message, disconnecting")
                     continue
                 
-                command_id = struct.unpack_from('>B', status_message, IZZI_STATUS_MSG_ID_INDEX)[0]
+                if self._frame_listeners:
+                    self._notify_frame(CAPTURE_KIND_RX, status_message)
+                
+                command_id = status_message[IZZI_STATUS_MSG_ID_INDEX]
                 if (command_id == IZZI_STATUS_MESSAGE_ID):
                     stat_msg_counter += 1
                     #_LOGGER.debug(status_message)
@@ -579,83 +1152,111 @@ class IzziController(object):
                     
                     #_LOGGER.debug("Since last cmd %f", timediff)
                     
-                    for sensor_id in self._sensors_data:
-                        sensor_data = self._sensors_data[sensor_id];
-                        sensor_current = struct.unpack_from(sensor_data[2], status_message, sensor_data[1])[0] 
-                       
-                        if sensor_data[0] != sensor_current:
-                            sensor_data[0] = sensor_current
-                            if self.callback_sensor:
-                                self.callback_sensor(sensor_id, sensor_data[0])
-                    
-                    #Calculate efficiency
-                    try:
-                        t1 = float(self._sensors_data[IZZY_SENSOR_TEMPERATURE_OUTDOOR_ID][0])
-                        t2 = float(self._sensors_data[IZZY_SENSOR_TEMPERATURE_SUPPLY_ID][0])
-                        t3 = float(self._sensors_data[IZZY_SENSOR_TEMPERATURE_EXTRACT_ID][0])
-                        
-                        if t3 != t1:
-                            efficiency = ((t2 - t1) / (t3 - t1)) * 100.0
-                            self._virtual_data[IZZY_SENSOR_EFFICIENCY_ID][0] = round(efficiency)
+                    windows = self._windows
+                    for sensor_id, index, unpack in self._sensors_unpack:
+                        window = windows[sensor_id]
+                        if window is None:
+                            state.set_current(sensor_id, unpack(status_message, index)[0])
                         else:
-                            self._virtual_data[IZZY_SENSOR_EFFICIENCY_ID][0] = 100
-                                
-                    except Exception as exc:
-                        self._virtual_data[IZZY_SENSOR_EFFICIENCY_ID][0] = None
-                        _LOGGER.error(exc)
+                            window.add(unpack(status_message, index)[0])
+                    
+                    if windows[IZZY_SENSOR_TEMPERATURE_SUPPLY_ID] is not None:
+                        now = time.monotonic()
+                        if now >= self._next_oversample:
+                            self._next_oversample = now + self._oversample_interval
+                            for sensor_id in self._oversampled_sensors:
+                                window = windows[sensor_id]
+                                window_mean = window.mean() if window is not None else None
+                                if window_mean is not None:
+                                    state.set_current(sensor_id, round(window_mean, 1))
+                
+                elif command_id == IZZI_COMMAND_MESSAGE_ID:
+                    self._track_command_frame(status_message)
                 
-                elif not self._master_mode and command_id == IZZI_COMMAND_MESSAGE_ID:
-                    for sensor_id in self._cmd_data:
-                        sensor_data = self._cmd_data[sensor_id]
-                        sensor_data[0] = status_message[sensor_data[1]]
+                if not self._master_mode and command_id == IZZI_COMMAND_MESSAGE_ID:
+                    for sensor_id, index in self._cmd_layout:
+                        state.target[sensor_id] = status_message[index]
                     _LOGGER.debug("CMD RX %s", str(binascii.hexlify(status_message)))
                     
-                for sensor_id in self._cmd_data:
-                    sensor_data = self._cmd_data[sensor_id]
-                    sensor_current = self._command_message[sensor_data[1]]
-                    if sensor_data[0] is None:
-                        sensor_data[0] = sensor_current
-                        if self.callback_sensor:
-                            self.callback_sensor(sensor_id, sensor_data[0])
+                self._consume_cf_samples()
+                
+                schedule = self._schedule
+                if schedule is not None and command_id == IZZI_STATUS_MESSAGE_ID:
+                    now = time.time()
+                    if now >= self._next_schedule and self._run_schedule(schedule, now):
+                        # Send the new frame after this status frame
+                        stat_msg_counter = 2
+                
+                # Counted before the targets are read, see add_write_waiter
+                self._command_builds += 1
+                targets = state.target
+                multipliers = self._cmd_multiplier
+                cf_active = targets[IZZY_SENSOR_UNIT_STATE_ID] == IZZY_CMD_UNIT_STATE_ON and state.current[IZZY_SENSOR_COVER_STATE_ID] == 0
+                supply_request = None
+                extract_request = None
+                for sensor_id, index in self._cmd_layout:
+                    exp_sensor_val = targets[sensor_id]
+                    if exp_sensor_val is None:
+                        continue
                     
-                        # Make sure we use up to date data
-                    if sensor_data[2] is not None:
-                        exp_sensor_val = int(float(sensor_data[0]) * sensor_data[2])
-                    else:
-                        exp_sensor_val = sensor_data[0]
+                    multiplier = multipliers[sensor_id]
+                    if multiplier is not None:
+                        exp_sensor_val = int(float(exp_sensor_val) * multiplier)
                     
-                    if self._cmd_data[IZZY_SENSOR_UNIT_STATE_ID][0] == IZZY_CMD_UNIT_STATE_ON and self._sensors_data[IZZY_SENSOR_COVER_STATE_ID][0] == 0:
+                    if cf_active:
                         if sensor_id == IZZY_SENSOR_FAN_SUPPLY_SPEED_ID:
+                            supply_request = exp_sensor_val
                             exp_sensor_val = self.cf_controller.get_supply_speed(exp_sensor_val)
                             if exp_sensor_val < 15:
                                 exp_sensor_val = 15
+                            supply_command = exp_sensor_val
                         elif sensor_id == IZZY_SENSOR_FAN_EXTRACT_SPEED_ID:
+                            extract_request = exp_sensor_val
                             exp_sensor_val = self.cf_controller.get_extract_speed(exp_sensor_val)
                             if exp_sensor_val < 15:
                                 exp_sensor_val = 15
+                            extract_command = exp_sensor_val
                         
-                    if exp_sensor_val != sensor_current:
-                        self._command_message[sensor_data[1]] = exp_sensor_val
-                        if self.callback_sensor:
-                            self.callback_sensor(sensor_id, self._command_message[sensor_data[1]])
+                    if exp_sensor_val != self._command_message[index]:
+                        self._command_message[index] = exp_sensor_val
+                    state.set_current(sensor_id, self._command_message[index])
+                
+                if self._cf_shadow is not None and supply_request is not None and extract_request is not None:
+                    self._cf_shadow.tick(self.cf_controller, supply_request, extract_request, supply_command, extract_command)
+                
+                state.set_current(IZZY_SENSOR_CF_STATE_ID, self.cf_controller.revision)
+                self.derived.update(state)
+                
+                if command_id == IZZI_STATUS_MESSAGE_ID and self.history is not None:
+                    self.history.record(time.time(), state.current)
+                
+                if self.filter_load is not None and command_id == IZZI_STATUS_MESSAGE_ID:
+                    now = time.time()
+                    if now >= self._next_filter_load:
+                        self._next_filter_load = now + FILTER_LOAD_PUBLISH_INTERVAL
+                        load, days = self.filter_load.estimate(now)
+                        state.set_current(IZZY_SENSOR_FILTER_LOAD_ID, load)
+                        state.set_current(IZZY_SENSOR_FILTER_DAYS_ID, days)
                 
-                if self.cf_controller.is_enabled(): 
-                    self._virtual_data[IZZY_SENSOR_CF_EXTRACT_CORRECTION_ID][0] = self.cf_controller.get_extract_correction()
-                    self._virtual_data[IZZY_SENSOR_CF_SUPPLY_CORRECTION_ID][0] = self.cf_controller.get_supply_correction()
+                if command_id == IZZI_STATUS_MESSAGE_ID and self.energy.update(time.monotonic(), state.current[IZZY_SENSOR_RECOVERED_POWER_ID]):
+                    state.set_current(IZZY_SENSOR_RECOVERED_HEAT_ENERGY_ID, round(self.energy.heat_kwh, 3))
+                    state.set_current(IZZY_SENSOR_RECOVERED_COOL_ENERGY_ID, round(self.energy.cool_kwh, 3))
                     
-                for sensor_id in self._virtual_data:
-                    sensor_data = self._virtual_data[sensor_id]
-                    if sensor_data[1] is None or sensor_data[0] != sensor_data[1]:
-                        sensor_data[1] = sensor_data[0]
-                        if self.callback_sensor:
-                            self.callback_sensor(sensor_id, sensor_data[0])
+                state.publish(self.callback_sensor)
                  
                 if stat_msg_counter >= 2:
                     stat_msg_counter = 0
                     if self._master_mode:
                         #_LOGGER.debug("Writting msg %s", str(self._command_message))
                         time.sleep(0.2)
-                        self._bridge.write_message(self._command_message)
+                        command_message = self._command_message
+                        build = self._command_builds
+                        written = self._bridge.write_message(command_message)
+                        self._track_command_frame(command_message)
+                        if written and self._write_waiters:
+                            self._notify_write_waiters(build, command_message)
+                        if self._frame_listeners:
+                            self._notify_frame(CAPTURE_KIND_TX, command_message)
 
             except Exception as exc:
                 _LOGGER.error(exc)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""Status and command frame decoding.
+
+Both the live decoder of the connection loop and the vectorised batch
+decoder are built from IZZI_STATUS_LAYOUT / IZZI_COMMAND_LAYOUT in
+const.py, so they cannot drift apart. NumPy is only imported by the
+batch functions.
+"""
+
+import struct
+from .const import *
+
+# Sensor id -> field name
+SENSOR_NAMES = {sensor_id: name for name, sensor_id in IZZY_SENSOR_KEYS.items()}
+
+# Live decoder: sensor id, index in frame, unpack_from function
+STATUS_UNPACK = tuple((sensor_id, index, struct.Struct(fmt).unpack_from) for sensor_id, index, fmt in IZZI_STATUS_LAYOUT)
+COMMAND_UNPACK = tuple((sensor_id, index, struct.Struct(fmt).unpack_from) for sensor_id, index, fmt in IZZI_COMMAND_LAYOUT)
+
+_dtypes = {}
+
+def _numpy_format(fmt : str) -> str:
+    return {'b': 'i1', 'B': 'u1'}[fmt[-1]]
+
+def _frame_dtype(layout):
+    import numpy as np
+    return np.dtype({"names": ["message_id"] + [SENSOR_NAMES[sensor_id] for sensor_id, index, fmt in layout],
+                     "formats": ['u1'] + [_numpy_format(fmt) for sensor_id, index, fmt in layout],
+                     "offsets": [0] + [index for sensor_id, index, fmt in layout],
+                     "itemsize": IZZI_MESSAGE_LENGTH})
+
+def status_dtype():
+    """NumPy structured dtype of a status frame, fields overlap where the layout does."""
+    if "status" not in _dtypes:
+        _dtypes["status"] = _frame_dtype(IZZI_STATUS_LAYOUT)
+    return _dtypes["status"]
+
+def command_dtype():
+    """NumPy structured dtype of a command frame."""
+    if "command" not in _dtypes:
+        _dtypes["command"] = _frame_dtype(IZZI_COMMAND_LAYOUT)
+    return _dtypes["command"]
+
+def _decode_frames(buffer, dtype, message_id : int, check : bool):
+    import numpy as np
+    if isinstance(buffer, np.ndarray):
+        frames = np.ascontiguousarray(buffer, dtype=np.uint8).reshape(-1).view(dtype)
+    else:
+        frames = np.frombuffer(buffer, dtype=dtype)
+    if check and not (frames["message_id"] == message_id).all():
+        raise ValueError("Buffer holds frames with unexpected message id")
+    return frames
+
+def decode_status_frames(buffer, check : bool = True):
+    """Decode a contiguous buffer of N status frames in one call.
+
+    Returns a structured array of N records without copying buffer, fields
+    are named after the sensors (frames["outdoor_temperature"], ...).
+    """
+    return _decode_frames(buffer, status_dtype(), IZZI_STATUS_MESSAGE_ID, check)
+
+def decode_command_frames(buffer, check : bool = True):
+    """Decode a contiguous buffer of N command frames in one call."""
+    return _decode_frames(buffer, command_dtype(), IZZI_COMMAND_MESSAGE_ID, check)
+
+def decode_status_frame(frame) -> dict:
+    """Decode one status frame into a {sensor id: value} dict."""
+    return {sensor_id: unpack(frame, index)[0] for sensor_id, index, unpack in STATUS_UNPACK}
+
+def decode_command_frame(frame) -> dict:
+    """Decode one command frame into a {sensor id: value} dict."""
+    return {sensor_id: unpack(frame, index)[0] for sensor_id, index, unpack in COMMAND_UNPACK}
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+from bisect import bisect_right
+from .const import *
+
+class DerivedSensor(object):
+    """Virtual sensor computed from other sensors of the state table.
+
+    compute is called with the list of current values and is only called
+    when at least one of the input sensors changed.
+    """
+
+    def __init__(self, sensor_id : int, inputs, compute):
+        self.sensor_id = sensor_id
+        self.inputs = tuple(inputs)
+        self.input_mask = 0
+        for input_id in self.inputs:
+            self.input_mask |= 1 << input_id
+        self.compute = compute
+
+
+class DerivedSensorEngine(object):
+    """Recomputes derived sensors whose inputs changed.
+
+    Sensors are evaluated in the order they were added, so a derived
+    sensor may use the ones added before it as inputs.
+    """
+
+    def __init__(self):
+        self._sensors = []
+        self._input_mask = 0
+
+    def add(self, sensor : DerivedSensor):
+        self._sensors.append(sensor)
+        self._input_mask |= sensor.input_mask
+
+    def update(self, state) -> int:
+        """Recompute sensors affected by changes since last update, returns their count."""
+        changed = state.take_changed()
+        if not changed & self._input_mask:
+            return 0
+        current = state.current
+        count = 0
+        for sensor in self._sensors:
+            if sensor.input_mask & changed:
+                count += 1
+                if state.set_current(sensor.sensor_id, sensor.compute(current)):
+                    changed |= 1 << sensor.sensor_id
+        return count
+
+
+def airflow(curve, speed : float) -> float:
+    """Interpolate airflow in m3/h for fan speed from a sorted (speed, airflow) curve."""
+    index = bisect_right(curve, (speed, float('inf')))
+    if index == 0:
+        return curve[0][1]
+    if index >= len(curve):
+        return curve[-1][1]
+    speed_lo, flow_lo = curve[index - 1]
+    speed_hi, flow_hi = curve[index]
+    return flow_lo + (flow_hi - flow_lo) * (speed - speed_lo) / (speed_hi - speed_lo)
+
+
+def _efficiency(current):
+    t1 = current[IZZY_SENSOR_TEMPERATURE_OUTDOOR_ID]
+    t2 = current[IZZY_SENSOR_TEMPERATURE_SUPPLY_ID]
+    t3 = current[IZZY_SENSOR_TEMPERATURE_EXTRACT_ID]
+    if t1 is None or t2 is None or t3 is None:
+        return None
+    if t3 == t1:
+        return 100
+    return round(((float(t2) - t1) / (float(t3) - t1)) * 100.0)
+
+
+def _temperature_delta(current):
+    outdoor = current[IZZY_SENSOR_TEMPERATURE_OUTDOOR_ID]
+    supply = current[IZZY_SENSOR_TEMPERATURE_SUPPLY_ID]
+    if outdoor is None or supply is None:
+        return None
+    return supply - outdoor
+
+
+def create_derived_sensors(cf_controller, airflow_curve=IZZY_AIRFLOW_CURVE) -> DerivedSensorEngine:
+    """Build the engine with all virtual sensors of the controller."""
+    curve = tuple(sorted(airflow_curve))
+
+    def recovered_power(current):
+        delta = current[IZZY_SENSOR_TEMPERATURE_DELTA_ID]
+        speed = current[IZZY_SENSOR_FAN_SUPPLY_SPEED_ID]
+        if delta is None or speed is None:
+            return None
+        if current[IZZY_SENSOR_UNIT_STATE_ID] != IZZY_CMD_UNIT_STATE_ON:
+            return 0
+        return round(IZZY_AIR_HEAT_CAPACITY * (airflow(curve, speed) / 3600.0) * delta)
+
+    engine = DerivedSensorEngine()
+    engine.add(DerivedSensor(IZZY_SENSOR_EFFICIENCY_ID,
+                             (IZZY_SENSOR_TEMPERATURE_OUTDOOR_ID, IZZY_SENSOR_TEMPERATURE_SUPPLY_ID, IZZY_SENSOR_TEMPERATURE_EXTRACT_ID),
+                             _efficiency))
+    engine.add(DerivedSensor(IZZY_SENSOR_TEMPERATURE_DELTA_ID,
+                             (IZZY_SENSOR_TEMPERATURE_OUTDOOR_ID, IZZY_SENSOR_TEMPERATURE_SUPPLY_ID),
+                             _temperature_delta))
+    engine.add(DerivedSensor(IZZY_SENSOR_RECOVERED_POWER_ID,
+                             (IZZY_SENSOR_TEMPERATURE_DELTA_ID, IZZY_SENSOR_FAN_SUPPLY_SPEED_ID, IZZY_SENSOR_UNIT_STATE_ID),
+                             recovered_power))
+    engine.add(DerivedSensor(IZZY_SENSOR_CF_EXTRACT_CORRECTION_ID, (IZZY_SENSOR_CF_STATE_ID,),
+                             lambda current: cf_controller.get_extract_correction()))
+    engine.add(DerivedSensor(IZZY_SENSOR_CF_SUPPLY_CORRECTION_ID, (IZZY_SENSOR_CF_STATE_ID,),
+                             lambda current: cf_controller.get_supply_correction()))
+    return engine
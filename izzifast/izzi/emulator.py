@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+"""Bridges that do not need a unit: an emulated unit and capture replay.
+
+Used by the command line monitor and the benchmarks.
+"""
+
+import math
+import struct
+import time
+from array import array
+from collections import deque
+from .const import *
+from .controller import IzziBridge
+from .capture import read_capture, CAPTURE_KIND_RX
+
+class IzziEmulatorBridge(IzziBridge):
+    """Emulated unit sending a status frame every interval seconds.
+
+    Temperatures follow a slow daily like swing so derived sensors change.
+    Written command frames are kept in written as (monotonic time, frame).
+    interval 0 returns frames as fast as they are read, frames limits the
+    number of status frames, read_message returns None afterwards. phase
+    shifts the temperature swing, so several emulated units differ.
+    """
+
+    def __init__(self, interval : float = 0.5, frames : int = None, phase : int = 0):
+        self.interval = interval
+        self.frames = frames
+        self.phase = phase
+        self.sent = 0
+        self.last_read_at = None
+        self.exhausted_at = None
+        self.written = deque([], 1024)
+        self.on_write = None
+        self._connected = False
+        self._next_frame = 0.0
+        self._message = array('B', [0] * IZZI_MESSAGE_LENGTH)
+        self._message[IZZI_STATUS_MSG_ID_INDEX] = IZZI_STATUS_MESSAGE_ID
+        # Created on connect, so an unconnected bridge can be pickled into a worker process
+        self._packers = None
+
+    def connect(self) -> bool:
+        if self._packers is None:
+            self._packers = {sensor_id: (index, struct.Struct(fmt).pack_into) for sensor_id, index, fmt in IZZI_STATUS_LAYOUT}
+        self._connected = True
+        self._next_frame = time.monotonic()
+        return True
+
+    def disconnect(self) -> bool:
+        self._connected = False
+        return True
+
+    def is_connected(self):
+        return self._connected
+
+    def _set(self, sensor_id : int, value : int):
+        index, pack_into = self._packers[sensor_id]
+        pack_into(self._message, index, value)
+
+    def read_message(self, timeout=3.0) -> b'':
+        if self.frames is not None and self.sent >= self.frames:
+            if self.exhausted_at is None:
+                self.exhausted_at = time.monotonic()
+            time.sleep(min(timeout, 0.1))
+            return None
+        if self.interval > 0:
+            delay = self._next_frame - time.monotonic()
+            if delay > timeout:
+                time.sleep(timeout)
+                return None
+            if delay > 0:
+                time.sleep(delay)
+            self._next_frame = max(self._next_frame + self.interval, time.monotonic())
+
+        # One emulated hour per 100 frames
+        swing = math.sin((self.sent + self.phase) * 2.0 * math.pi / 2400.0)
+        outdoor = int(round(5 + 8 * swing))
+        self._set(IZZY_SENSOR_TEMPERATURE_OUTDOOR_ID, outdoor)
+        self._set(IZZY_SENSOR_TEMPERATURE_EXTRACT_ID, 22)
+        self._set(IZZY_SENSOR_TEMPERATURE_SUPPLY_ID, int(round(outdoor + 0.85 * (22 - outdoor))))
+        self._set(IZZY_SENSOR_TEMPERATURE_EXHAUST_ID, int(round(22 - 0.85 * (22 - outdoor))))
+        self.sent += 1
+        self.last_read_at = time.monotonic()
+        return bytes(self._message)
+
+    def write_message(self, message: b'') -> bool:
+        frame = bytes(message)
+        self.written.append((time.monotonic(), frame))
+        if self.on_write is not None:
+            self.on_write(frame)
+        return True
+
+
+class IzziReplayBridge(IzziBridge):
+    """Replays received frames of capture files.
+
+    speed 1 keeps the recorded timing, 0 replays as fast as possible.
+    finished is set once all files were read.
+    """
+
+    def __init__(self, paths, speed : float = 1.0):
+        self.paths = list(paths)
+        self.speed = speed
+        self.finished = False
+        self.written = 0
+        self._records = self._iter_records()
+        self._connected = False
+        self._offset = None
+
+    def _iter_records(self):
+        for path in self.paths:
+            for ts, kind, frame in read_capture(path):
+                if kind == CAPTURE_KIND_RX:
+                    yield ts, frame
+
+    def connect(self) -> bool:
+        self._connected = True
+        return True
+
+    def disconnect(self) -> bool:
+        self._connected = False
+        return True
+
+    def is_connected(self):
+        return self._connected
+
+    def read_message(self, timeout=3.0) -> b'':
+        record = next(self._records, None)
+        if record is None:
+            self.finished = True
+            time.sleep(min(timeout, 0.1))
+            return None
+        ts, frame = record
+        if self.speed > 0:
+            now = time.monotonic()
+            if self._offset is None:
+                self._offset = now - ts / self.speed
+            delay = self._offset + ts / self.speed - now
+            if delay > 0:
+                time.sleep(delay)
+        return frame
+
+    def write_message(self, message: b'') -> bool:
+        self.written += 1
+        return True
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+
+class RecoveredEnergyIntegrator(object):
+    """Integrates recovered power into heating and cooling energy.
+
+    Power is sampled once per status frame, the energy is accumulated with
+    the trapezoidal rule between consecutive samples. Positive power (supply
+    warmer than outdoor) counts as recovered heat, negative as recovered cooling.
+    """
+
+    # Samples further apart are treated as a gap in data and not integrated
+    MAX_SAMPLE_GAP = 60.0
+
+    def __init__(self, publish_interval : float = 60.0):
+        self.publish_interval = publish_interval
+        self.heat_kwh = 0.0
+        self.cool_kwh = 0.0
+        self._last_time = None
+        self._last_power = None
+        self._last_publish = None
+
+    def update(self, now : float, power) -> bool:
+        """Add a power sample in W taken at monotonic time now, returns True when totals should be published."""
+        if power is None:
+            self._last_time = None
+            self._last_power = None
+            return False
+
+        if self._last_time is not None:
+            dt = now - self._last_time
+            if 0.0 < dt <= self.MAX_SAMPLE_GAP:
+                # W*s -> kWh
+                scale = dt / 2.0 / 3600000.0
+                self.heat_kwh += (max(power, 0.0) + max(self._last_power, 0.0)) * scale
+                self.cool_kwh += (max(-power, 0.0) + max(-self._last_power, 0.0)) * scale
+        self._last_time = now
+        self._last_power = power
+
+        if self._last_publish is None or now - self._last_publish >= self.publish_interval:
+            self._last_publish = now
+            return True
+        return False
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""Convert frame captures into columnar files.
+
+Run from the integration directory:
+
+    python -m izzi.export captures/izzi_*.cap -o month.npz
+    python -m izzi.export captures/izzi_*.cap -o month.parquet
+
+NumPy output is a single .npz with status_* and command_* columns.
+Parquet / Arrow output (needs pyarrow) writes <name>.status.parquet and
+<name>.command.parquet. Records are decoded in vectorised chunks.
+"""
+
+import argparse
+import os
+import sys
+import time
+import numpy as np
+from .const import *
+from .capture import CAPTURE_MAGIC, CAPTURE_RECORD
+from .decoder import decode_status_frames, decode_command_frames
+
+CAPTURE_DTYPE = np.dtype([('ts', '<f8'), ('kind', 'u1'), ('frame', 'u1', (15,))])
+assert CAPTURE_DTYPE.itemsize == CAPTURE_RECORD.size
+
+CHUNK_RECORDS = 1 << 20
+
+
+def _decode(records, message_id : int, decode) -> dict:
+    """Decode all records of a chunk holding frames with message_id."""
+    selected = records[records['frame'][:, 0] == message_id]
+    frames = decode(selected['frame'])
+    decoded = {"ts": selected['ts'].copy(), "kind": selected['kind'].copy()}
+    for name in frames.dtype.names[1:]:
+        decoded[name] = frames[name].copy()
+    return decoded
+
+
+def iter_chunks(paths, chunk_records : int = CHUNK_RECORDS):
+    """Yield (status, command) column dicts for every chunk of the captures."""
+    for path in paths:
+        with open(path, 'rb') as capture:
+            if capture.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+                raise ValueError("Not an izzi capture file: %s" % path)
+        # Only whole records, a torn record at the end is skipped
+        count = (os.path.getsize(path) - len(CAPTURE_MAGIC)) // CAPTURE_DTYPE.itemsize
+        if count == 0:
+            continue
+        records = np.memmap(path, dtype=CAPTURE_DTYPE, mode='r', offset=len(CAPTURE_MAGIC), shape=(count,))
+        for start in range(0, len(records), chunk_records):
+            chunk = records[start:start + chunk_records]
+            yield (_decode(chunk, IZZI_STATUS_MESSAGE_ID, decode_status_frames),
+                   _decode(chunk, IZZI_COMMAND_MESSAGE_ID, decode_command_frames))
+
+
+def export_npz(paths, output : str) -> int:
+    status_parts = []
+    command_parts = []
+    for status, command in iter_chunks(paths):
+        status_parts.append(status)
+        command_parts.append(command)
+    columns = {}
+    for prefix, parts in (("status", status_parts), ("command", command_parts)):
+        if not parts:
+            continue
+        for name in parts[0]:
+            columns[prefix + "_" + name] = np.concatenate([part[name] for part in parts])
+    np.savez(output, **columns)
+    return sum(len(part["ts"]) for part in status_parts + command_parts)
+
+
+def export_arrow(paths, output : str, parquet : bool) -> int:
+    import pyarrow as pa
+    if parquet:
+        import pyarrow.parquet as pq
+    else:
+        import pyarrow.feather as feather
+
+    base, extension = os.path.splitext(output)
+    writers = {}
+    tables = {"status": [], "command": []}
+    count = 0
+    try:
+        for status, command in iter_chunks(paths):
+            for prefix, columns in (("status", status), ("command", command)):
+                if len(columns["ts"]) == 0:
+                    continue
+                count += len(columns["ts"])
+                table = pa.table(columns)
+                if not parquet:
+                    tables[prefix].append(table)
+                    continue
+                # Stream every chunk as a row group
+                if prefix not in writers:
+                    writers[prefix] = pq.ParquetWriter("%s.%s%s" % (base, prefix, extension), table.schema)
+                writers[prefix].write_table(table)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    if not parquet:
+        for prefix, parts in tables.items():
+            if parts:
+                feather.write_feather(pa.concat_tables(parts), "%s.%s%s" % (base, prefix, extension))
+    return count
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m izzi.export", description="Convert izzi frame captures to columnar files.")
+    parser.add_argument("captures", nargs="+", help="capture files, processed in the given order")
+    parser.add_argument("-o", "--output", required=True, help="output file, .npz, .parquet or .arrow/.feather")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    extension = os.path.splitext(args.output)[1].lower()
+    if extension == ".npz":
+        count = export_npz(args.captures, args.output)
+    elif extension in (".parquet", ".arrow", ".feather"):
+        try:
+            count = export_arrow(args.captures, args.output, extension == ".parquet")
+        except ImportError:
+            print("pyarrow is required for %s output" % extension, file=sys.stderr)
+            return 1
+    else:
+        print("Unsupported output format %s" % extension, file=sys.stderr)
+        return 1
+    elapsed = time.perf_counter() - start
+    print("Exported %d frames in %.2f s" % (count, elapsed))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
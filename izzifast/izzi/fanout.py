@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+import logging
+import selectors
+import socket
+import threading
+from .capture import CAPTURE_KIND_RX, CAPTURE_KIND_TX
+
+_LOGGER = logging.getLogger('izzicontroller')
+
+class _Subscriber(object):
+
+    __slots__ = ("sock", "address", "pending", "dropped")
+
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.pending = bytearray()
+        self.dropped = False
+
+
+class FrameFanout(object):
+    """Local TCP server re-broadcasting bus frames to read-only subscribers.
+
+    Subscribers see the same byte stream as a direct bridge client, the
+    frames the unit sent and the command frames written to it. Meant to be
+    registered as a controller frame listener, the listener only appends to
+    per subscriber buffers; a selector thread sends them. A subscriber whose
+    buffer grows beyond max_pending bytes is dropped, so a slow client never
+    stalls the controller loop. Data sent by subscribers is discarded.
+    """
+
+    def __init__(self, address, max_pending : int = 64 * 1024):
+        self.address = address
+        self.max_pending = max_pending
+        self.dropped = 0
+        self.frames = 0
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._selector = None
+        self._server = None
+        self._wake_recv = None
+        self._wake_send = None
+        self._woken = False
+        self._thread = None
+        self._stopping = False
+
+    def start(self):
+        self._server = socket.create_server(self.address)
+        self._server.setblocking(False)
+        self._wake_recv, self._wake_send = socket.socketpair()
+        self._wake_recv.setblocking(False)
+        self._wake_send.setblocking(False)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._server, selectors.EVENT_READ, None)
+        self._selector.register(self._wake_recv, selectors.EVENT_READ, None)
+        self._stopping = False
+        self._thread = threading.Thread(target=self._serve_loop, name="izzi_fanout", daemon=True)
+        self._thread.start()
+        _LOGGER.info("Frame fan-out listening on %s", str(self.address))
+
+    def stop(self):
+        self._stopping = True
+        self._wake()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for subscriber in self._subscribers:
+            subscriber.sock.close()
+        self._subscribers = []
+        for sock in (self._server, self._wake_recv, self._wake_send):
+            if sock is not None:
+                sock.close()
+        self._server = self._wake_recv = self._wake_send = None
+        if self._selector is not None:
+            self._selector.close()
+            self._selector = None
+
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def __call__(self, ts : float, kind : int, frame):
+        if kind != CAPTURE_KIND_RX and kind != CAPTURE_KIND_TX:
+            return
+        self.frames += 1
+        if not self._subscribers:
+            return
+        max_pending = self.max_pending
+        with self._lock:
+            for subscriber in self._subscribers:
+                if len(subscriber.pending) >= max_pending:
+                    subscriber.dropped = True
+                else:
+                    subscriber.pending += frame
+        self._wake()
+
+    def _wake(self):
+        # One wakeup byte per selector round is enough
+        if self._woken or self._wake_send is None:
+            return
+        self._woken = True
+        try:
+            self._wake_send.send(b'\0')
+        except OSError:
+            pass
+
+    def _accept(self):
+        try:
+            sock, address = self._server.accept()
+        except OSError:
+            return
+        sock.setblocking(False)
+        subscriber = _Subscriber(sock, address)
+        self._selector.register(sock, selectors.EVENT_READ, subscriber)
+        with self._lock:
+            self._subscribers = self._subscribers + [subscriber]
+        _LOGGER.info("Frame fan-out subscriber %s connected", str(address))
+
+    def _close(self, subscriber : _Subscriber, reason : str):
+        with self._lock:
+            self._subscribers = [other for other in self._subscribers if other is not subscriber]
+        self._selector.unregister(subscriber.sock)
+        subscriber.sock.close()
+        _LOGGER.info("Frame fan-out subscriber %s %s", str(subscriber.address), reason)
+
+    def _send(self, subscriber : _Subscriber):
+        with self._lock:
+            data = bytes(subscriber.pending)
+        if not data:
+            return
+        try:
+            sent = subscriber.sock.send(data)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self._close(subscriber, "disconnected")
+            return
+        with self._lock:
+            del subscriber.pending[:sent]
+            waiting = len(subscriber.pending) > 0
+        # Wait for the socket to become writable only while data is pending
+        self._selector.modify(subscriber.sock, selectors.EVENT_READ | selectors.EVENT_WRITE if waiting else selectors.EVENT_READ, subscriber)
+
+    def _serve_loop(self):
+        while not self._stopping:
+            for key, events in self._selector.select(1.0):
+                subscriber = key.data
+                if key.fileobj is self._server:
+                    self._accept()
+                elif key.fileobj is self._wake_recv:
+                    # Drain before clearing, a byte sent in between must not be lost
+                    try:
+                        while self._wake_recv.recv(256):
+                            pass
+                    except OSError:
+                        pass
+                    self._woken = False
+                elif events & selectors.EVENT_READ:
+                    try:
+                        data = subscriber.sock.recv(256)
+                    except BlockingIOError:
+                        continue
+                    except OSError:
+                        data = b''
+                    if not data:
+                        self._close(subscriber, "disconnected")
+            for subscriber in self._subscribers:
+                if subscriber.dropped:
+                    self.dropped += 1
+                    self._close(subscriber, "dropped, not reading fast enough")
+                elif subscriber.pending:
+                    self._send(subscriber)
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+"""Filter clogging trend estimation from CF pressure samples.
+
+Run from the integration directory to reproduce the estimate from captures:
+
+    python -m izzi.filterload captures/izzi_*.cap --params-max 120
+"""
+
+import argparse
+import sys
+import time
+from .const import *
+from .capture import read_capture, CAPTURE_KIND_CF_SAMPLE, CAPTURE_CF_SAMPLE
+from .cfinput import cf_expected_param, CF_CHANNEL_SUPPLY, CF_CHANNEL_EXTRACT
+
+SECONDS_PER_DAY = 86400.0
+
+# Seconds between published estimates
+FILTER_LOAD_PUBLISH_INTERVAL = 600.0
+
+
+class FilterLoadEstimator(object):
+    """Running regression of CF param residual vs commanded speed and time.
+
+    Fits residual = a + b * speed + c * days with exponential forgetting,
+    the 3x3 normal equations are updated in O(1) per sample. The slope c
+    is the residual rise per day caused by the filter clogging.
+    """
+
+    def __init__(self, half_life_days : float = 30.0):
+        self.half_life = half_life_days * SECONDS_PER_DAY
+        self._t0 = None
+        self._last_ts = None
+        # Weighted sums of x * x^T and x * residual, x = (1, speed, days)
+        self._xx = [[0.0] * 3 for _ in range(3)]
+        self._xy = [0.0] * 3
+        self.samples = 0
+
+    def add(self, ts : float, speed : float, residual : float):
+        if self._t0 is None:
+            self._t0 = ts
+        elif ts > self._last_ts:
+            decay = 0.5 ** ((ts - self._last_ts) / self.half_life)
+            for row in self._xx:
+                for i in range(3):
+                    row[i] *= decay
+            for i in range(3):
+                self._xy[i] *= decay
+        self._last_ts = ts if self._last_ts is None else max(ts, self._last_ts)
+
+        x = (1.0, speed / 100.0, (ts - self._t0) / SECONDS_PER_DAY)
+        for i in range(3):
+            xi = x[i]
+            row = self._xx[i]
+            for j in range(3):
+                row[j] += xi * x[j]
+            self._xy[i] += xi * residual
+        self.samples += 1
+
+    def slope(self):
+        """Residual change per day, None until enough data."""
+        if self.samples < 10:
+            return None
+        # Small ridge keeps the system solvable when speed never changes
+        m = [row[:] + [self._xy[i]] for i, row in enumerate(self._xx)]
+        for i in range(3):
+            m[i][i] += 1e-6
+        # Gaussian elimination with partial pivoting
+        for col in range(3):
+            pivot = max(range(col, 3), key=lambda r: abs(m[r][col]))
+            if abs(m[pivot][col]) < 1e-12:
+                return None
+            m[col], m[pivot] = m[pivot], m[col]
+            for r in range(col + 1, 3):
+                f = m[r][col] / m[col][col]
+                for k in range(col, 4):
+                    m[r][k] -= f * m[col][k]
+        coef = [0.0] * 3
+        for r in (2, 1, 0):
+            coef[r] = (m[r][3] - sum(m[r][k] * coef[k] for k in range(r + 1, 3))) / m[r][r]
+        return coef[2]
+
+    def get_state(self) -> dict:
+        return {"t0": self._t0, "last_ts": self._last_ts, "xx": [row[:] for row in self._xx],
+                "xy": self._xy[:], "samples": self.samples}
+
+    def set_state(self, state : dict):
+        """Continue the regression from get_state(), half life is kept."""
+        xx = [[float(value) for value in row] for row in state["xx"]]
+        xy = [float(value) for value in state["xy"]]
+        if len(xx) != 3 or len(xy) != 3 or any(len(row) != 3 for row in xx):
+            raise ValueError("Invalid filter load regression")
+        self._t0 = state["t0"]
+        self._last_ts = state["last_ts"]
+        self._xx = xx
+        self._xy = xy
+        self.samples = int(state["samples"])
+
+
+class FilterLoadMonitor(object):
+    """Estimates filter load from CF samples of both fans.
+
+    Residual is the difference between measured and expected CF param in
+    percent of params_max. Load is the residual rise since the last filter
+    reset relative to replace_residual, 100 % meaning filters should be
+    replaced. The worse of both fans is reported.
+    """
+
+    def __init__(self, params_max : float = 0.0, replace_residual : float = 25.0, half_life_days : float = 30.0):
+        self.params_max = params_max
+        self.replace_residual = replace_residual
+        self._estimators = (FilterLoadEstimator(half_life_days), FilterLoadEstimator(half_life_days))
+        self._speeds = [None, None]
+        self.reset_ts = None
+
+    def set_speeds(self, supply, extract):
+        """Commanded fan speeds, taken from the last command frame."""
+        self._speeds[CF_CHANNEL_SUPPLY] = supply
+        self._speeds[CF_CHANNEL_EXTRACT] = extract
+
+    def add_sample(self, ts : float, channel : int, value : float):
+        speed = self._speeds[channel]
+        if self.params_max <= 0.0 or not speed:
+            return
+        if self.reset_ts is None:
+            self.reset_ts = ts
+        residual = (value - cf_expected_param(self.params_max, speed)) / self.params_max * 100.0
+        self._estimators[channel].add(ts, speed, residual)
+
+    def reset(self, ts : float):
+        """Filters were replaced, start counting load from ts."""
+        self.reset_ts = ts
+        self._estimators = tuple(FilterLoadEstimator(e.half_life / SECONDS_PER_DAY) for e in self._estimators)
+
+    def get_state(self) -> dict:
+        """Regression of both fans and the reset time, see set_state."""
+        return {"reset_ts": self.reset_ts, "estimators": [e.get_state() for e in self._estimators]}
+
+    def set_state(self, state : dict):
+        """Continue from a state saved before a restart."""
+        estimators = tuple(FilterLoadEstimator(e.half_life / SECONDS_PER_DAY) for e in self._estimators)
+        for estimator, saved in zip(estimators, state["estimators"]):
+            estimator.set_state(saved)
+        self._estimators = estimators
+        self.reset_ts = state["reset_ts"]
+
+    def estimate(self, ts : float):
+        """Return (load percent, days to replacement), None where unknown."""
+        load = None
+        days = None
+        for estimator in self._estimators:
+            slope = estimator.slope()
+            if slope is None:
+                continue
+            rise = max(0.0, slope * (ts - self.reset_ts) / SECONDS_PER_DAY)
+            channel_load = rise / self.replace_residual * 100.0
+            if load is None or channel_load > load:
+                load = channel_load
+            if slope > 0:
+                channel_days = max(0.0, (self.replace_residual - rise) / slope)
+                if days is None or channel_days < days:
+                    days = channel_days
+        if load is not None:
+            load = round(load, 1)
+        if days is not None:
+            days = round(days)
+        return load, days
+
+
+def replay_filter_load(paths, params_max : float, replace_residual : float = 25.0, half_life_days : float = 30.0, reset_ts : float = None) -> FilterLoadMonitor:
+    """Feed a monitor with the command frames and CF samples of captures, in order.
+
+    reset_ts is the time filters were last replaced, earlier samples are ignored.
+    """
+    monitor = FilterLoadMonitor(params_max, replace_residual, half_life_days)
+    for path in paths:
+        for ts, kind, frame in read_capture(path):
+            if kind == CAPTURE_KIND_CF_SAMPLE:
+                if reset_ts is not None and ts < reset_ts:
+                    continue
+                channel, value = CAPTURE_CF_SAMPLE.unpack(frame)
+                monitor.add_sample(ts, channel, value)
+            elif frame[IZZI_CMD_MSG_ID_INDEX] == IZZI_COMMAND_MESSAGE_ID:
+                monitor.set_speeds(frame[IZZI_CMD_MSG_SUPPLY_FAN_SPEED_INDEX], frame[IZZI_CMD_MSG_EXTRACT_FAN_SPEED_INDEX])
+    return monitor
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m izzi.filterload", description="Estimate filter load from izzi captures.")
+    parser.add_argument("captures", nargs="+", help="capture files, processed in the given order")
+    parser.add_argument("--params-max", type=float, required=True, help="cf_params_max of the installation")
+    parser.add_argument("--replace-residual", type=float, default=25.0)
+    parser.add_argument("--half-life", type=float, default=30.0, help="regression half life in days")
+    parser.add_argument("--reset", type=float, default=None, help="unix time of the last filter replacement")
+    parser.add_argument("--at", type=float, default=None, help="estimate at this unix time, default now")
+    args = parser.parse_args(argv)
+
+    monitor = replay_filter_load(args.captures, args.params_max, args.replace_residual, args.half_life, args.reset)
+    load, days = monitor.estimate(args.at if args.at is not None else time.time())
+    print("Filter load: %s %%, days to replacement: %s" % (load, days))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+
+from array import array
+
+class SampleWindow(object):
+    """Fixed size window of the last samples with an O(1) running mean."""
+
+    def __init__(self, size : int):
+        self.size = size
+        self._samples = array('d', [0.0] * size)
+        self._index = 0
+        self._count = 0
+        self._sum = 0.0
+
+    def add(self, value : float):
+        if self._count == self.size:
+            self._sum -= self._samples[self._index]
+        else:
+            self._count += 1
+        self._samples[self._index] = value
+        self._sum += value
+        self._index += 1
+        if self._index == self.size:
+            self._index = 0
+
+    def mean(self):
+        if self._count == 0:
+            return None
+        return self._sum / self._count
+
+    def clear(self):
+        self._index = 0
+        self._count = 0
+        self._sum = 0.0
+
+    def __len__(self):
+        return self._count
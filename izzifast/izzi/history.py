@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+
+import threading
+from array import array
+from .const import *
+
+HISTORY_RESOLUTIONS = ("raw", "1m", "15m", "1h")
+
+class RingSeries(object):
+    """Preallocated ring of points with increasing timestamps.
+
+    Every point has a timestamp and fields values, stored column wise in
+    double arrays. Oldest points are overwritten when the ring is full.
+    """
+
+    def __init__(self, capacity : int, fields : int):
+        self.capacity = capacity
+        self._ts = array('d', [0.0] * capacity)
+        self._columns = [array('d', [0.0] * capacity) for _ in range(fields)]
+        self._start = 0
+        self._count = 0
+
+    def append(self, ts : float, *values):
+        if self._count < self.capacity:
+            index = (self._start + self._count) % self.capacity
+            self._count += 1
+        else:
+            index = self._start
+            self._start = (self._start + 1) % self.capacity
+        self._ts[index] = ts
+        for column, value in zip(self._columns, values):
+            column[index] = value
+
+    def oldest(self):
+        if self._count == 0:
+            return None
+        return self._ts[self._start]
+
+    def _bisect(self, ts : float) -> int:
+        """First logical index with timestamp >= ts."""
+        lo = 0
+        hi = self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._ts[(self._start + mid) % self.capacity] < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def query(self, start : float, end : float) -> list:
+        """Points with start <= timestamp <= end as [timestamp, values...] lists."""
+        points = []
+        position = self._bisect(start)
+        while position < self._count:
+            index = (self._start + position) % self.capacity
+            ts = self._ts[index]
+            if ts > end:
+                break
+            points.append([ts] + [column[index] for column in self._columns])
+            position += 1
+        return points
+
+    def __len__(self):
+        return self._count
+
+
+class _Rollup(object):
+    """Accumulates samples of one bucket of a downsampling tier."""
+
+    def __init__(self, period : float, capacity : int):
+        self.period = period
+        self.series = RingSeries(capacity, 3)
+        self.bucket = None
+        self.min = 0.0
+        self.max = 0.0
+        self.sum = 0.0
+        self.count = 0
+
+    def add(self, ts : float, value : float):
+        bucket = ts - (ts % self.period)
+        if bucket != self.bucket:
+            if self.count > 0:
+                self.series.append(self.bucket, self.min, self.max, self.sum / self.count)
+            self.bucket = bucket
+            self.min = value
+            self.max = value
+            self.sum = value
+            self.count = 1
+            return
+        if value < self.min:
+            self.min = value
+        elif value > self.max:
+            self.max = value
+        self.sum += value
+        self.count += 1
+
+
+class SensorHistory(object):
+    """Raw samples plus 1 min, 15 min and 1 h min/max/mean rollups of one sensor."""
+
+    RAW_CAPACITY = 3600
+    # Period in seconds, number of points
+    ROLLUPS = ((60, 1440), (900, 672), (3600, 2160))
+
+    def __init__(self, raw_capacity : int = RAW_CAPACITY, rollups=ROLLUPS):
+        self.raw = RingSeries(raw_capacity, 1)
+        self.rollups = [_Rollup(period, capacity) for period, capacity in rollups]
+
+    def add(self, ts : float, value : float):
+        self.raw.append(ts, value)
+        for rollup in self.rollups:
+            rollup.add(ts, value)
+
+    def _series(self, resolution : str) -> RingSeries:
+        if resolution == "raw":
+            return self.raw
+        return self.rollups[HISTORY_RESOLUTIONS.index(resolution) - 1].series
+
+    def resolve(self, start : float) -> str:
+        """Finest resolution still holding data from start.
+
+        When no resolution reaches back to start, as right after a restart,
+        the finest one holding any data is used.
+        """
+        for resolution in HISTORY_RESOLUTIONS:
+            oldest = self._series(resolution).oldest()
+            if oldest is not None and oldest <= start:
+                return resolution
+        for resolution in HISTORY_RESOLUTIONS:
+            if len(self._series(resolution)) > 0:
+                return resolution
+        return HISTORY_RESOLUTIONS[-1]
+
+    def query(self, start : float, end : float, resolution : str = None):
+        """Return resolution and points between start and end.
+
+        Raw points are [timestamp, value], rollup points are
+        [bucket start, min, max, mean].
+        """
+        if resolution is None:
+            resolution = self.resolve(start)
+        if resolution == "raw":
+            return resolution, self.raw.query(start, end)
+
+        rollup = self.rollups[HISTORY_RESOLUTIONS.index(resolution) - 1]
+        # Include the bucket start falls into and the one still being filled
+        points = rollup.series.query(start - (start % rollup.period), end)
+        if rollup.count > 0 and rollup.bucket <= end and rollup.bucket + rollup.period > start:
+            points.append([rollup.bucket, float(rollup.min), float(rollup.max), rollup.sum / rollup.count])
+        return resolution, points
+
+
+class IzziHistory(object):
+    """In memory history of numeric sensors of the state table.
+
+    record() runs in the connection thread and query() in the event loop,
+    a lock keeps queries from seeing a ring half way through an append.
+    """
+
+    TRACKED_SENSORS = (IZZY_SENSOR_TEMPERATURE_SUPPLY_ID,
+                       IZZY_SENSOR_TEMPERATURE_EXTRACT_ID,
+                       IZZY_SENSOR_TEMPERATURE_EXHAUST_ID,
+                       IZZY_SENSOR_TEMPERATURE_OUTDOOR_ID,
+                       IZZY_SENSOR_FAN_SUPPLY_SPEED_ID,
+                       IZZY_SENSOR_FAN_EXTRACT_SPEED_ID,
+                       IZZY_SENSOR_EFFICIENCY_ID,
+                       IZZY_SENSOR_TEMPERATURE_DELTA_ID,
+                       IZZY_SENSOR_RECOVERED_POWER_ID,
+                       IZZY_SENSOR_CF_SUPPLY_CORRECTION_ID,
+                       IZZY_SENSOR_CF_EXTRACT_CORRECTION_ID)
+
+    def __init__(self, raw_capacity : int = SensorHistory.RAW_CAPACITY, sensors=TRACKED_SENSORS):
+        self.sensors = tuple(sensors)
+        self._series = [None] * IZZY_SENSOR_ID_COUNT
+        self._lock = threading.Lock()
+        for sensor_id in self.sensors:
+            self._series[sensor_id] = SensorHistory(raw_capacity)
+
+    def record(self, ts : float, current):
+        """Add the current value of every tracked sensor."""
+        series = self._series
+        with self._lock:
+            for sensor_id in self.sensors:
+                value = current[sensor_id]
+                if value is not None:
+                    series[sensor_id].add(ts, value)
+
+    def query(self, sensor_id : int, start : float, end : float, resolution : str = None):
+        series = self._series[sensor_id] if 0 <= sensor_id < IZZY_SENSOR_ID_COUNT else None
+        if series is None:
+            return None, []
+        with self._lock:
+            return series.query(start, end, resolution)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+import logging
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from .const import *
+from .capture import CAPTURE_KIND_RX, CAPTURE_KIND_TX
+from .decoder import SENSOR_NAMES
+
+_LOGGER = logging.getLogger('izzicontroller')
+
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _number(value) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return repr(value) if isinstance(value, float) else str(value)
+
+class ControllerMetrics(object):
+    """Prometheus text format of a controller's state and counters.
+
+    Registered as a controller frame listener, which only counts frames.
+    Sensor values, the bulk of the text, are rendered on the first scrape
+    after the state table changed and served from the rendered buffer
+    until the next change, frames with unchanged values cost no render.
+    Setpoints and counters are a few lines, formatted on every scrape.
+    """
+
+    def __init__(self, controller, labels : dict = None):
+        self.controller = controller
+        self.frames = {CAPTURE_KIND_RX: 0, CAPTURE_KIND_TX: 0}
+        self.renders = 0
+        self.scrapes = 0
+        self._rendered_version = -1
+        self._sensors = b''
+        extra = "".join(',%s="%s"' % (key, value) for key, value in sorted((labels or {}).items()))
+        # Label sets are fixed, so only the values are formatted on render
+        self._sensor_prefixes = tuple((sensor_id, 'izzi_sensor{sensor="%s"%s} ' % (name, extra))
+                                      for sensor_id, name in sorted(SENSOR_NAMES.items()))
+        self._setpoint_prefixes = tuple((sensor_id, 'izzi_setpoint{sensor="%s"%s} ' % (SENSOR_NAMES[sensor_id], extra))
+                                        for sensor_id, index, fmt in IZZI_COMMAND_LAYOUT)
+        self._labels = "{%s}" % extra[1:] if extra else ""
+        self._extra = extra
+
+    def __call__(self, ts : float, kind : int, frame):
+        if kind in self.frames:
+            self.frames[kind] += 1
+
+    def render_sensors(self) -> str:
+        current = self.controller.state.current
+        lines = ["# HELP izzi_sensor Last value of decoded, derived and CF sensors.",
+                 "# TYPE izzi_sensor gauge"]
+        for sensor_id, prefix in self._sensor_prefixes:
+            value = current[sensor_id]
+            if value is not None:
+                lines.append(prefix + _number(value))
+        return "\n".join(lines) + "\n"
+
+    def render_counters(self) -> str:
+        controller = self.controller
+        state = controller.state
+        target = state.target
+        extra = self._extra
+        lines = ["# HELP izzi_setpoint Requested value of command fields.",
+                 "# TYPE izzi_setpoint gauge"]
+        for sensor_id, prefix in self._setpoint_prefixes:
+            value = target[sensor_id]
+            if value is not None:
+                lines.append(prefix + _number(value))
+        cf = controller.cf_controller
+        lines.append("# HELP izzi_cf_error Difference between measured and expected CF param.")
+        lines.append("# TYPE izzi_cf_error gauge")
+        lines.append('izzi_cf_error{fan="supply"%s} %s' % (extra, _number(float(cf.get_supply_error()))))
+        lines.append('izzi_cf_error{fan="extract"%s} %s' % (extra, _number(float(cf.get_extract_error()))))
+        lines.append("# HELP izzi_cf_enabled CF module active.")
+        lines.append("# TYPE izzi_cf_enabled gauge")
+        lines.append("izzi_cf_enabled%s %s" % (self._labels, _number(cf.is_enabled())))
+        lines.append("# HELP izzi_connected Bridge connection open.")
+        lines.append("# TYPE izzi_connected gauge")
+        lines.append("izzi_connected%s %s" % (self._labels, _number(bool(controller.is_connected()))))
+        lines.append("# HELP izzi_frames_total Frames read from and written to the bus.")
+        lines.append("# TYPE izzi_frames_total counter")
+        lines.append('izzi_frames_total{direction="rx"%s} %d' % (extra, self.frames[CAPTURE_KIND_RX]))
+        lines.append('izzi_frames_total{direction="tx"%s} %d' % (extra, self.frames[CAPTURE_KIND_TX]))
+        lines.append("# HELP izzi_published_total Sensor values handed to the sensor callback.")
+        lines.append("# TYPE izzi_published_total counter")
+        lines.append("izzi_published_total%s %d" % (self._labels, state.published_count))
+        lines.append("# HELP izzi_suppressed_total Sensor changes held back by publish policies.")
+        lines.append("# TYPE izzi_suppressed_total counter")
+        lines.append("izzi_suppressed_total%s %d" % (self._labels, state.suppressed_count))
+        lines.append("# HELP izzi_command_builds_total Command frames built by the connection loop.")
+        lines.append("# TYPE izzi_command_builds_total counter")
+        lines.append("izzi_command_builds_total%s %d" % (self._labels, controller._command_builds))
+        return "\n".join(lines) + "\n"
+
+    def render(self) -> str:
+        return self.render_sensors() + self.render_counters()
+
+    def body(self) -> bytes:
+        """Sensor text rendered again only when the state table changed since the last render."""
+        self.scrapes += 1
+        version = self.controller.state.version
+        if version != self._rendered_version:
+            self._sensors = self.render_sensors().encode("utf-8")
+            self._rendered_version = version
+            self.renders += 1
+        return self._sensors + self.render_counters().encode("utf-8")
+
+
+class MetricsServer(object):
+    """Serves ControllerMetrics over HTTP on /metrics."""
+
+    def __init__(self, address, metrics : ControllerMetrics):
+        self.address = address
+        self.metrics = metrics
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.body()
+                self.send_response(200)
+                self.send_header("Content-Type", METRICS_CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = HTTPServer(self.address, Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, name="izzi_metrics", daemon=True)
+        self._thread.start()
+        _LOGGER.info("Metrics served on %s", str(self.address))
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,19 @@
+#!/usr/bin/env python
+
+class IzziPreset(object):
+    """Complete set of command targets, precomputed when the preset is added.
+
+    targets     - (sensor id, value) of every command field
+    vent_mode   - vent mode of the preset
+    multipliers - fan speed multipliers of the vent mode, indexed by sensor id
+    frame       - command frame sent for the preset when CF does not adjust it
+    """
+
+    __slots__ = ("name", "targets", "vent_mode", "multipliers", "frame")
+
+    def __init__(self, name : str, targets, vent_mode : int, multipliers, frame):
+        self.name = name
+        self.targets = targets
+        self.vent_mode = vent_mode
+        self.multipliers = multipliers
+        self.frame = frame
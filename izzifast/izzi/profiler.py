@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+import logging
+import threading
+
+_LOGGER = logging.getLogger('izzicontroller')
+
+class ThreadSampler(object):
+    """Sampling profiler of a single thread.
+
+    A helper thread reads the stack of the target thread through
+    sys._current_frames every interval seconds, the target thread itself
+    is never instrumented, so nothing runs when no sampler is active.
+    Stacks are counted in collapsed form (root;...;leaf), which flame
+    graph tools read directly.
+    """
+
+    def __init__(self, thread : threading.Thread, interval : float = 0.005):
+        self.thread = thread
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self._stopping = threading.Event()
+        self._sampler = None
+
+    @staticmethod
+    def _frame_name(frame) -> str:
+        code = frame.f_code
+        return "%s:%s:%d" % (os.path.basename(code.co_filename), code.co_name, code.co_firstlineno)
+
+    def _sample_loop(self, duration : float, on_done):
+        ident = self.thread.ident
+        deadline = time.monotonic() + duration
+        while not self._stopping.is_set() and time.monotonic() < deadline and self.thread.is_alive():
+            frame = sys._current_frames().get(ident)
+            if frame is not None:
+                names = []
+                while frame is not None:
+                    names.append(self._frame_name(frame))
+                    frame = frame.f_back
+                stack = ";".join(reversed(names))
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+                self.samples += 1
+            self._stopping.wait(self.interval)
+        if on_done is not None:
+            try:
+                on_done(self)
+            except Exception as exc:
+                _LOGGER.error("Profiler result handling failed: %s", exc)
+
+    def start(self, duration : float, on_done=None):
+        """Sample for duration seconds, then call on_done(sampler) from the sampler thread."""
+        self._sampler = threading.Thread(target=self._sample_loop, args=(duration, on_done), name="izzi-profiler", daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        self._stopping.set()
+
+    def is_running(self) -> bool:
+        return self._sampler is not None and self._sampler.is_alive()
+
+    def write_collapsed(self, path : str):
+        with open(path, "w") as output:
+            for stack, count in sorted(self.stacks.items(), key=lambda item: -item[1]):
+                output.write("%s %d\n" % (stack, count))
+
+    def summary(self, top : int = 20) -> str:
+        """Functions with most samples, own (leaf) and total (anywhere on the stack)."""
+        own = {}
+        total = {}
+        for stack, count in self.stacks.items():
+            names = stack.split(";")
+            own[names[-1]] = own.get(names[-1], 0) + count
+            for name in set(names):
+                total[name] = total.get(name, 0) + count
+        samples = max(self.samples, 1)
+        lines = ["%d samples every %.1f ms" % (self.samples, self.interval * 1000.0),
+                 "  own%  total%  function"]
+        for name, count in sorted(own.items(), key=lambda item: -item[1])[:top]:
+            lines.append("%6.1f  %6.1f  %s" % (count * 100.0 / samples, total[name] * 100.0 / samples, name))
+        return "\n".join(lines)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+import time
+from bisect import bisect_right
+from datetime import datetime
+
+SECONDS_PER_DAY = 86400
+SECONDS_PER_WEEK = 7 * SECONDS_PER_DAY
+
+# Longest wait between schedule checks, bounds the error of daylight saving
+# changes between a check and the next transition
+SCHEDULE_RECHECK_INTERVAL = 3600.0
+
+def week_second(ts : float, tz=None) -> float:
+    """Seconds since Monday 00:00 of the week of ts, local time in tz.
+
+    tz is a tzinfo, None uses the time zone of the process.
+    """
+    if tz is None:
+        local = time.localtime(ts)
+        return local.tm_wday * SECONDS_PER_DAY + local.tm_hour * 3600 + local.tm_min * 60 + local.tm_sec + ts % 1.0
+    local = datetime.fromtimestamp(ts, tz)
+    return local.weekday() * SECONDS_PER_DAY + local.hour * 3600 + local.minute * 60 + local.second + ts % 1.0
+
+class IzziSchedule(object):
+    """Weekly timetable compiled into a sorted transition table.
+
+    entries are (weekday, seconds since midnight, preset name), weekday 0 is
+    Monday. Of entries at the same time the last one wins. Times are local
+    time in tz, a tzinfo, None uses the time zone of the process.
+    """
+
+    def __init__(self, entries, tz=None):
+        self.tz = tz
+        table = {}
+        for weekday, day_second, preset in entries:
+            if weekday < 0 or weekday > 6 or day_second < 0 or day_second >= SECONDS_PER_DAY:
+                raise ValueError("Invalid schedule entry %s %s" % (weekday, day_second))
+            table[weekday * SECONDS_PER_DAY + day_second] = preset
+        self.times = sorted(table)
+        self.presets = [table[second] for second in self.times]
+
+    def __len__(self):
+        return len(self.times)
+
+    def active(self, second : float):
+        """Preset of the last transition at or before second, wrapping the week."""
+        if not self.times:
+            return None
+        return self.presets[bisect_right(self.times, second) - 1]
+
+    def due(self, last : float, second : float):
+        """Preset of the last transition after last up to second, None if there was none.
+
+        second behind last by up to half a week is a clock set back, as on
+        the daylight saving fall back, not a week wrap.
+        """
+        index = bisect_right(self.times, second) - 1
+        if second >= last:
+            if index >= 0 and self.times[index] > last:
+                return self.presets[index]
+            return None
+        if last - second <= SECONDS_PER_WEEK / 2:
+            return None
+        # Week wrapped since last
+        if index >= 0:
+            return self.presets[index]
+        if self.times and self.times[-1] > last:
+            return self.presets[-1]
+        return None
+
+    def seconds_to_next(self, second : float) -> float:
+        """Seconds from second to the next transition."""
+        if not self.times:
+            return SECONDS_PER_WEEK
+        index = bisect_right(self.times, second)
+        if index < len(self.times):
+            return self.times[index] - second
+        return self.times[0] + SECONDS_PER_WEEK - second
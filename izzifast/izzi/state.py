@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+import time
+import threading
+from .const import IZZY_SENSOR_ID_COUNT
+
+class PublishPolicy(object):
+    """Limits how often a sensor is published.
+
+    deadband     - minimum absolute change from the published value
+    hysteresis   - change must exceed it when reversing direction
+    min_interval - minimum seconds between publishes, later changes are deferred
+    max_interval - republish the current value at least this often, 0 disables
+    """
+
+    def __init__(self, deadband : float = 0.0, hysteresis : float = 0.0, min_interval : float = 0.0, max_interval : float = 0.0):
+        self.deadband = deadband
+        self.hysteresis = hysteresis
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+
+
+class IzziStateTable(object):
+    """State of all sensors, indexed by the sensor ids from const.py.
+
+    current   - last observed value (decoded, sent or computed)
+    target    - requested value of command and virtual sensors
+    published - last value handed to the sensor callback, read by entities
+
+    Every change of current sets a bit in the dirty bitmap, so publishing
+    only visits sensors that actually changed, and increments version.
+    Internal sensors are tracked for change detection but never published.
+    Sensors with a PublishPolicy are published only when the policy allows it.
+    """
+
+    def __init__(self, size : int = IZZY_SENSOR_ID_COUNT, internal=()):
+        self.size = size
+        self.current = [None] * size
+        self.target = [None] * size
+        self.published = [None] * size
+        self._dirty = 0
+        self._forced = 0
+        self._changed = 0
+        self._internal = 0
+        for sensor_id in internal:
+            self._internal |= 1 << sensor_id
+        self._lock = threading.Lock()
+
+        self.policies = [None] * size
+        self._publish_time = [0.0] * size
+        self._direction = [0] * size
+        self._pending = 0
+        self._deferred = 0
+        self._held = [None] * size
+        self._heartbeats = ()
+        self._next_heartbeat = float('inf')
+        self.published_count = 0
+        self.suppressed_count = 0
+        self.version = 0
+
+    def set_policy(self, sensor_id : int, policy : PublishPolicy):
+        """Set publish policy of sensor, None publishes every change."""
+        self.policies[sensor_id] = policy
+        self._heartbeats = tuple(i for i in range(self.size) if self.policies[i] is not None and self.policies[i].max_interval > 0)
+        self._next_heartbeat = time.monotonic() if self._heartbeats else float('inf')
+
+    def set_current(self, sensor_id : int, value) -> bool:
+        """Store the current value, returns True when it changed."""
+        if self.current[sensor_id] == value:
+            return False
+        self.current[sensor_id] = value
+        with self._lock:
+            self._dirty |= 1 << sensor_id
+            self._changed |= 1 << sensor_id
+            self.version += 1
+        return True
+
+    def set_published(self, sensor_id : int, value):
+        """Store a value owned by the HA side, it is never dispatched."""
+        self.current[sensor_id] = value
+        self.published[sensor_id] = value
+        self.version += 1
+
+    def force_update(self, sensor_id : int):
+        """Publish the current value on next publish even if it did not change."""
+        if sensor_id < 0 or sensor_id >= self.size:
+            return
+        with self._lock:
+            self._dirty |= 1 << sensor_id
+            self._forced |= 1 << sensor_id
+
+    def mark_changed(self, sensor_id : int):
+        """Make sensors derived from sensor_id recompute without changing it."""
+        with self._lock:
+            self._changed |= 1 << sensor_id
+
+    def is_dirty(self) -> bool:
+        return self._dirty != 0
+
+    def take_changed(self) -> int:
+        """Return the bitmap of sensors changed since the last call and clear it."""
+        with self._lock:
+            changed = self._changed
+            self._changed = 0
+        return changed
+
+    def _due_heartbeats(self, now : float) -> int:
+        due = 0
+        next_heartbeat = float('inf')
+        for sensor_id in self._heartbeats:
+            deadline = self._publish_time[sensor_id] + self.policies[sensor_id].max_interval
+            if deadline <= now:
+                due |= 1 << sensor_id
+                deadline = now + self.policies[sensor_id].max_interval
+            next_heartbeat = min(next_heartbeat, deadline)
+        self._next_heartbeat = next_heartbeat
+        return due
+
+    def _policy_allows(self, sensor_id : int, policy : PublishPolicy, value, now : float) -> bool:
+        previous = self.published[sensor_id]
+        if previous is None or value is None:
+            return True
+        try:
+            delta = value - previous
+        except TypeError:
+            return True
+
+        if abs(delta) < policy.deadband:
+            self.suppressed_count += 1
+            return False
+        direction = 1 if delta > 0 else -1
+        if self._direction[sensor_id] == -direction and abs(delta) <= policy.hysteresis:
+            self.suppressed_count += 1
+            return False
+        if now - self._publish_time[sensor_id] < policy.min_interval:
+            bit = 1 << sensor_id
+            # Counted once per held back value, not on every re-evaluation
+            if not self._deferred & bit or self._held[sensor_id] != value:
+                self.suppressed_count += 1
+                self._held[sensor_id] = value
+            self._pending |= bit
+            return False
+        self._direction[sensor_id] = direction
+        return True
+
+    def publish(self, callback, now : float = None):
+        """Dispatch every dirty sensor whose value differs from the published one."""
+        with self._lock:
+            dirty = self._dirty
+            forced = self._forced
+            self._dirty = 0
+            self._forced = 0
+
+        policies = self.policies
+        self._deferred = self._pending
+        if self._pending or self._heartbeats:
+            if now is None:
+                now = time.monotonic()
+            # Deferred changes are evaluated again
+            dirty |= self._pending
+            self._pending = 0
+            if now >= self._next_heartbeat:
+                heartbeats = self._due_heartbeats(now)
+                dirty |= heartbeats
+                forced |= heartbeats
+        dirty &= ~self._internal
+
+        current = self.current
+        published = self.published
+        while dirty:
+            bit = dirty & -dirty
+            dirty ^= bit
+            sensor_id = bit.bit_length() - 1
+            value = current[sensor_id]
+            policy = policies[sensor_id]
+            if value == published[sensor_id]:
+                if not (forced & bit) or value is None:
+                    continue
+            elif policy is not None and not (forced & bit):
+                if now is None:
+                    now = time.monotonic()
+                if not self._policy_allows(sensor_id, policy, value, now):
+                    continue
+            if policy is not None:
+                self._publish_time[sensor_id] = now if now is not None else time.monotonic()
+            published[sensor_id] = value
+            self.published_count += 1
+            if callback:
+                callback(sensor_id, value)
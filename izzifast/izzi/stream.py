@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+from collections import deque
+from .const import *
+from .capture import CAPTURE_KIND_RX, CAPTURE_KIND_TX
+from .decoder import SENSOR_NAMES, STATUS_UNPACK, COMMAND_UNPACK
+
+# Frames kept between two batches, older ones are dropped
+FRAME_BATCH_LIMIT = 4096
+
+def decode_frame(ts : float, kind : int, frame) -> dict:
+    """JSON serialisable form of a bus frame, values keyed by sensor name."""
+    message_id = frame[IZZI_STATUS_MSG_ID_INDEX]
+    if message_id == IZZI_STATUS_MESSAGE_ID:
+        frame_type, layout = "status", STATUS_UNPACK
+    elif message_id == IZZI_COMMAND_MESSAGE_ID:
+        frame_type, layout = "command", COMMAND_UNPACK
+    else:
+        return {"ts": ts, "direction": "tx" if kind == CAPTURE_KIND_TX else "rx", "type": "unknown", "raw": bytes(frame).hex()}
+    return {"ts": ts,
+            "direction": "tx" if kind == CAPTURE_KIND_TX else "rx",
+            "type": frame_type,
+            "values": {SENSOR_NAMES[sensor_id]: unpack(frame, index)[0] for sensor_id, index, unpack in layout}}
+
+class FrameBatcher(object):
+    """Collects bus frames between batches, meant as a controller frame listener.
+
+    The connection thread only copies the frame, decoding happens in take(),
+    once per batch for every consumer.
+    """
+
+    def __init__(self, limit : int = FRAME_BATCH_LIMIT):
+        self._frames = deque([], limit)
+
+    def __call__(self, ts : float, kind : int, frame):
+        if kind == CAPTURE_KIND_RX or kind == CAPTURE_KIND_TX:
+            self._frames.append((ts, kind, bytes(frame)))
+
+    def clear(self):
+        self._frames.clear()
+
+    def take(self) -> list:
+        """Decoded frames collected since the last call."""
+        frames = self._frames
+        batch = []
+        while frames:
+            batch.append(decode_frame(*frames.popleft()))
+        return batch
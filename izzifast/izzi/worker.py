@@ -0,0 +1,515 @@
+#!/usr/bin/env python
+"""Controller in a separate process.
+
+The worker process owns the bridge and runs IzziController, so bus I/O,
+framing, CF control and command scheduling never wait for the GIL of the
+Home Assistant process. The two sides share one memory block:
+
+  - published sensor values with a version counter the worker increments
+    on every publish, so readers only copy the table when it changed
+  - a single producer, single consumer ring of setpoint commands, the HA
+    side only advances head, the worker only advances tail
+
+Plain stores to shared memory are not ordered between processes on weakly
+ordered CPUs such as ARM, so every access to the block goes through a
+multiprocessing lock. It is held for a few struct copies at a time.
+
+Configuration and other rare calls go over a pipe.
+"""
+
+import logging
+import multiprocessing
+import queue
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+from .const import *
+from .cfinput import CF_CHANNEL_SUPPLY, CF_CHANNEL_EXTRACT
+from .state import IzziStateTable, PublishPolicy
+
+_LOGGER = logging.getLogger('izzicontroller')
+
+# Header: state version, ring head, ring tail, last ring slot in a written
+# command frame, connected flag
+HEADER = struct.Struct('<QQQQB7x')
+HEADER_SEQ = 0
+HEADER_HEAD = 8
+HEADER_TAIL = 16
+HEADER_WRITTEN = 24
+HEADER_CONNECTED = 32
+COUNTER = struct.Struct('<Q')
+
+# Value kinds of the published table
+VALUE_NONE = 0
+VALUE_INT = 1
+VALUE_FLOAT = 2
+VALUE_BOOL = 3
+VALUE = struct.Struct('<d')
+
+# Ring slot: operation, two arguments
+RING_SLOT = struct.Struct('<B7xdd')
+RING_SLOTS = 256
+
+OP_BYPASS_MODE = 1
+OP_BYPASS_TEMP = 2
+OP_FAN_SPEED = 3
+OP_VENT_MODE = 4
+OP_UNIT_ON = 5
+OP_CF_PARAMS = 6
+OP_CF_SUPPLY_PARAM = 7
+OP_CF_EXTRACT_PARAM = 8
+OP_CF_SAMPLE = 9
+OP_PRESET = 10
+
+# Seconds between snapshot reads of the HA side
+WORKER_POLL_INTERVAL = 0.02
+WORKER_CALL_TIMEOUT = 10.0
+
+class _SharedBlock(object):
+    """Layout of the shared memory block, see the module docstring."""
+
+    def __init__(self, buf, lock, size : int = IZZY_SENSOR_ID_COUNT):
+        self.buf = buf
+        self.lock = lock
+        self.size = size
+        self.kinds_offset = HEADER.size
+        self.values_offset = self.kinds_offset + (size + 7) // 8 * 8
+        self.ring_offset = self.values_offset + size * VALUE.size
+        self.values = struct.Struct('<%dd' % size)
+
+    @staticmethod
+    def length(size : int = IZZY_SENSOR_ID_COUNT) -> int:
+        return HEADER.size + (size + 7) // 8 * 8 + size * VALUE.size + RING_SLOTS * RING_SLOT.size
+
+    def get(self, offset : int) -> int:
+        return COUNTER.unpack_from(self.buf, offset)[0]
+
+    def put(self, offset : int, value : int):
+        COUNTER.pack_into(self.buf, offset, value)
+
+    def load(self, offset : int) -> int:
+        """Header counter read under the lock."""
+        with self.lock:
+            return self.get(offset)
+
+    def store(self, offset : int, value : int):
+        """Header counter write under the lock."""
+        with self.lock:
+            self.put(offset, value)
+
+    # Worker side
+
+    def publish(self, sensor_id : int, value):
+        if value is None:
+            kind, number = VALUE_NONE, 0.0
+        elif isinstance(value, bool):
+            kind, number = VALUE_BOOL, float(value)
+        elif isinstance(value, int):
+            kind, number = VALUE_INT, float(value)
+        else:
+            kind, number = VALUE_FLOAT, float(value)
+        with self.lock:
+            self.buf[self.kinds_offset + sensor_id] = kind
+            VALUE.pack_into(self.buf, self.values_offset + sensor_id * VALUE.size, number)
+            self.put(HEADER_SEQ, self.get(HEADER_SEQ) + 1)
+
+    def take_commands(self, tail : int):
+        """Commands from tail up to head, as (slot number, op, a, b)."""
+        commands = []
+        with self.lock:
+            head = self.get(HEADER_HEAD)
+            while tail < head:
+                op, a, b = RING_SLOT.unpack_from(self.buf, self.ring_offset + (tail % RING_SLOTS) * RING_SLOT.size)
+                tail += 1
+                commands.append((tail, op, a, b))
+            self.put(HEADER_TAIL, tail)
+        return commands
+
+    # HA side
+
+    def snapshot(self):
+        """Consistent copy of (version, kinds, values) of the published table."""
+        with self.lock:
+            return (self.get(HEADER_SEQ), bytes(self.buf[self.kinds_offset:self.kinds_offset + self.size]),
+                    self.values.unpack_from(self.buf, self.values_offset))
+
+    def push(self, op : int, a : float = 0.0, b : float = 0.0) -> int:
+        """Add a command, returns its slot number or 0 when the ring is full."""
+        with self.lock:
+            head = self.get(HEADER_HEAD)
+            if head - self.get(HEADER_TAIL) >= RING_SLOTS:
+                return 0
+            RING_SLOT.pack_into(self.buf, self.ring_offset + (head % RING_SLOTS) * RING_SLOT.size, op, a, b)
+            self.put(HEADER_HEAD, head + 1)
+        return head + 1
+
+
+def _value(kind : int, number : float):
+    if kind == VALUE_INT:
+        return int(number)
+    if kind == VALUE_FLOAT:
+        return number
+    if kind == VALUE_BOOL:
+        return bool(number)
+    return None
+
+
+class _WorkerCommands(object):
+    """Calls the HA side can make besides controller methods."""
+
+    def __init__(self, controller):
+        self.controller = controller
+
+    def bridge_attribute(self, name : str):
+        return getattr(self.controller._bridge, name)
+
+
+def _apply_command(controller, presets : list, op : int, a : float, b : float):
+    if op == OP_BYPASS_MODE:
+        controller.set_bypass_mode(int(a))
+    elif op == OP_BYPASS_TEMP:
+        controller.set_bypass_temp(int(a))
+    elif op == OP_FAN_SPEED:
+        controller.set_fan_speed(int(a), int(b))
+    elif op == OP_VENT_MODE:
+        controller.set_vent_mode(int(a))
+    elif op == OP_UNIT_ON:
+        controller.set_unit_on(bool(a))
+    elif op == OP_CF_PARAMS:
+        controller.set_cf_params(a, b)
+    elif op == OP_CF_SUPPLY_PARAM:
+        controller.set_cf_supply_param(a)
+    elif op == OP_CF_EXTRACT_PARAM:
+        controller.set_cf_extract_param(b)
+    elif op == OP_CF_SAMPLE:
+        controller.cf_samples.push(int(a), b)
+    elif op == OP_PRESET:
+        controller.apply_preset(presets[int(a)])
+
+def worker_main(shm_name : str, lock, conn, bridge, is_master : bool):
+    """Entry point of the worker process."""
+    from .controller import IzziController
+    shm = shared_memory.SharedMemory(name=shm_name)
+    block = _SharedBlock(shm.buf, lock)
+    controller = IzziController(bridge, is_master)
+    commands = _WorkerCommands(controller)
+    send_lock = threading.Lock()
+    presets = []
+
+    def send(message):
+        with send_lock:
+            conn.send(message)
+
+    def on_written(slot):
+        return lambda frame, ts: block.store(HEADER_WRITTEN, slot)
+
+    controller.callback_sensor = block.publish
+    controller.callback_preset = lambda name: send(("preset", name))
+
+    tail = block.load(HEADER_TAIL)
+    while True:
+        if conn.poll(0.01):
+            try:
+                message = conn.recv()
+            except EOFError:
+                break
+            if message is None:
+                break
+            call_id, name, args = message
+            try:
+                target = getattr(commands, name, None) or getattr(controller, name)
+                result = target(*args)
+                if name == "add_preset" and result and args[0] not in presets:
+                    presets.append(args[0])
+                send(("result", call_id, result))
+            except Exception as exc:
+                send(("error", call_id, "%s: %s" % (name, exc)))
+
+        applied = block.take_commands(tail)
+        if applied:
+            for slot, op, a, b in applied:
+                try:
+                    _apply_command(controller, presets, op, a, b)
+                except Exception as exc:
+                    _LOGGER.error("Worker command %d failed: %s", op, exc)
+            tail = applied[-1][0]
+            controller.add_write_waiter(on_written(tail))
+        block.buf[HEADER_CONNECTED] = 1 if controller.is_connected() else 0
+
+    controller.disconnect()
+    del block
+    shm.close()
+
+
+class _ProcessCfSamples(object):
+    """CF sample queue interface, samples go through the command ring."""
+
+    def __init__(self, controller):
+        self._controller = controller
+
+    def push(self, channel : int, value : float):
+        self._controller._push(OP_CF_SAMPLE, channel, value)
+
+    def push_pair(self, supply : float, extract : float):
+        self.push(CF_CHANNEL_SUPPLY, supply)
+        self.push(CF_CHANNEL_EXTRACT, extract)
+
+
+class IzziProcessController(object):
+    """IzziController interface backed by a controller in a worker process.
+
+    Setpoints are queued in the command ring and return at once, other
+    calls are forwarded over the pipe and return the worker's result.
+    Published values are read from shared memory every
+    WORKER_POLL_INTERVAL seconds and handed to callback_sensor from the
+    poll thread. History and frame listeners holding sockets stay in the
+    worker and are not available here.
+    """
+
+    # Forwarded unchanged to the worker controller
+    _FORWARDED = frozenset(("set_cf_params_max", "set_airflow_curve", "set_energy_publish_interval",
+                            "set_oversampling", "set_cf_shadow", "get_cf_shadow_stats",
+                            "enable_history", "enable_filter_load", "reset_filter_load", "start_profiler",
+                            "stop_profiler", "add_frame_listener", "is_cf_enabled", "set_schedule",
+                            "bridge_attribute"))
+
+    callback_sensor = None
+    callback_preset = None
+    history = None
+
+    def __init__(self, bridge, is_master : bool):
+        self._master_mode = is_master
+        self.preset = None
+        self.state = IzziStateTable()
+        self.cf_samples = _ProcessCfSamples(self)
+        self._presets = []
+        self._push_lock = threading.Lock()
+        self._call_lock = threading.Lock()
+        self._replies = queue.Queue()
+        self._call_id = 0
+        self._waiters = []
+        self._waiters_lock = threading.Lock()
+        self._stopping = False
+        self._final_snapshot = None
+
+        self._shm = shared_memory.SharedMemory(create=True, size=_SharedBlock.length())
+        # Spawn, forking the threads of HA is not safe
+        context = multiprocessing.get_context("spawn")
+        lock = context.Lock()
+        self._block = _SharedBlock(self._shm.buf, lock)
+        self._block.buf[:HEADER.size] = bytes(HEADER.size)
+        self._conn, child_conn = multiprocessing.Pipe()
+        self._process = context.Process(target=worker_main, args=(self._shm.name, lock, child_conn, bridge, is_master),
+                                        name="izzi_worker", daemon=True)
+        self._process.start()
+        child_conn.close()
+        self._poll_thread = threading.Thread(target=self._poll_loop, name="izzi_worker_poll", daemon=True)
+        self._poll_thread.start()
+
+    def __getattr__(self, name):
+        if name in IzziProcessController._FORWARDED:
+            return lambda *args: self._call(name, *args)
+        raise AttributeError(name)
+
+    def _call(self, name : str, *args):
+        if not self._poll_thread.is_alive():
+            raise Exception("Worker process exited")
+        with self._call_lock:
+            self._call_id += 1
+            call_id = self._call_id
+            self._conn.send((call_id, name, args))
+            deadline = time.monotonic() + WORKER_CALL_TIMEOUT
+            while True:
+                try:
+                    kind, reply_id, result = self._replies.get(timeout=max(deadline - time.monotonic(), 0.0))
+                except queue.Empty:
+                    raise Exception("Worker did not answer %s" % name)
+                # Late answers of calls that timed out are dropped, None is a worker exit
+                if reply_id is None or reply_id == call_id:
+                    break
+        if kind == "error":
+            raise Exception(result)
+        return result
+
+    def _push(self, op : int, a : float = 0.0, b : float = 0.0) -> bool:
+        with self._push_lock:
+            if self._block.push(op, a, b) == 0:
+                _LOGGER.error("Worker command ring full, command %d dropped", op)
+                return False
+        return True
+
+    def _poll_loop(self):
+        last = None
+        while not self._stopping:
+            try:
+                if self._conn.poll(WORKER_POLL_INTERVAL):
+                    message = self._conn.recv()
+                    if message[0] == "preset":
+                        self.preset = message[1]
+                        if self.callback_preset is not None:
+                            self.callback_preset(message[1])
+                    else:
+                        self._replies.put(message)
+            except (EOFError, OSError):
+                # The worker exited, fail a call waiting for its answer
+                self._replies.put(("error", None, "Worker process exited"))
+                break
+
+            if last is None or self._block.load(HEADER_SEQ) != last[0]:
+                snapshot = self._block.snapshot()
+                version, kinds, values = snapshot
+                for sensor_id in range(len(kinds)):
+                    if last is None or kinds[sensor_id] != last[1][sensor_id] or values[sensor_id] != last[2][sensor_id]:
+                        if kinds[sensor_id] != VALUE_NONE:
+                            self.state.set_current(sensor_id, _value(kinds[sensor_id], values[sensor_id]))
+                last = snapshot
+            self.state.publish(self.callback_sensor)
+
+            if self._waiters:
+                self._notify_waiters(self._block.load(HEADER_WRITTEN))
+
+    def _notify_waiters(self, written : int):
+        ts = time.monotonic()
+        with self._waiters_lock:
+            done = [waiter for waiter in self._waiters if waiter[0] <= written]
+            self._waiters = [waiter for waiter in self._waiters if waiter[0] > written]
+        for slot, callback in done:
+            try:
+                callback(None, ts)
+            except Exception as exc:
+                _LOGGER.error("Write waiter failed: %s", exc)
+
+    def connect(self):
+        self._call("connect")
+
+    def disconnect(self):
+        if self._process is None:
+            return
+        try:
+            self._call("disconnect")
+            # Kept for the state cache saved after unloading
+            self._final_snapshot = self.get_snapshot()
+            self._conn.send(None)
+        except Exception as exc:
+            _LOGGER.error(exc)
+        self._process.join(10)
+        self._process = None
+        self._stopping = True
+        self._poll_thread.join()
+        self._conn.close()
+        del self._block
+        self._shm.close()
+        self._shm.unlink()
+
+    def is_connected(self):
+        return self._block.buf[HEADER_CONNECTED] == 1
+
+    def get_master_mode(self) -> bool:
+        return self._master_mode
+
+    def set_master_mode(self, is_master : bool) -> bool:
+        self._master_mode = is_master
+        return self._call("set_master_mode", is_master)
+
+    def force_update(self, sensor_id):
+        self.state.force_update(sensor_id)
+
+    def set_bypass_mode(self, mode : int) -> bool:
+        if mode < 0 or mode > 2:
+            return False
+        self.preset = None
+        return self._push(OP_BYPASS_MODE, mode)
+
+    def set_bypass_temp(self, temp : int) -> bool:
+        # Same bounds as IzziController, the worker would drop the value silently
+        if temp < IZZY_CMD_BYPASS_TEMP_MIN or temp > IZZY_CMD_BYPASS_TEMP_MAX:
+            return False
+        self.preset = None
+        return self._push(OP_BYPASS_TEMP, temp)
+
+    def set_fan_speed(self, supply : int, extract : int):
+        if (supply < 0 and extract < 0) or supply > 100 or extract > 100:
+            return False
+        self.preset = None
+        return self._push(OP_FAN_SPEED, supply, extract)
+
+    def set_vent_mode(self, mode : int) -> bool:
+        if mode not in (IZZY_SENSOR_VENT_MODE_NONE, IZZY_SENSOR_VENT_MODE_FIREPLACE,
+                        IZZY_SENSOR_VENT_MODE_OPEN_WINDOW, IZZY_SENSOR_VENT_MODE_COOKER_HOOD):
+            return False
+        self.preset = None
+        return self._push(OP_VENT_MODE, mode)
+
+    def set_unit_on(self, on : bool):
+        self.preset = None
+        return self._push(OP_UNIT_ON, 1.0 if on else 0.0)
+
+    def set_cf_params(self, supply : float, extract : float) -> bool:
+        return self._push(OP_CF_PARAMS, supply, extract)
+
+    def set_cf_supply_param(self, supply : float) -> bool:
+        return self._push(OP_CF_SUPPLY_PARAM, supply)
+
+    def set_cf_extract_param(self, extract : float) -> bool:
+        return self._push(OP_CF_EXTRACT_PARAM, 0.0, extract)
+
+    def add_preset(self, name : str, targets : dict, vent_mode : int = IZZY_SENSOR_VENT_MODE_NONE) -> bool:
+        if not self._call("add_preset", name, targets, vent_mode):
+            return False
+        if name not in self._presets:
+            self._presets.append(name)
+        return True
+
+    def get_presets(self) -> list:
+        return list(self._presets)
+
+    def apply_preset(self, name : str) -> bool:
+        if name not in self._presets:
+            return False
+        self.preset = name
+        return self._push(OP_PRESET, self._presets.index(name))
+
+    def set_publish_policy(self, sensor_id : int, policy) -> bool:
+        if not self._call("set_publish_policy", sensor_id, policy):
+            return False
+        # Heartbeats repeat unchanged values, which never show up in shared
+        # memory, so they are generated on this side
+        heartbeat = policy is not None and policy.max_interval > 0
+        self.state.set_policy(sensor_id, PublishPolicy(max_interval=policy.max_interval) if heartbeat else None)
+        return True
+
+    def add_write_waiter(self, callback):
+        """Like IzziController.add_write_waiter, frame is None."""
+        waiter = (self._block.load(HEADER_HEAD), callback)
+        with self._waiters_lock:
+            self._waiters.append(waiter)
+        return waiter
+
+    def remove_write_waiter(self, waiter):
+        with self._waiters_lock:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def restore_snapshot(self, snapshot : dict) -> bool:
+        try:
+            if not self._call("restore_snapshot", snapshot):
+                return False
+        except Exception as exc:
+            _LOGGER.warning("Worker did not restore the state cache: %s", exc)
+            return False
+        for sensor_id, value in enumerate(snapshot["published"][:self.state.size]):
+            if value is not None:
+                self.state.set_published(sensor_id, value)
+        return True
+
+    def get_snapshot(self) -> dict:
+        if self._process is None:
+            return self._final_snapshot
+        snapshot = self._call("get_snapshot")
+        # Values owned by the HA side, e.g. the fan mode, are not in the worker
+        published = snapshot["published"]
+        for sensor_id, value in enumerate(self.state.published):
+            if value is not None and published[sensor_id] is None:
+                published[sensor_id] = value
+        return snapshot
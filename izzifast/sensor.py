@@ -4,10 +4,13 @@ import logging
 from homeassistant.helpers.dispatcher import *
 from homeassistant.components.sensor import PLATFORM_SCHEMA
 from homeassistant.const import (
+    UnitOfEnergy,
     UnitOfTemperature,
 )
 from homeassistant.components.sensor import (
+    ATTR_STATE_CLASS,
     SensorDeviceClass,
+    SensorStateClass,
 )
 from homeassistant.helpers.dispatcher import async_dispatcher_connect
 from homeassistant.helpers.entity import Entity
@@ -22,7 +25,7 @@ vent_mode_mapping = ["none", "fireplace", "open windows"]
 
 _LOGGER = logging.getLogger(__name__)
 
-def setup_platform(hass, config, add_entities, discovery_info=None):
+async def async_setup_entry(hass, entry, async_add_entities):
     """Set up the ComfoConnect fan platform."""
     izzibridge = hass.data[DOMAIN]
 
@@ -65,9 +68,20 @@ def setup_platform(hass, config, add_entities, discovery_info=None):
         ["iZZi Bypass temp", UnitOfTemperature.CELSIUS, IZZY_SENSOR_BYPASS_TEMP_ID, None, "mdi:home-temperature", None],
         ["iZZi Vent mode", "", IZZY_SENSOR_VENT_MODE_ID, None, None, vent_mode_mapping],
         ["iZZi Efficiency", "%", IZZY_SENSOR_EFFICIENCY_ID, None, None, None],
+        [
+            "iZZi Supply Outdoor Delta",
+            UnitOfTemperature.CELSIUS,
+            IZZY_SENSOR_TEMPERATURE_DELTA_ID,
+            None,
+            "mdi:thermometer-chevron-up",
+            None
+        ],
+        ["iZZi Recovered Power", "W", IZZY_SENSOR_RECOVERED_POWER_ID, SensorDeviceClass.POWER, None, None],
         ["iZZi Extract correction", "%", IZZY_SENSOR_EXTRACT_CORRECTION_STATE_ID, None, None, None],
         ["iZZi CF extract correction", "%", IZZY_SENSOR_CF_EXTRACT_CORRECTION_ID, None, None, None],
-        ["iZZi CF supply correction", "%", IZZY_SENSOR_CF_SUPPLY_CORRECTION_ID, None, None, None]
+        ["iZZi CF supply correction", "%", IZZY_SENSOR_CF_SUPPLY_CORRECTION_ID, None, None, None],
+        ["iZZi Filter Load", "%", IZZY_SENSOR_FILTER_LOAD_ID, None, "mdi:air-filter", None],
+        ["iZZi Filter Replacement", "d", IZZY_SENSOR_FILTER_DAYS_ID, None, "mdi:calendar-clock", None]
         
     ]
     dev = []
@@ -75,7 +89,15 @@ def setup_platform(hass, config, add_entities, discovery_info=None):
     for sensor in sensors:
         dev.append(IzzifastSensor(sensor[0], izzibridge, sensor[1], sensor[2], sensor[3], sensor[4], sensor[5]))
 
-    add_entities(dev, True)
+    energy_sensors = [
+        ["iZZi Recovered Heat Energy", IZZY_SENSOR_RECOVERED_HEAT_ENERGY_ID, "mdi:home-import-outline"],
+        ["iZZi Recovered Cooling Energy", IZZY_SENSOR_RECOVERED_COOL_ENERGY_ID, "mdi:snowflake"],
+    ]
+
+    for sensor in energy_sensors:
+        dev.append(IzzifastEnergySensor(sensor[0], izzibridge, UnitOfEnergy.KILO_WATT_HOUR, sensor[1], SensorDeviceClass.ENERGY, sensor[2], None))
+
+    async_add_entities(dev, True)
 
 
 class IzzifastSensor(Entity):
@@ -115,20 +137,23 @@ class IzzifastSensor(Entity):
             self._name,
             value,
         )
-        if self._mapping != None:
-            self._izzibridge.data[self._sensor_type] = self._mapping[value]
-        else:
-            self._izzibridge.data[self._sensor_type] = value
-        
         self.schedule_update_ha_state()
 
     @property
     def state(self):
         """Return the state of the entity."""
-        try:
-            return self._izzibridge.data[self._sensor_type]
-        except KeyError:
-            return None
+        value = self._izzibridge.get_state(self._sensor_type)
+        if self._mapping != None and value is not None:
+            try:
+                return self._mapping[value]
+            except IndexError:
+                return None
+        return value
+
+    @property
+    def force_update(self) -> bool:
+        """Write republished unchanged values, heartbeats would be dropped otherwise."""
+        return self._izzibridge.has_heartbeat(self._sensor_type)
 
     @property
     def should_poll(self) -> bool:
@@ -159,3 +184,12 @@ class IzzifastSensor(Entity):
     def device_class(self):
         """Return the device_class."""
         return self._device_class
+
+
+class IzzifastEnergySensor(IzzifastSensor):
+    """Cumulative energy integrated by the controller."""
+
+    @property
+    def capability_attributes(self):
+        """Return the state class, used by long term statistics."""
+        return {ATTR_STATE_CLASS: SensorStateClass.TOTAL_INCREASING}
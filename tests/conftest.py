@@ -0,0 +1,9 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The izzi package runs without Home Assistant, import it from the integration
+# directory; the integration package itself is imported from the repository root
+sys.path.insert(0, os.path.join(ROOT, "izzifast"))
+sys.path.insert(0, ROOT)
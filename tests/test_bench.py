@@ -0,0 +1,57 @@
+"""Benchmark result comparison and the opt-in regression gate.
+
+Set IZZI_BENCH_BASELINE to a JSON file written by python -m izzi bench --json
+to fail when a benchmark got worse than the baseline by more than
+IZZI_BENCH_THRESHOLD percent (default 10). Without it only the comparison
+logic is tested, timings depend on the machine.
+"""
+
+import json
+import os
+
+import pytest
+
+from izzi.bench import BENCHMARKS, bench_parse, compare_results, run_benchmarks
+
+
+def _document(results):
+    return {"commit": None, "results": results}
+
+
+def test_compare_flags_regressions_by_direction():
+    base = _document({"parse": {"frames": 10, "live_frames_per_s": 1000.0},
+                      "latency": {"write_p95_ms": 10.0}})
+    current = _document({"parse": {"frames": 20, "live_frames_per_s": 850.0},
+                         "latency": {"write_p95_ms": 10.5}})
+    rows = {(name, key): (change, regressed) for name, key, base_value, value, change, regressed
+            in compare_results(base, current, 0.1)}
+    # Counts are not compared
+    assert set(rows) == {("parse", "live_frames_per_s"), ("latency", "write_p95_ms")}
+    assert rows["parse", "live_frames_per_s"] == (pytest.approx(-0.15), True)
+    assert rows["latency", "write_p95_ms"] == (pytest.approx(-0.05), False)
+
+
+def test_compare_skips_missing_and_skipped_results():
+    base = _document({"cf": {"skipped": "numpy not installed"}, "parse": {"batch_skipped": "numpy not installed"}})
+    current = _document({"cf": {"samples_per_s": 100.0}, "parse": {"batch_frames_per_s": 100.0}, "new": {"x_per_s": 1.0}})
+    assert list(compare_results(base, current)) == []
+
+
+def test_parse_benchmark_reports_skipped_batch_path():
+    result = bench_parse(1000)
+    assert result["frames"] == 1000
+    assert result["live_frames_per_s"] > 0
+    assert ("batch_frames_per_s" in result) != ("batch_skipped" in result)
+
+
+@pytest.mark.skipif(not os.environ.get("IZZI_BENCH_BASELINE"), reason="IZZI_BENCH_BASELINE not set")
+def test_no_regression_against_baseline():
+    with open(os.environ["IZZI_BENCH_BASELINE"]) as base_file:
+        base = json.load(base_file)
+    threshold = float(os.environ.get("IZZI_BENCH_THRESHOLD", "10")) / 100.0
+    names = [name for name in base["results"] if name in BENCHMARKS]
+    current = run_benchmarks(names)
+    regressions = ["%s %s: %s -> %s" % (name, key, base_value, value)
+                   for name, key, base_value, value, change, regressed in compare_results(base, current, threshold)
+                   if regressed]
+    assert not regressions, "Benchmarks regressed: " + ", ".join(regressions)
@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+from izzi.capture import (CaptureWriter, read_capture, CAPTURE_MAGIC, CAPTURE_RECORD,
+                          CAPTURE_KIND_RX, CAPTURE_KIND_TX)
+from izzi.const import *
+from izzi.emulator import IzziEmulatorBridge
+
+DAY = 86400.0
+
+
+def _frames(count : int):
+    bridge = IzziEmulatorBridge(interval=0, frames=count)
+    bridge.connect()
+    return [bytes(bridge.read_message()) for _ in range(count)]
+
+
+def _command_frame(speed : int) -> bytes:
+    frame = bytearray(IZZI_MESSAGE_LENGTH)
+    frame[IZZI_CMD_MSG_ID_INDEX] = IZZI_COMMAND_MESSAGE_ID
+    frame[IZZI_CMD_MSG_SUPPLY_FAN_SPEED_INDEX] = speed
+    return bytes(frame)
+
+
+def test_records_round_trip_into_daily_files(tmp_path):
+    writer = CaptureWriter(str(tmp_path))
+    frames = _frames(3)
+    writer(DAY * 10 + 1.0, CAPTURE_KIND_RX, frames[0])
+    writer(DAY * 10 + 2.0, CAPTURE_KIND_TX, _command_frame(40))
+    writer(DAY * 11 + 1.0, CAPTURE_KIND_RX, frames[1])
+    writer.close()
+    first, second = sorted(os.listdir(tmp_path))
+    assert (first, second) == ("izzi_19700111.cap", "izzi_19700112.cap")
+    records = list(read_capture(str(tmp_path / first)))
+    assert records == [(DAY * 10 + 1.0, CAPTURE_KIND_RX, frames[0]), (DAY * 10 + 2.0, CAPTURE_KIND_TX, _command_frame(40))]
+    assert writer.records == 3
+
+
+def test_torn_record_is_dropped_on_reopen(tmp_path):
+    writer = CaptureWriter(str(tmp_path))
+    frame = _frames(1)[0]
+    writer(1.0, CAPTURE_KIND_RX, frame)
+    writer.close()
+    path = tmp_path / "izzi_19700101.cap"
+    with open(path, "ab") as capture:
+        capture.write(b"\1\2\3")
+    writer(2.0, CAPTURE_KIND_RX, frame)
+    writer.close()
+    assert os.path.getsize(path) == len(CAPTURE_MAGIC) + 2 * CAPTURE_RECORD.size
+    assert [record[0] for record in read_capture(str(path))] == [1.0, 2.0]
+
+
+def test_not_a_capture_file(tmp_path):
+    path = tmp_path / "other.cap"
+    path.write_bytes(b"something else")
+    with pytest.raises(ValueError):
+        list(read_capture(str(path)))
+
+
+def test_export_npz_columns(tmp_path):
+    np = pytest.importorskip("numpy")
+    from izzi.export import export_npz
+    from izzi.decoder import SENSOR_NAMES, decode_status_frame
+    writer = CaptureWriter(str(tmp_path))
+    frames = _frames(5)
+    for position, frame in enumerate(frames):
+        writer(float(position), CAPTURE_KIND_RX, frame)
+    writer(10.0, CAPTURE_KIND_TX, _command_frame(55))
+    writer.close()
+    output = str(tmp_path / "out.npz")
+    export_npz([str(tmp_path / "izzi_19700101.cap")], output)
+    columns = np.load(output)
+    assert list(columns["status_ts"]) == [0.0, 1.0, 2.0, 3.0, 4.0]
+    outdoor = SENSOR_NAMES[IZZY_SENSOR_TEMPERATURE_OUTDOOR_ID]
+    assert list(columns["status_" + outdoor]) == [decode_status_frame(frame)[IZZY_SENSOR_TEMPERATURE_OUTDOOR_ID] for frame in frames]
+    assert list(columns["command_" + SENSOR_NAMES[IZZY_SENSOR_FAN_SUPPLY_SPEED_ID]]) == [55]
@@ -0,0 +1,52 @@
+import asyncio
+import socket
+
+import pytest
+
+pytest.importorskip("homeassistant")
+
+from izzifast import CONF_MODE, CONF_MODE_MASTER, CONF_TYPE_TCP, DEFAULT_NAME
+from izzifast.config_flow import IzzifastConfigFlow, _can_connect
+from homeassistant.const import CONF_HOST, CONF_NAME, CONF_PORT, CONF_TYPE
+
+
+class _Hass(object):
+    async def async_add_executor_job(self, target, *args):
+        return target(*args)
+
+
+def _flow():
+    flow = IzzifastConfigFlow()
+    flow.hass = _Hass()
+    flow.context = {}
+    flow._async_current_entries = lambda *args, **kwargs: []
+    return flow
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_can_connect():
+    with socket.create_server(("127.0.0.1", 0)) as server:
+        assert _can_connect("127.0.0.1", server.getsockname()[1])
+    assert not _can_connect("127.0.0.1", _free_port())
+
+
+def test_unreachable_bridge_shows_error():
+    result = asyncio.run(_flow().async_step_tcp({CONF_HOST: "127.0.0.1", CONF_PORT: _free_port(),
+                                                 CONF_NAME: DEFAULT_NAME, CONF_MODE: CONF_MODE_MASTER}))
+    assert result["step_id"] == "tcp"
+    assert result["errors"] == {"base": "cannot_connect"}
+
+
+def test_reachable_bridge_creates_entry():
+    with socket.create_server(("127.0.0.1", 0)) as server:
+        port = server.getsockname()[1]
+        result = asyncio.run(_flow().async_step_tcp({CONF_HOST: "127.0.0.1", CONF_PORT: port,
+                                                     CONF_NAME: "Attic", CONF_MODE: CONF_MODE_MASTER}))
+    assert result["title"] == "Attic"
+    assert result["data"][CONF_TYPE] == CONF_TYPE_TCP
+    assert result["data"][CONF_PORT] == port
@@ -0,0 +1,71 @@
+from izzi.const import *
+from izzi.controller import IzziController
+from izzi.emulator import IzziEmulatorBridge
+
+
+def _controller(is_master : bool = True):
+    return IzziController(IzziEmulatorBridge(0), is_master)
+
+
+def test_snapshot_round_trip():
+    controller = _controller()
+    controller.set_fan_speed(40, 35)
+    controller.set_bypass_temp(23)
+    snapshot = controller.get_snapshot()
+
+    restored = _controller()
+    assert restored.restore_snapshot(snapshot)
+    assert restored.get_snapshot()["command"] == snapshot["command"]
+    assert restored.state.target[IZZY_SENSOR_BYPASS_TEMP_ID] == 23
+
+
+def test_restore_rejects_command_bytes_out_of_range():
+    controller = _controller()
+    snapshot = controller.get_snapshot()
+    before = list(snapshot["command"])
+    snapshot["command"][IZZI_CMD_MSG_SUPPLY_FAN_SPEED_INDEX] = 300
+    assert not controller.restore_snapshot(snapshot)
+    snapshot["command"][IZZI_CMD_MSG_SUPPLY_FAN_SPEED_INDEX] = -1
+    assert not controller.restore_snapshot(snapshot)
+    assert controller.get_snapshot()["command"] == before
+
+
+def test_restore_skips_invalid_targets():
+    controller = _controller()
+    snapshot = controller.get_snapshot()
+    before = list(controller.state.target)
+    snapshot["targets"] = {"9999": 1, "abc": 2, str(IZZY_SENSOR_TEMPERATURE_SUPPLY_ID): 5,
+                           str(IZZY_SENSOR_BYPASS_TEMP_ID): "hot",
+                           str(IZZY_SENSOR_FAN_SUPPLY_SPEED_ID): 55}
+    assert controller.restore_snapshot(snapshot)
+    expected = list(before)
+    expected[IZZY_SENSOR_FAN_SUPPLY_SPEED_ID] = 55
+    assert list(controller.state.target) == expected
+
+    snapshot["targets"] = ["not", "a", "dict"]
+    assert controller.restore_snapshot(snapshot)
+
+
+def test_preset_switches_all_targets_and_frame():
+    controller = _controller()
+    controller.set_fan_speed(30, 30)
+    assert controller.add_preset("boost", {IZZY_SENSOR_FAN_SUPPLY_SPEED_ID: 90, IZZY_SENSOR_FAN_EXTRACT_SPEED_ID: 80},
+                                 IZZY_SENSOR_VENT_MODE_FIREPLACE)
+    assert controller.get_presets() == ["boost"]
+    assert controller.apply_preset("boost")
+    assert controller.preset == "boost"
+    targets = controller.state.target
+    assert targets[IZZY_SENSOR_FAN_SUPPLY_SPEED_ID] == 90
+    assert targets[IZZY_SENSOR_VENT_MODE_ID] == IZZY_SENSOR_VENT_MODE_FIREPLACE
+    frame = controller.get_snapshot()["command"]
+    assert frame[IZZI_CMD_MSG_SUPPLY_FAN_SPEED_INDEX] == 90
+    # Fireplace mode lowers the extract fan
+    assert frame[IZZI_CMD_MSG_EXTRACT_FAN_SPEED_INDEX] == int(80 * 0.8)
+
+
+def test_invalid_presets_are_rejected():
+    controller = _controller()
+    assert not controller.add_preset("bad", {IZZY_SENSOR_FAN_SUPPLY_SPEED_ID: 300})
+    assert not controller.add_preset("bad", {}, 99)
+    assert not controller.apply_preset("missing")
+    assert controller.get_presets() == []
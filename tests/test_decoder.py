@@ -0,0 +1,70 @@
+import pytest
+
+from izzi.const import *
+from izzi.decoder import SENSOR_NAMES, decode_status_frame, decode_command_frame, decode_status_frames
+from izzi.emulator import IzziEmulatorBridge
+from izzi.stream import FrameBatcher, decode_frame
+from izzi.capture import CAPTURE_KIND_RX, CAPTURE_KIND_TX, CAPTURE_KIND_CF_SAMPLE
+
+
+def _status_frames(count : int):
+    bridge = IzziEmulatorBridge(interval=0, frames=count)
+    bridge.connect()
+    return [bytes(bridge.read_message()) for _ in range(count)]
+
+
+def test_status_frame_follows_layout():
+    frame = _status_frames(1)[0]
+    values = decode_status_frame(frame)
+    assert set(values) == {sensor_id for sensor_id, index, fmt in IZZI_STATUS_LAYOUT}
+    for sensor_id, index, fmt in IZZI_STATUS_LAYOUT:
+        if fmt == '>B':
+            assert values[sensor_id] == frame[index]
+
+
+def test_command_frame_round_trip():
+    frame = bytearray(IZZI_MESSAGE_LENGTH)
+    frame[IZZI_CMD_MSG_ID_INDEX] = IZZI_COMMAND_MESSAGE_ID
+    frame[IZZI_CMD_MSG_SUPPLY_FAN_SPEED_INDEX] = 45
+    frame[IZZI_CMD_MSG_BYPASS_TEMP_INDEX] = 22
+    values = decode_command_frame(frame)
+    assert values[IZZY_SENSOR_FAN_SUPPLY_SPEED_ID] == 45
+    assert values[IZZY_SENSOR_BYPASS_TEMP_ID] == 22
+
+
+def test_batch_decoder_matches_live_decoder():
+    pytest.importorskip("numpy")
+    frames = _status_frames(50)
+    decoded = decode_status_frames(b''.join(frames))
+    assert len(decoded) == 50
+    for position, frame in enumerate(frames):
+        for sensor_id, value in decode_status_frame(frame).items():
+            assert decoded[SENSOR_NAMES[sensor_id]][position] == value
+
+
+def test_batch_decoder_checks_message_id():
+    pytest.importorskip("numpy")
+    frame = bytearray(_status_frames(1)[0])
+    frame[IZZI_STATUS_MSG_ID_INDEX] = IZZI_COMMAND_MESSAGE_ID
+    with pytest.raises(ValueError):
+        decode_status_frames(bytes(frame))
+
+
+def test_frame_batcher_decodes_on_take():
+    batcher = FrameBatcher(limit=2)
+    frames = _status_frames(3)
+    batcher(1.0, CAPTURE_KIND_CF_SAMPLE, frames[0])
+    for position, frame in enumerate(frames):
+        batcher(float(position), CAPTURE_KIND_RX, frame)
+    batch = batcher.take()
+    # Oldest frame dropped by the limit, CF samples are not frames
+    assert [entry["ts"] for entry in batch] == [1.0, 2.0]
+    assert batch[0]["type"] == "status"
+    assert batch[0]["values"] == {SENSOR_NAMES[sensor_id]: value for sensor_id, value in decode_status_frame(frames[1]).items()}
+    assert batcher.take() == []
+
+
+def test_unknown_frame_is_passed_raw():
+    frame = bytes(IZZI_MESSAGE_LENGTH)
+    decoded = decode_frame(5.0, CAPTURE_KIND_TX, frame)
+    assert decoded == {"ts": 5.0, "direction": "tx", "type": "unknown", "raw": frame.hex()}
@@ -0,0 +1,63 @@
+from izzi.const import *
+from izzi.controller import CfController
+from izzi.derived import DerivedSensor, DerivedSensorEngine, airflow, create_derived_sensors
+from izzi.state import IzziStateTable
+
+
+def test_airflow_interpolates_and_clamps():
+    curve = ((0, 0.0), (50, 100.0), (100, 300.0))
+    assert airflow(curve, 25) == 50.0
+    assert airflow(curve, 75) == 200.0
+    assert airflow(curve, -5) == 0.0
+    assert airflow(curve, 120) == 300.0
+
+
+def test_only_affected_sensors_recompute():
+    calls = []
+    engine = DerivedSensorEngine()
+    engine.add(DerivedSensor(10, (1,), lambda current: calls.append(10) or current[1] * 2))
+    engine.add(DerivedSensor(11, (2,), lambda current: calls.append(11) or current[2] * 3))
+    state = IzziStateTable()
+    state.set_current(1, 4)
+    assert engine.update(state) == 1
+    assert calls == [10]
+    assert state.current[10] == 8
+    assert engine.update(state) == 0
+
+
+def test_chained_sensors_follow_their_inputs():
+    engine = DerivedSensorEngine()
+    engine.add(DerivedSensor(10, (1,), lambda current: current[1] + 1))
+    engine.add(DerivedSensor(11, (10,), lambda current: current[10] * 10))
+    state = IzziStateTable()
+    state.set_current(1, 1)
+    assert engine.update(state) == 2
+    assert state.current[11] == 20
+
+
+def test_efficiency_delta_and_power():
+    engine = create_derived_sensors(CfController(), ((0, 0.0), (100, 360.0)))
+    state = IzziStateTable()
+    state.set_current(IZZY_SENSOR_TEMPERATURE_OUTDOOR_ID, 0.0)
+    state.set_current(IZZY_SENSOR_TEMPERATURE_SUPPLY_ID, 16.0)
+    state.set_current(IZZY_SENSOR_TEMPERATURE_EXTRACT_ID, 20.0)
+    state.set_current(IZZY_SENSOR_FAN_SUPPLY_SPEED_ID, 50)
+    state.set_current(IZZY_SENSOR_UNIT_STATE_ID, IZZY_CMD_UNIT_STATE_ON)
+    engine.update(state)
+    assert state.current[IZZY_SENSOR_EFFICIENCY_ID] == 80
+    assert state.current[IZZY_SENSOR_TEMPERATURE_DELTA_ID] == 16.0
+    # 180 m3/h at 50 %
+    assert state.current[IZZY_SENSOR_RECOVERED_POWER_ID] == round(IZZY_AIR_HEAT_CAPACITY * 0.05 * 16.0)
+
+    state.set_current(IZZY_SENSOR_UNIT_STATE_ID, IZZY_CMD_UNIT_STATE_ON + 1)
+    engine.update(state)
+    assert state.current[IZZY_SENSOR_RECOVERED_POWER_ID] == 0
+
+
+def test_missing_inputs_give_none():
+    engine = create_derived_sensors(CfController())
+    state = IzziStateTable()
+    state.set_current(IZZY_SENSOR_TEMPERATURE_OUTDOOR_ID, 5.0)
+    engine.update(state)
+    assert state.current[IZZY_SENSOR_EFFICIENCY_ID] is None
+    assert state.current[IZZY_SENSOR_TEMPERATURE_DELTA_ID] is None
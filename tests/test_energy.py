@@ -0,0 +1,38 @@
+import pytest
+
+from izzi.energy import RecoveredEnergyIntegrator
+
+
+def test_trapezoidal_integration_splits_heat_and_cooling():
+    energy = RecoveredEnergyIntegrator(publish_interval=0.0)
+    energy.update(0.0, 1000.0)
+    energy.update(36.0, 1000.0)
+    assert energy.heat_kwh == pytest.approx(0.01)
+    energy.update(72.0, -1000.0)
+    # Half of the interval on each side of zero
+    assert energy.heat_kwh == pytest.approx(0.015)
+    assert energy.cool_kwh == pytest.approx(0.005)
+
+
+def test_gaps_are_not_integrated():
+    energy = RecoveredEnergyIntegrator()
+    energy.update(0.0, 1000.0)
+    energy.update(RecoveredEnergyIntegrator.MAX_SAMPLE_GAP + 1.0, 1000.0)
+    assert energy.heat_kwh == 0.0
+
+
+def test_missing_power_restarts_integration():
+    energy = RecoveredEnergyIntegrator()
+    energy.update(0.0, 1000.0)
+    assert not energy.update(1.0, None)
+    energy.update(2.0, 1000.0)
+    assert energy.heat_kwh == 0.0
+    energy.update(3.6, 1000.0)
+    assert energy.heat_kwh == pytest.approx(1000.0 * 1.6 / 3600000.0)
+
+
+def test_publish_interval():
+    energy = RecoveredEnergyIntegrator(publish_interval=60.0)
+    assert energy.update(0.0, 100.0)
+    assert not energy.update(30.0, 100.0)
+    assert energy.update(60.0, 100.0)
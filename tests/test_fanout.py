@@ -0,0 +1,64 @@
+import socket
+import time
+
+from izzi.capture import CAPTURE_KIND_RX, CAPTURE_KIND_TX, CAPTURE_KIND_CF_SAMPLE
+from izzi.fanout import FrameFanout
+
+
+def _wait(condition, timeout : float = 2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def _connect(fanout):
+    client = socket.create_connection(fanout._server.getsockname()[:2], timeout=2.0)
+    return client
+
+
+def _recv(client, size : int) -> bytes:
+    data = b''
+    while len(data) < size:
+        chunk = client.recv(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def test_frames_reach_every_subscriber():
+    fanout = FrameFanout(("127.0.0.1", 0))
+    fanout.start()
+    try:
+        clients = [_connect(fanout), _connect(fanout)]
+        assert _wait(lambda: fanout.subscriber_count() == 2)
+        fanout(1.0, CAPTURE_KIND_RX, b'\x01' * 15)
+        fanout(1.0, CAPTURE_KIND_CF_SAMPLE, b'\x09' * 15)
+        fanout(2.0, CAPTURE_KIND_TX, b'\x02' * 15)
+        for client in clients:
+            assert _recv(client, 30) == b'\x01' * 15 + b'\x02' * 15
+        assert fanout.frames == 2
+
+        clients[0].close()
+        assert _wait(lambda: fanout.subscriber_count() == 1)
+        clients[1].close()
+    finally:
+        fanout.stop()
+
+
+def test_subscriber_over_buffer_limit_is_dropped():
+    fanout = FrameFanout(("127.0.0.1", 0), max_pending=0)
+    fanout.start()
+    try:
+        client = _connect(fanout)
+        assert _wait(lambda: fanout.subscriber_count() == 1)
+        fanout(1.0, CAPTURE_KIND_RX, b'\x01' * 15)
+        assert _wait(lambda: fanout.dropped == 1)
+        assert fanout.subscriber_count() == 0
+        assert client.recv(15) == b''
+        client.close()
+    finally:
+        fanout.stop()
@@ -0,0 +1,70 @@
+import pytest
+
+from izzi.cfinput import cf_expected_param, CF_CHANNEL_SUPPLY, CF_CHANNEL_EXTRACT
+from izzi.filterload import FilterLoadEstimator, FilterLoadMonitor, SECONDS_PER_DAY
+
+PARAMS_MAX = 120.0
+
+
+def _feed(monitor, days : int, rise_per_day : float):
+    """Four samples a day at alternating speeds, residual rising linearly."""
+    for day in range(days):
+        for step, speed in enumerate((30, 50, 70, 90)):
+            ts = (day + step / 4.0) * SECONDS_PER_DAY
+            residual = rise_per_day * ts / SECONDS_PER_DAY
+            monitor.set_speeds(speed, speed)
+            for channel in (CF_CHANNEL_SUPPLY, CF_CHANNEL_EXTRACT):
+                monitor.add_sample(ts, channel, cf_expected_param(PARAMS_MAX, speed) + residual * PARAMS_MAX / 100.0)
+
+
+def test_estimator_finds_slope_independent_of_speed():
+    estimator = FilterLoadEstimator(half_life_days=1000.0)
+    for day in range(20):
+        for speed in (30, 60, 90):
+            estimator.add(day * SECONDS_PER_DAY, speed, 2.0 + 0.05 * speed + 0.5 * day)
+    assert estimator.slope() == pytest.approx(0.5, rel=1e-3)
+
+
+def test_no_slope_until_enough_samples():
+    estimator = FilterLoadEstimator()
+    for day in range(5):
+        estimator.add(day * SECONDS_PER_DAY, 50, 1.0)
+    assert estimator.slope() is None
+
+
+def test_monitor_load_and_days_left():
+    monitor = FilterLoadMonitor(PARAMS_MAX, replace_residual=25.0, half_life_days=1000.0)
+    _feed(monitor, 30, 0.5)
+    load, days = monitor.estimate(30 * SECONDS_PER_DAY)
+    # 15 of 25 percent risen, 10 more at half a percent a day
+    assert load == pytest.approx(60.0, abs=1.0)
+    assert days == pytest.approx(20, abs=1)
+
+
+def test_state_round_trip_and_reset():
+    monitor = FilterLoadMonitor(PARAMS_MAX, half_life_days=1000.0)
+    _feed(monitor, 10, 1.0)
+    restored = FilterLoadMonitor(PARAMS_MAX, half_life_days=1000.0)
+    restored.set_state(monitor.get_state())
+    assert restored.estimate(10 * SECONDS_PER_DAY) == monitor.estimate(10 * SECONDS_PER_DAY)
+
+    restored.reset(10 * SECONDS_PER_DAY)
+    assert restored.estimate(11 * SECONDS_PER_DAY) == (None, None)
+
+
+def test_invalid_state_is_rejected():
+    monitor = FilterLoadMonitor(PARAMS_MAX)
+    state = monitor.get_state()
+    state["estimators"][0]["xx"] = [[0.0, 0.0]]
+    with pytest.raises(ValueError):
+        monitor.set_state(state)
+
+
+def test_samples_ignored_without_speed_or_params_max():
+    monitor = FilterLoadMonitor(0.0)
+    monitor.set_speeds(50, 50)
+    monitor.add_sample(0.0, CF_CHANNEL_SUPPLY, 10.0)
+    assert monitor.reset_ts is None
+    monitor = FilterLoadMonitor(PARAMS_MAX)
+    monitor.add_sample(0.0, CF_CHANNEL_SUPPLY, 10.0)
+    assert monitor.reset_ts is None
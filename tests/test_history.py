@@ -0,0 +1,35 @@
+from izzi.history import SensorHistory
+
+
+def _filled(samples : int, raw_capacity : int = SensorHistory.RAW_CAPACITY):
+    history = SensorHistory(raw_capacity)
+    start = 1000000.0
+    for second in range(samples):
+        history.add(start + second, float(second))
+    return history, start + samples - 1
+
+
+def test_partial_window_uses_raw_points():
+    history, now = _filled(600)
+    resolution, points = history.query(now - 3600, now)
+    assert resolution == "raw"
+    assert len(points) == 600
+
+
+def test_raw_covering_window_uses_raw_points():
+    history, now = _filled(1800)
+    resolution, points = history.query(now - 900, now)
+    assert resolution == "raw"
+    assert len(points) == 901
+
+
+def test_finest_tier_reaching_start_is_used():
+    history, now = _filled(7200, raw_capacity=600)
+    resolution, points = history.query(now - 3600, now)
+    assert resolution == "1m"
+    assert len(points) == 61
+
+
+def test_empty_history():
+    history = SensorHistory()
+    assert history.query(0.0, 100.0) == ("1h", [])
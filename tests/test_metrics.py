@@ -0,0 +1,56 @@
+import urllib.request
+
+import pytest
+
+from izzi.const import *
+from izzi.capture import CAPTURE_KIND_RX, CAPTURE_KIND_TX
+from izzi.controller import IzziController
+from izzi.decoder import SENSOR_NAMES
+from izzi.emulator import IzziEmulatorBridge
+from izzi.metrics import ControllerMetrics, MetricsServer
+
+
+def _metrics(labels=None):
+    controller = IzziController(IzziEmulatorBridge(0), True)
+    return controller, ControllerMetrics(controller, labels)
+
+
+def test_sensor_text_is_rendered_only_after_changes():
+    controller, metrics = _metrics()
+    controller.state.set_current(IZZY_SENSOR_TEMPERATURE_OUTDOOR_ID, 4.5)
+    body = metrics.body().decode()
+    assert 'izzi_sensor{sensor="%s"} 4.5\n' % SENSOR_NAMES[IZZY_SENSOR_TEMPERATURE_OUTDOOR_ID] in body
+    metrics.body()
+    assert (metrics.renders, metrics.scrapes) == (1, 2)
+    controller.state.set_current(IZZY_SENSOR_TEMPERATURE_OUTDOOR_ID, 5.0)
+    assert "} 5.0\n" in metrics.body().decode()
+    assert metrics.renders == 2
+
+
+def test_counters_and_labels():
+    controller, metrics = _metrics({"unit": "attic"})
+    metrics(0.0, CAPTURE_KIND_RX, b'')
+    metrics(0.0, CAPTURE_KIND_RX, b'')
+    metrics(0.0, CAPTURE_KIND_TX, b'')
+    controller.set_fan_speed(40, 40)
+    text = metrics.render()
+    assert 'izzi_frames_total{direction="rx",unit="attic"} 2' in text
+    assert 'izzi_frames_total{direction="tx",unit="attic"} 1' in text
+    assert 'izzi_setpoint{sensor="%s",unit="attic"} 40' % SENSOR_NAMES[IZZY_SENSOR_FAN_SUPPLY_SPEED_ID] in text
+    assert 'izzi_connected{unit="attic"} 0' in text
+
+
+def test_server_serves_metrics_path_only():
+    controller, metrics = _metrics()
+    server = MetricsServer(("127.0.0.1", 0), metrics)
+    server.start()
+    try:
+        host, port = server._server.server_address[:2]
+        with urllib.request.urlopen("http://%s:%d/metrics" % (host, port), timeout=2) as response:
+            assert response.headers["Content-Type"].startswith("text/plain")
+            assert b"izzi_published_total" in response.read()
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen("http://%s:%d/other" % (host, port), timeout=2)
+        assert error.value.code == 404
+    finally:
+        server.stop()
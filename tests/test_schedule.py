@@ -0,0 +1,36 @@
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+from izzi.schedule import IzziSchedule, week_second, SECONDS_PER_DAY
+
+BERLIN = ZoneInfo("Europe/Berlin")
+
+
+def _schedule():
+    # Weekdays day at 07:00, every evening night at 22:00
+    entries = [(weekday, 7 * 3600, "day") for weekday in range(7)]
+    entries += [(weekday, 22 * 3600, "night") for weekday in range(7)]
+    return IzziSchedule(entries, BERLIN)
+
+
+def test_transition_is_due_once():
+    schedule = _schedule()
+    assert schedule.due(6 * 3600, 7 * 3600 + 5) == "day"
+    assert schedule.due(7 * 3600 + 5, 7 * 3600 + 10) is None
+
+
+def test_week_wrap():
+    schedule = _schedule()
+    sunday_late = 6 * SECONDS_PER_DAY + 23 * 3600
+    assert schedule.due(sunday_late, 60.0) is None
+    assert schedule.due(sunday_late, 7 * 3600 + 1) == "day"
+
+
+def test_daylight_saving_fall_back_is_not_a_week_wrap():
+    schedule = _schedule()
+    # 2023-10-29 02:59:59 CEST, two seconds later it is 02:00:01 CET
+    before = datetime(2023, 10, 29, 0, 59, 59, tzinfo=timezone.utc).timestamp()
+    last = week_second(before, BERLIN)
+    second = week_second(before + 2, BERLIN)
+    assert (last, second) == (529199, 525601)
+    assert schedule.due(last, second) is None
@@ -0,0 +1,90 @@
+from izzi.const import *
+from izzi.state import IzziStateTable, PublishPolicy
+
+SENSOR = IZZY_SENSOR_TEMPERATURE_SUPPLY_ID
+
+
+def _collect(table, now=None):
+    published = []
+    table.publish(lambda sensor_id, value: published.append((sensor_id, value)), now)
+    return published
+
+
+def test_publishes_only_changed_sensors():
+    table = IzziStateTable()
+    assert table.set_current(SENSOR, 20.0)
+    assert not table.set_current(SENSOR, 20.0)
+    assert _collect(table) == [(SENSOR, 20.0)]
+    assert _collect(table) == []
+    assert table.published[SENSOR] == 20.0
+
+
+def test_force_update_republishes():
+    table = IzziStateTable()
+    table.set_current(SENSOR, 20.0)
+    _collect(table)
+    table.force_update(SENSOR)
+    assert _collect(table) == [(SENSOR, 20.0)]
+
+
+def test_internal_sensors_are_not_published():
+    table = IzziStateTable(internal=(IZZY_SENSOR_CF_STATE_ID,))
+    table.set_current(IZZY_SENSOR_CF_STATE_ID, 3)
+    assert _collect(table) == []
+    assert table.take_changed() & (1 << IZZY_SENSOR_CF_STATE_ID)
+
+
+def test_version_counts_changes():
+    table = IzziStateTable()
+    table.set_current(SENSOR, 1)
+    table.set_current(SENSOR, 1)
+    table.set_published(IZZY_SENSOR_FAN_MODE_ID, 2)
+    assert table.version == 2
+
+
+def test_deadband_suppresses_small_changes():
+    table = IzziStateTable()
+    table.set_policy(SENSOR, PublishPolicy(deadband=0.5))
+    table.set_current(SENSOR, 20.0)
+    assert _collect(table, 0.0) == [(SENSOR, 20.0)]
+    table.set_current(SENSOR, 20.3)
+    assert _collect(table, 1.0) == []
+    table.set_current(SENSOR, 20.6)
+    assert _collect(table, 2.0) == [(SENSOR, 20.6)]
+    assert table.suppressed_count == 1
+
+
+def test_hysteresis_on_direction_change():
+    table = IzziStateTable()
+    table.set_policy(SENSOR, PublishPolicy(hysteresis=0.3))
+    table.set_current(SENSOR, 20.0)
+    _collect(table, 0.0)
+    table.set_current(SENSOR, 20.5)
+    assert _collect(table, 1.0) == [(SENSOR, 20.5)]
+    table.set_current(SENSOR, 20.3)
+    assert _collect(table, 2.0) == []
+    table.set_current(SENSOR, 20.1)
+    assert _collect(table, 3.0) == [(SENSOR, 20.1)]
+
+
+def test_min_interval_defers_and_counts_once():
+    table = IzziStateTable()
+    table.set_policy(SENSOR, PublishPolicy(min_interval=10.0))
+    table.set_current(SENSOR, 20.0)
+    assert _collect(table, 100.0) == [(SENSOR, 20.0)]
+    table.set_current(SENSOR, 21.0)
+    assert _collect(table, 101.0) == []
+    # The held back value is evaluated again without being counted again
+    assert _collect(table, 102.0) == []
+    assert table.suppressed_count == 1
+    assert _collect(table, 110.0) == [(SENSOR, 21.0)]
+
+
+def test_max_interval_heartbeat():
+    table = IzziStateTable()
+    table.set_policy(SENSOR, PublishPolicy(max_interval=60.0))
+    table.set_current(SENSOR, 20.0)
+    start = table._next_heartbeat
+    assert _collect(table, start) == [(SENSOR, 20.0)]
+    assert _collect(table, start + 30.0) == []
+    assert _collect(table, start + 60.0) == [(SENSOR, 20.0)]
@@ -0,0 +1,157 @@
+import multiprocessing
+import queue
+import threading
+import time
+
+import pytest
+
+from izzi.emulator import IzziEmulatorBridge
+from izzi.state import IzziStateTable
+from izzi.worker import (_SharedBlock, IzziProcessController, HEADER_SEQ, HEADER_HEAD, HEADER_WRITTEN,
+                         RING_SLOTS, OP_FAN_SPEED, OP_PRESET, VALUE, VALUE_FLOAT, VALUE_INT)
+
+
+def _block():
+    return _SharedBlock(bytearray(_SharedBlock.length()), threading.Lock())
+
+
+def test_publish_increments_version():
+    block = _block()
+    block.publish(3, 20.5)
+    block.publish(4, 7)
+    version, kinds, values = block.snapshot()
+    assert version == 2
+    assert (kinds[3], values[3]) == (VALUE_FLOAT, 20.5)
+    assert (kinds[4], values[4]) == (VALUE_INT, 7.0)
+
+
+def test_snapshot_waits_for_writer_holding_the_lock():
+    block = _block()
+    block.publish(2, 7)
+    block.lock.acquire()
+    # A writer half way through: kind written, value not yet
+    block.buf[block.kinds_offset + 2] = VALUE_FLOAT
+    snapshots = []
+    reader = threading.Thread(target=lambda: snapshots.append(block.snapshot()))
+    reader.start()
+    time.sleep(0.05)
+    assert snapshots == []
+    VALUE.pack_into(block.buf, block.values_offset + 2 * VALUE.size, 7.5)
+    block.put(HEADER_SEQ, block.get(HEADER_SEQ) + 1)
+    block.lock.release()
+    reader.join()
+    version, kinds, values = snapshots[0]
+    assert (version, kinds[2], values[2]) == (2, VALUE_FLOAT, 7.5)
+
+
+def test_ring_rejects_when_full_and_wraps():
+    block = _block()
+    for slot in range(RING_SLOTS):
+        assert block.push(OP_FAN_SPEED, slot, 0.0) == slot + 1
+    assert block.push(OP_FAN_SPEED, 999, 0.0) == 0
+
+    commands = block.take_commands(0)
+    assert [command[0] for command in commands] == list(range(1, RING_SLOTS + 1))
+    assert commands[-1][2] == RING_SLOTS - 1
+
+    # Slots are free again and the ring wraps to its first entries
+    for value in range(10):
+        assert block.push(OP_PRESET, value, 1.0) == RING_SLOTS + value + 1
+    commands = block.take_commands(RING_SLOTS)
+    assert commands == [(RING_SLOTS + value + 1, OP_PRESET, value, 1.0) for value in range(10)]
+    assert block.take_commands(RING_SLOTS + 10) == []
+
+
+def _bare_controller():
+    """Process controller without a worker process, only its shared state."""
+    controller = IzziProcessController.__new__(IzziProcessController)
+    controller._block = _block()
+    controller.state = IzziStateTable()
+    controller._stopping = False
+    controller._call_lock = threading.Lock()
+    controller._replies = queue.Queue()
+    controller._call_id = 0
+    controller._waiters = []
+    controller._waiters_lock = threading.Lock()
+    return controller
+
+
+def test_write_waiters_released_by_written_slot():
+    controller = _bare_controller()
+    block = controller._block
+    released = []
+    block.push(OP_FAN_SPEED, 30, 30)
+    controller.add_write_waiter(lambda frame, ts: released.append("first"))
+    block.push(OP_FAN_SPEED, 40, 40)
+    block.push(OP_FAN_SPEED, 50, 50)
+    controller.add_write_waiter(lambda frame, ts: released.append("second"))
+
+    controller._notify_waiters(block.get(HEADER_WRITTEN))
+    assert released == []
+    block.put(HEADER_WRITTEN, 1)
+    controller._notify_waiters(block.get(HEADER_WRITTEN))
+    assert released == ["first"]
+    block.put(HEADER_WRITTEN, block.get(HEADER_HEAD))
+    controller._notify_waiters(block.get(HEADER_WRITTEN))
+    assert released == ["first", "second"]
+    assert controller._waiters == []
+
+
+def test_pending_call_fails_when_worker_exits():
+    controller = _bare_controller()
+    controller._conn, worker_conn = multiprocessing.Pipe()
+    controller._poll_thread = threading.Thread(target=controller._poll_loop, daemon=True)
+    controller._poll_thread.start()
+
+    def worker_dies():
+        worker_conn.recv()
+        worker_conn.close()
+
+    worker = threading.Thread(target=worker_dies)
+    worker.start()
+    started = time.monotonic()
+    with pytest.raises(Exception, match="Worker process exited"):
+        controller.is_cf_enabled()
+    assert time.monotonic() - started < 2.0
+    worker.join()
+    controller._poll_thread.join(2.0)
+    with pytest.raises(Exception, match="Worker process exited"):
+        controller.is_cf_enabled()
+
+
+def test_late_reply_of_timed_out_call_is_dropped(monkeypatch):
+    monkeypatch.setattr("izzi.worker.WORKER_CALL_TIMEOUT", 0.2)
+    controller = _bare_controller()
+    controller._conn, worker_conn = multiprocessing.Pipe()
+    controller._poll_thread = threading.Thread(target=controller._poll_loop, daemon=True)
+    controller._poll_thread.start()
+
+    with pytest.raises(Exception, match="did not answer"):
+        controller.get_cf_shadow_stats()
+    late_id, name, args = worker_conn.recv()
+    worker_conn.send(("result", late_id, {"late": True}))
+
+    def answer():
+        call_id, name, args = worker_conn.recv()
+        worker_conn.send(("result", call_id, False))
+
+    worker = threading.Thread(target=answer)
+    worker.start()
+    assert controller.is_cf_enabled() is False
+    worker.join()
+    controller._stopping = True
+    controller._poll_thread.join(2.0)
+
+
+def test_call_fails_after_worker_killed():
+    controller = IzziProcessController(IzziEmulatorBridge(0.05), True)
+    try:
+        assert controller.is_cf_enabled() is False
+        controller._process.kill()
+        controller._process.join()
+        started = time.monotonic()
+        with pytest.raises(Exception):
+            controller.is_cf_enabled()
+        assert time.monotonic() - started < 2.0
+    finally:
+        controller.disconnect()